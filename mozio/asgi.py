@@ -0,0 +1,18 @@
+"""
+ASGI config for mozio project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+The point query endpoints are served natively by providers.asgi, everything else
+goes through the regular WSGI application. Run it with any ASGI 3 server, e.g.
+
+    uvicorn mozio.asgi:application
+"""
+
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mozio.settings")
+
+from mozio.wsgi import application as wsgi_application  # noqa: E402 sets Django up
+from providers.asgi import QueryApplication  # noqa: E402
+
+application = QueryApplication(wsgi_application)
@@ -45,6 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'providers.middleware.InstrumentationMiddleware',
+    'providers.middleware.ThrottleMiddleware',
+    'providers.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,10 +88,21 @@ DATABASES = {
         'NAME': 'moziotest',
         'USER': 'shouvik',
         'PASSWORD': 'svk*2263',
-        'HOST': 'localhost'
+        'HOST': 'localhost',
+        'CONN_MAX_AGE': 60,  # keep connections open between requests instead of reconnecting every time
     }
 }
 
+# optional read replica, e.g. a second local PostGIS server. Tests read it as a mirror of default
+
+if os.environ.get('REPLICA_DB_HOST'):
+    DATABASES['replica'] = dict(DATABASES['default'], HOST=os.environ['REPLICA_DB_HOST'],
+                                PORT=os.environ.get('REPLICA_DB_PORT', ''),
+                                NAME=os.environ.get('REPLICA_DB_NAME', DATABASES['default']['NAME']),
+                                TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['providers.routers.ReplicaRouter']
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 
@@ -129,9 +143,226 @@ AUTH_PATRON_MODEL = 'providers.Provider'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'providers.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        'providers.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     )
 }
+
+# In-process spatial index answering get_areas without hitting PostGIS, see providers/spatial_index.py
+# CELL_SIZE is the prefilter grid size in degrees, CHECK_INTERVAL how often (seconds) a worker
+# checks CACHE, which all workers have to share, for writes made by other workers
+
+PROVIDERS_SPATIAL_INDEX = {
+    'ENABLED': False,
+    'CELL_SIZE': 0.5,
+    'CHECK_INTERVAL': 1,
+    'CACHE': 'shared',
+}
+
+# Limits for the get_areas/batch/ endpoint
+
+PROVIDERS_BATCH_QUERY = {
+    'MAX_POINTS': 10000,
+}
+
+# Limits for the get_areas/shape/ endpoint, MAX_VERTICES of the posted route or region
+
+PROVIDERS_SHAPE_QUERY = {
+    'MAX_VERTICES': 10000,
+}
+
+# Per-provider unions of the service areas (providers/provider_coverage.py) answering get_providers/,
+# one extra union per PRICE_TIERS price. PRUNE narrows get_areas lookups to the providers whose union
+# may hold the point. Run rebuild_provider_coverage after enabling or changing the tiers
+
+PROVIDERS_PROVIDER_COVERAGE = {
+    'ENABLED': False,
+    'PRICE_TIERS': (),
+    'PRUNE': False,
+}
+
+# Response cache for get_areas, see providers/cache.py
+# PRECISION is the cell size responses are shared across (0.0001 degrees is ~11 m),
+# TILE_SIZE the granularity at which ServiceArea writes invalidate cached cells. Responses are kept in ALIAS,
+# the version tokens the writes replace in VERSION_ALIAS, which has to be shared by all workers
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'get_areas': {
+        'BACKEND': 'providers.cache.LRULocMemCache',
+        'LOCATION': 'get_areas',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'CULL_FREQUENCY': 100,
+        },
+    },
+    # state every worker has to agree on, see providers/checks.py. Set MEMCACHED_LOCATION (host:port) to share it
+    # through memcached; without it each process keeps its own copy, which only suits a single process like runserver
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.environ['MEMCACHED_LOCATION'],
+    } if os.environ.get('MEMCACHED_LOCATION') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+    },
+    # process local half of the token authentication cache, keep TIMEOUT short as other workers
+    # cannot invalidate it
+    'auth_local': {
+        'BACKEND': 'providers.cache.LRULocMemCache',
+        'LOCATION': 'auth_local',
+        'TIMEOUT': 10,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'CULL_FREQUENCY': 100,
+        },
+    },
+}
+
+PROVIDERS_QUERY_CACHE = {
+    'ENABLED': False,
+    'ALIAS': 'get_areas',
+    'VERSION_ALIAS': 'shared',
+    'TIMEOUT': 300,
+    'PRECISION': 0.0001,
+    'TILE_SIZE': 0.1,
+}
+
+# Opt-in keyset pagination and streaming for the provider and area lists
+
+PROVIDERS_PAGINATION = {
+    'PAGE_SIZE': 100,
+    'MAX_PAGE_SIZE': 1000,
+    'STREAM_CHUNK_SIZE': 500,
+}
+
+# Number of records validated and inserted per bulk_create by bulk imports
+
+PROVIDERS_BULK = {
+    'CHUNK_SIZE': 500,
+}
+
+# Token authentication cache, see providers/authentication.py. Writes invalidate tokens in SHARED_ALIAS, which
+# has to be shared by all workers for them to see it before their LOCAL_ALIAS entries expire
+
+PROVIDERS_AUTH_CACHE = {
+    'LOCAL_ALIAS': 'auth_local',
+    'SHARED_ALIAS': 'shared',
+    'TIMEOUT': 300,
+}
+
+# Derived ServiceArea geometries and write-time normalization, see providers/geometry.py
+# BORDER_MARGIN (degrees) is how far inside the edge a point has to be to skip the geography test. Planar
+# copies follow the great circle edges with a point every SEGMENT_LENGTH degrees of arc.
+# Written polygons are simplified within NORMALIZE_TOLERANCE degrees (0 keeps them as sent), rejected
+# above MAX_VERTICES and split into pieces of at most PIECE_VERTICES for point tests
+
+PROVIDERS_GEOMETRY = {
+    'BORDER_MARGIN': 0.001,
+    'SEGMENT_LENGTH': 0.1,
+    'SIMPLIFY_TOLERANCE': 0.0005,
+    'NORMALIZE_TOLERANCE': 0,
+    'MAX_VERTICES': 10000,
+    'PIECE_VERTICES': 256,
+}
+
+# Request instrumentation, see providers/metrics.py. Histograms are served on /api/metrics/ to ALLOWED_IPS
+
+PROVIDERS_METRICS = {
+    'ENABLED': True,
+    'ALLOWED_IPS': ('127.0.0.1',),
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+}
+
+# ASGI point query path, see mozio/asgi.py. POOL_SIZE threads, and so at most POOL_SIZE database
+# connections per process, run the lookups; beyond MAX_PENDING queued lookups requests get a 503. Other paths
+# go through WSGI, with at most STREAM_BUFFER chunks of their body produced ahead of the client
+
+PROVIDERS_ASGI = {
+    'POOL_SIZE': 20,
+    'MAX_PENDING': 10000,
+    'STREAM_BUFFER': 16,
+}
+
+# Read fast path, see providers/renderers.py. VALUES_SERIALIZERS serves the list endpoints from
+# values_list() rows like get_areas; ENCODER "orjson" is faster than "json" but writes tiny/huge floats differently
+
+PROVIDERS_JSON = {
+    'ENCODER': 'json',
+    'VALUES_SERIALIZERS': True,
+}
+
+# Coverage grid for get_areas, see providers/coverage.py. RESOLUTION is the cell size in degrees, areas
+# spanning more than MAX_CELLS_PER_AREA cells are left untiled and always tested exactly.
+# Run "manage.py rebuild_coverage_tiles" after enabling the grid or changing it
+
+PROVIDERS_COVERAGE_TILES = {
+    'ENABLED': False,
+    'RESOLUTION': 0.05,
+    'MAX_CELLS_PER_AREA': 4096,
+}
+
+# Read replicas, see providers/routers.py. Replicas leave rotation when unreachable or more than MAX_LAG
+# seconds behind; clients that wrote read from default for PIN_SECONDS, pinned in PIN_CACHE which all workers share
+
+PROVIDERS_REPLICAS = {
+    'ALIASES': tuple(alias for alias in DATABASES if alias != 'default'),
+    'MAX_LAG': 5,
+    'CHECK_INTERVAL': 5,
+    'PIN_SECONDS': 5,
+    'PIN_CACHE': 'shared',
+}
+
+# Change feed, see providers/changes.py. Every Provider and ServiceArea write is logged while ENABLED,
+# /api/changes/ serves PAGE_SIZE changes per request by default to ALLOWED_IPS and KEEP_DAYS is how long
+# "manage.py prune_changes" keeps them
+
+PROVIDERS_CHANGES = {
+    'ENABLED': True,
+    'PAGE_SIZE': 1000,
+    'MAX_PAGE_SIZE': 10000,
+    'ALLOWED_IPS': ('127.0.0.1',),
+    'KEEP_DAYS': 7,
+}
+
+# Rate limits and load shedding for the query endpoints, see providers/throttling.py. CLASSES are the
+# priority classes: RATE requests per second with bursts of BURST per client, shed with a 503 once the load
+# reaches SHED_AT. Load 1.0 is MAX_IN_FLIGHT requests in a process or MAX_DB_LATENCY seconds per SQL query.
+# The buckets are kept in CACHE, which has to be shared by all workers: the app refuses to load with
+# throttling enabled on a process local cache
+
+PROVIDERS_THROTTLE = {
+    'ENABLED': False,
+    'CACHE': 'shared',
+    'LEASE': 1,
+    'INTERNAL_IPS': (),
+    'CLASSES': {
+        'internal': {'RATE': None, 'SHED_AT': None},
+        'token': {'RATE': 50, 'BURST': 100, 'SHED_AT': 1.0},
+        'anon': {'RATE': 10, 'BURST': 20, 'SHED_AT': 0.8},
+    },
+    'MAX_IN_FLIGHT': 64,
+    'MAX_DB_LATENCY': 0.5,
+    'LATENCY_WINDOW': 5,
+    'SHED_RETRY_AFTER': 1,
+}
+
+# Quote mode of get_areas, see providers/queries.py: the "limit" cheapest areas, DEFAULT_LIMIT when only
+# "currency" or "language" is sent
+
+PROVIDERS_QUOTE = {
+    'DEFAULT_LIMIT': 5,
+    'MAX_LIMIT': 100,
+}
+
+# Query plan guard, see providers/query_plans.py and the check_query_plans command: sequential scans are
+# flagged on tables of SEQ_SCAN_ROWS rows or more, plans costing over COST_FACTOR times their baseline as regressions
+
+PROVIDERS_QUERY_PLANS = {
+    'SEQ_SCAN_ROWS': 10000,
+    'COST_FACTOR': 2.0,
+}
@@ -0,0 +1,38 @@
+"""
+Settings for query workers, processes serving only the read-only point query endpoints
+(get_areas and its batch, shape and trip variants) and the metrics endpoint. Run them with
+
+    DJANGO_SETTINGS_MODULE=mozio.settings_query gunicorn mozio.wsgi
+    DJANGO_SETTINGS_MODULE=mozio.settings_query uvicorn mozio.asgi:application
+
+Everything else comes from mozio.settings. The admin, sessions, messages, static files and API docs
+apps are left out together with their middleware, so a worker imports and sets up less before its
+first request; "manage.py benchmark_startup" compares the two profiles.
+"""
+from mozio.settings import *  # noqa: F401,F403
+
+# auth and authtoken stay installed: providers are auth users and their tokens are kept in sync by signals
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.gis',
+    'providers',
+    'rest_framework',
+    'rest_framework.authtoken',
+    'rest_framework_gis',
+]
+
+MIDDLEWARE = [
+    'providers.middleware.InstrumentationMiddleware',
+    'providers.middleware.ThrottleMiddleware',
+    'providers.middleware.ReplicaRoutingMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+ROOT_URLCONF = 'mozio.urls_query'
+
+# the query endpoints are anonymous, skip the token lookup for requests that send one anyway
+
+REST_FRAMEWORK = dict(REST_FRAMEWORK, DEFAULT_AUTHENTICATION_CLASSES=())  # noqa: F405
@@ -0,0 +1,6 @@
+"""mozio URL Configuration of query workers, see mozio/settings_query.py"""
+from django.conf.urls import url, include
+
+urlpatterns = [
+    url(r'^api/', include('providers.query_urls')),
+]
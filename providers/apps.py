@@ -1,7 +1,16 @@
 from __future__ import unicode_literals
 
 from django.apps import AppConfig
+from django.core.exceptions import ImproperlyConfigured
 
 
 class ProvidersConfig(AppConfig):
     name = 'providers'
+
+    def ready(self):
+        from providers import checks, signals  # noqa: registering system checks and model signal receivers
+
+        # workers are not started through manage.py, so the system checks alone would not stop them
+        errors = [message for message in checks.check_shared_caches(None) if message.is_serious()]
+        if errors:
+            raise ImproperlyConfigured(errors[0].msg)
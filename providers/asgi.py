@@ -0,0 +1,236 @@
+"""
+Async (ASGI 3) front end for the point query endpoints. Needs Python 3.5+.
+
+get_areas/ and get_areas/batch/ are answered on the event loop, with their database work run on a
+fixed pool of POOL_SIZE threads. Django connections are per thread and persistent (CONN_MAX_AGE),
+so the pool doubles as a bounded connection pool: one process holds at most POOL_SIZE connections
+however many lookups are in flight. Beyond MAX_PENDING queued lookups requests get a 503, and
+providers/throttling.py rate limits and sheds the lookups before they are queued.
+Every other path is handed to the WSGI application on the same pool, its body sent on chunk by chunk
+as the application yields it, at most STREAM_BUFFER chunks ahead of the client.
+"""
+import asyncio
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+from django.utils.six.moves.urllib.parse import parse_qs
+
+from providers import queries, routers, throttling
+from providers.renderers import fast_dumps
+from providers.utils import InvalidArgumentsException, get_setting
+
+QUERY_PATH = '/api/get_areas/'
+BATCH_PATH = '/api/get_areas/batch/'
+
+
+class Overloaded(Exception):
+    pass
+
+
+def _with_connection(func, *args):
+    # same connection housekeeping Django does around every WSGI request
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def _read_only(func, *args):
+    with routers.routing(use_replicas=True):
+        return func(*args)
+
+
+def _wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'REMOTE_ADDR': client[0],
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin1'), value.decode('latin1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def _call_wsgi(application, environ, emit):
+    """
+    Runs the WSGI application, handing emit its (status, headers) and then each chunk of its body as it
+    is produced. Runs on a single pool thread, so the database connection the body is read on stays the same
+    """
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started.append((int(status.split(' ', 1)[0]), headers))
+
+    result = application(environ, start_response)
+    try:
+        for chunk in result:
+            if started:
+                emit(started.pop())
+            if chunk:
+                emit(chunk)
+        if started:
+            emit(started.pop())
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+
+class QueryApplication(object):
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.executor = ThreadPoolExecutor(max_workers=get_setting('PROVIDERS_ASGI', 'POOL_SIZE', 20))
+        self.max_pending = get_setting('PROVIDERS_ASGI', 'MAX_PENDING', 10000)
+        self.pending = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        body = await self.read_body(receive)
+        try:
+            if (scope['path'], scope['method']) in ((QUERY_PATH, 'GET'), (BATCH_PATH, 'POST')):
+                rejection = self.throttle(scope)
+                if rejection is not None:
+                    await self.respond(send, rejection.status, [
+                        ('Content-Type', 'application/json'),
+                        ('Retry-After', throttling.retry_after_header(rejection)),
+                    ], fast_dumps({'detail': rejection.detail}))
+                    return
+            if scope['path'] == QUERY_PATH and scope['method'] == 'GET':
+                params = parse_qs(scope.get('query_string', b'').decode('latin1'))
+                lat, lng = queries.parse_point(params.get('lat', [None])[0], params.get('lng', [None])[0])
+                quote = queries.parse_quote(params.get('limit', [None])[0], params.get('currency', [None])[0],
+                                            params.get('language', [None])[0])
+                await self.respond_json(send, 200, await self.run(_read_only, queries.areas_for_point, lat, lng, quote))
+            elif scope['path'] == BATCH_PATH and scope['method'] == 'POST':
+                points = queries.parse_points(self.parse_json(body))
+                await self.respond_json(send, 200, await self.run(_read_only, queries.areas_for_points, points))
+            else:
+                await self.respond_wsgi(send, _wsgi_environ(scope, body))
+        except InvalidArgumentsException as exc:
+            await self.respond_json(send, 400, {'detail': exc.detail})
+        except Overloaded:
+            await self.respond_json(send, 503, {'detail': 'Too many pending lookups'})
+
+    def throttle(self, scope):
+        if not throttling.is_enabled():
+            return None
+        authorization = None
+        for name, value in scope.get('headers', []):
+            if name.lower() == b'authorization':
+                authorization = value.decode('latin1')
+        client = scope.get('client') or ('', 0)
+        return throttling.check(client[0], authorization, self.pending / float(self.max_pending))
+
+    def parse_json(self, body):
+        try:
+            return json.loads(body.decode('utf-8'))
+        except ValueError:
+            raise InvalidArgumentsException
+
+    async def run(self, func, *args):
+        if self.pending >= self.max_pending:
+            raise Overloaded
+        self.pending += 1
+        try:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.executor, _with_connection, func, *args)
+        finally:
+            self.pending -= 1
+
+    async def read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                return b''.join(chunks)
+
+    async def respond_wsgi(self, send, environ):
+        loop = asyncio.get_event_loop()
+        messages = asyncio.Queue(maxsize=get_setting('PROVIDERS_ASGI', 'STREAM_BUFFER', 16))
+
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(messages.put(message), loop).result()
+
+        async def produce():
+            try:
+                await self.run(_call_wsgi, self.fallback, environ, emit)
+            finally:
+                await messages.put(None)
+
+        producing = asyncio.ensure_future(produce())
+        started = False
+        try:
+            while True:
+                message = await messages.get()
+                if message is None:
+                    break
+                if isinstance(message, tuple):
+                    await self.respond(send, message[0], message[1], None)
+                    started = True
+                else:
+                    await send({'type': 'http.response.body', 'body': message, 'more_body': True})
+        except BaseException:
+            asyncio.ensure_future(self.drain(messages))  # lets the pool thread run to the end of the body
+            raise
+        if started:
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        await producing  # raises Overloaded, or what the application raised
+
+    async def drain(self, messages):
+        while await messages.get() is not None:
+            pass
+
+    async def respond_json(self, send, status, data):
+        await self.respond(send, status, [('Content-Type', 'application/json')], fast_dumps(data))
+
+    async def respond(self, send, status, headers, content):
+        """
+        Sends the response start and, unless content is None, the whole body
+        """
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers],
+        })
+        if content is not None:
+            await send({'type': 'http.response.body', 'body': content})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
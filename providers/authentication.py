@@ -0,0 +1,99 @@
+from django.core.cache import caches
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from providers.utils import get_setting
+
+
+class ProviderPrincipal(object):
+    """
+    Lightweight request.user for token authenticated providers, carrying only what the views read
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, name, is_active):
+        self.id = id
+        self.name = name
+        self.is_active = is_active
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return self.name or ''
+
+
+def _local_cache():
+    return caches[get_setting('PROVIDERS_AUTH_CACHE', 'LOCAL_ALIAS', 'default')]
+
+
+def _shared_cache():
+    return caches[get_setting('PROVIDERS_AUTH_CACHE', 'SHARED_ALIAS', 'default')]
+
+
+def _cache_key(key):
+    return 'auth:token:%s' % key
+
+
+def cached_principal(key):
+    """
+    The (id, name, is_active) row cached for the token, an empty tuple for tokens known to be invalid
+    and None when neither cache has it. Never queries the database
+    """
+    cache_key = _cache_key(key)
+    row = _local_cache().get(cache_key)
+    if row is None:
+        row = _shared_cache().get(cache_key)
+    return row
+
+
+def invalidate_token(key):
+    _local_cache().delete(_cache_key(key))
+    _shared_cache().delete(_cache_key(key))
+
+
+def invalidate_user(user_id):
+    for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication resolving the token straight to a ProviderPrincipal, looked up in a process
+    local LRU cache first, then in the shared cache and only then in the database.
+    Entries are dropped from the shared cache when the token, user or provider changes. Other
+    workers' local caches expire after the local cache alias TIMEOUT, keep it short.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = _cache_key(key)
+        local_cache = _local_cache()
+        row = local_cache.get(cache_key)
+        if row is None:
+            shared_cache = _shared_cache()
+            row = shared_cache.get(cache_key)
+            if row is None:
+                row = self.load_principal(key)
+                shared_cache.set(cache_key, row, get_setting('PROVIDERS_AUTH_CACHE', 'TIMEOUT', 300))
+            local_cache.set(cache_key, row)
+
+        if not row:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        principal = ProviderPrincipal(*row)
+        if not principal.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return (principal, key)
+
+    def load_principal(self, key):
+        """
+        Returns (id, name, is_active) for the token's user, or an empty tuple for unknown tokens
+        so misses are cached too
+        """
+        rows = Token.objects.filter(key=key).values_list('user_id', 'user__provider__name', 'user__is_active')
+        for row in rows:
+            return tuple(row)
+        return ()
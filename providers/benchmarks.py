@@ -0,0 +1,307 @@
+"""
+Benchmark harness for the providers API, driven by the benchmark_api management command.
+
+Synthetic providers and square service areas are generated on a grid through the same bulk path
+imports take, then every endpoint in providers.urls, reads and writes, is driven either in-process
+through the test client or over HTTP against a wsgiref server running mozio.wsgi. Latencies and
+query counts cover the requests only, not the rows a scenario creates for them beforehand. Results
+are plain dicts so runs can be saved as JSON and compared against a baseline.
+
+measure_startup(), driven by the benchmark_startup command, times worker cold starts per settings module.
+"""
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils.six.moves.urllib.request import Request, urlopen
+from rest_framework.test import APIClient
+
+from providers.models import Provider, ServiceArea
+from providers.signals import providers_bulk_created, service_areas_bulk_created
+
+AREA_SIZE = 0.05  # degrees, a little over 5 km
+
+
+def generate(area_count, areas_per_provider=100, seed=0, chunk_size=5000):
+    """
+    Creates area_count square areas for area_count / areas_per_provider providers, laid out on a
+    grid around (0, 0) with some random overlap. Returns the providers
+    """
+    rng = random.Random(seed)
+    provider_count = max(1, area_count // areas_per_provider)
+    with transaction.atomic():
+        providers = Provider.objects.bulk_create_with_tokens([
+            Provider(name='Provider %d' % i, email='provider%d@bench.invalid' % i, language='en', currency='USD',
+                     phone_number='+10000000000') for i in range(provider_count)])
+        providers_bulk_created.send(sender=Provider, instances=providers)
+
+    side = int(area_count ** 0.5) + 1
+    areas = []
+    for i in range(area_count):
+        x = (i % side) * AREA_SIZE * 0.8 + rng.uniform(0, AREA_SIZE / 4)
+        y = (i // side) * AREA_SIZE * 0.8 + rng.uniform(0, AREA_SIZE / 4)
+        areas.append(ServiceArea(provider=providers[i % provider_count], name='Area %d' % i,
+                                 price='%.2f' % rng.uniform(5, 100),
+                                 polygon=Polygon.from_bbox((x, y, x + AREA_SIZE, y + AREA_SIZE))))
+        if len(areas) == chunk_size:
+            _create_areas(areas)
+            areas = []
+    _create_areas(areas)
+    return providers
+
+
+def _create_areas(areas):
+    # what providers.bulk.import_areas does per chunk, so pieces, coverage and caches are kept up to date
+    if not areas:
+        return
+    for area in areas:
+        area.update_derived_geometries()
+    with transaction.atomic():
+        ServiceArea.objects.bulk_create(areas)
+        ServiceArea.objects.subdivide([area.pk for area in areas if area.subdivided])
+        service_areas_bulk_created.send(sender=ServiceArea, instances=areas)
+
+
+def random_point(rng, area_count):
+    extent = (int(area_count ** 0.5) + 1) * AREA_SIZE * 0.8
+    return rng.uniform(0, extent), rng.uniform(0, extent)
+
+
+def scenarios(providers, area_count, seed=0):
+    """
+    Returns (name, factory) pairs, one per endpoint. Factories return (method, path, body, content_type, token)
+    """
+    rng = random.Random(seed)
+    provider = providers[0]
+    token = provider.auth_token.key
+    area_id = ServiceArea.objects.filter(provider=provider).values_list('id', flat=True).first()
+    square = {'type': 'Polygon', 'coordinates': [[[0, 0], [0.01, 0], [0.01, 0.01], [0, 0.01], [0, 0]]]}
+    run = uuid.uuid4().hex[:8]  # keeps the emails of created providers unique across runs on a kept database
+    created = [0]
+
+    def new_provider_data():
+        created[0] += 1
+        return {'name': 'Bench', 'email': 'bench-%s-%d@bench.invalid' % (run, created[0]), 'language': 'en',
+                'currency': 'USD', 'phone_number': '+10000000000'}
+
+    def provider_create():
+        return 'POST', '/api/providers/', json.dumps(new_provider_data()), 'application/json', None
+
+    def provider_bulk_create():
+        return ('POST', '/api/providers/', json.dumps([new_provider_data() for _ in range(100)]),
+                'application/json', None)
+
+    def provider_delete():
+        target, = Provider.objects.bulk_create_with_tokens([Provider(**new_provider_data())])
+        return 'DELETE', '/api/providers/%d' % target.pk, None, None, None
+
+    def area_delete():
+        target = ServiceArea.objects.create(provider=provider, name='Bench', price='1', polygon=json.dumps(square))
+        return 'DELETE', '/api/areas/%d' % target.pk, None, None, token
+
+    def areas_import():
+        lines = [json.dumps({'name': 'Bench %d' % i, 'price': '1', 'polygon': square}) for i in range(100)]
+        return 'POST', '/api/areas/bulk/', '\n'.join(lines), 'application/x-ndjson', token
+
+    def point_query():
+        lat, lng = random_point(rng, area_count)
+        return 'GET', '/api/get_areas/?lat=%f&lng=%f' % (lat, lng), None, None, None
+
+    def batch_query():
+        points = [random_point(rng, area_count) for _ in range(100)]
+        return 'POST', '/api/get_areas/batch/', json.dumps(points), 'application/json', None
+
+    return [
+        ('get_areas', point_query),
+        ('get_areas_batch_100', batch_query),
+        ('providers_list_page', lambda: ('GET', '/api/providers/?page_size=100', None, None, None)),
+        ('provider_detail', lambda: ('GET', '/api/providers/%d' % provider.pk, None, None, None)),
+        ('provider_update', lambda: ('PATCH', '/api/providers/%d' % provider.pk,
+                                     json.dumps({'language': 'en'}), 'application/json', None)),
+        ('get_token', lambda: ('POST', '/api/providers/get_token', json.dumps({'email': provider.email}),
+                               'application/json', None)),
+        ('areas_list_page', lambda: ('GET', '/api/areas/?page_size=100', None, None, token)),
+        ('area_detail', lambda: ('GET', '/api/areas/%d' % area_id, None, None, token)),
+        ('area_update', lambda: ('PATCH', '/api/areas/%d' % area_id, json.dumps({'price': '10.00'}),
+                                 'application/json', token)),
+        ('area_create', lambda: ('POST', '/api/areas/', json.dumps({'name': 'Bench', 'price': '1', 'polygon': square}),
+                                 'application/json', token)),
+        ('area_delete', area_delete),
+        ('areas_export', lambda: ('GET', '/api/areas/bulk/?output=ndjson', None, None, token)),
+        ('areas_import_100', areas_import),
+        ('provider_create', provider_create),
+        ('provider_bulk_create_100', provider_bulk_create),
+        ('provider_delete', provider_delete),
+    ]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+def summarize(latencies, queries=None, errors=0):
+    """
+    Throughput is over the time spent in requests, one at a time, leaving out the scenarios' own setup
+    """
+    elapsed = sum(latencies)
+    latencies = sorted(latencies)
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+    if queries is not None:
+        result['queries_per_request'] = queries / float(len(latencies))
+    return result
+
+
+def peak_memory_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage // 1024 if sys.platform == 'darwin' else usage  # bytes on macOS, KB elsewhere
+
+
+def count_queries(func, *args):
+    """
+    Runs func, returning its result and the number of queries it ran on the default connection. The query
+    log keeps only the last queries_limit (9000) queries, so it is emptied first and func has to stay below that
+    """
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as queries:
+        result = func(*args)
+    return result, len(queries)
+
+
+def run_in_process(factory, requests):
+    client = APIClient()
+    latencies, query_count, errors = [], 0, 0
+
+    def send(method, path, body, content_type, token):
+        kwargs = {'data': body, 'content_type': content_type} if body is not None else {}
+        if token:
+            kwargs['HTTP_AUTHORIZATION'] = 'Token ' + token
+        started = time.time()
+        response = getattr(client, method.lower())(path, **kwargs)
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+        latencies.append(time.time() - started)
+        return response
+
+    for _ in range(requests):
+        response, queries = count_queries(send, *factory())
+        query_count += queries
+        errors += response.status_code >= 400
+    return summarize(latencies, query_count, errors)
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class WSGIServer(object):
+    """
+    Serves mozio.wsgi on a free local port from a background thread
+    """
+
+    def __enter__(self):
+        from mozio.wsgi import application
+
+        self.server = make_server('127.0.0.1', 0, application, handler_class=_QuietHandler)
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def run_over_wsgi(base_url, factory, requests):
+    """
+    SQL runs in the server thread on its own connection, so query counts are only reported in-process
+    """
+    latencies = []
+    for _ in range(requests):
+        method, path, body, content_type, token = factory()
+        request = Request(base_url + path, data=body.encode('utf-8') if body is not None else None)
+        request.get_method = lambda: method
+        if content_type:
+            request.add_header('Content-Type', content_type)
+        if token:
+            request.add_header('Authorization', 'Token ' + token)
+        request_started = time.time()
+        urlopen(request).read()  # raises on error responses
+        latencies.append(time.time() - request_started)
+    return summarize(latencies)
+
+
+def compare(results, baseline):
+    """
+    Returns (scenario, metric, baseline, current, change) rows for the metrics both runs have
+    """
+    rows = []
+    for mode, scenario_results in sorted(results['scenarios'].items()):
+        for name, metrics in sorted(scenario_results.items()):
+            previous = baseline.get('scenarios', {}).get(mode, {}).get(name, {})
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput', 'queries_per_request'):
+                if metrics.get(metric) is not None and previous.get(metric):
+                    change = (metrics[metric] - previous[metric]) / previous[metric]
+                    rows.append(('%s/%s' % (mode, name), metric, previous[metric], metrics[metric], change))
+    return rows
+
+
+# Run in a fresh interpreter per measurement, so nothing is imported or set up beforehand
+STARTUP_SCRIPT = """
+import json, os, resource, sys, time
+started = time.time()
+os.environ['DJANGO_SETTINGS_MODULE'] = sys.argv[1]
+import django
+django.setup()
+set_up = time.time()
+from django.core.handlers.wsgi import WSGIHandler
+from django.urls import resolve
+WSGIHandler()
+resolve(sys.argv[2])
+ready = time.time()
+usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    'setup_ms': (set_up - started) * 1000,
+    'ready_ms': (ready - started) * 1000,
+    'modules': len(sys.modules),
+    'gis_modules': len([name for name in sys.modules if name.startswith('django.contrib.gis')]),
+    'peak_memory_kb': usage // 1024 if sys.platform == 'darwin' else usage,
+}))
+"""
+
+
+def measure_startup(settings_module, runs=5, path='/api/get_areas/'):
+    """
+    Median cold start of a worker process under settings_module: django.setup() (setup_ms), then
+    loading the middleware and URLconf the first request needs (ready_ms), with the modules it
+    imported and its peak memory
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT, settings_module, path],
+                                         cwd=settings.BASE_DIR, env=env)
+        samples.append(json.loads(output.decode('utf-8')))
+    return dict((key, sorted(sample[key] for sample in samples)[len(samples) // 2]) for key in samples[0])
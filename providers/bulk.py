@@ -0,0 +1,171 @@
+"""
+Bulk import and export of service areas.
+
+Records are {"name", "price", "polygon"} objects, where polygon is GeoJSON, WKT or hex (E)WKB,
+or GeoJSON Features carrying name and price in their properties. Imports validate records with
+ServiceAreaSerializer in chunks and insert every chunk with a single bulk_create. By default an import
+runs in one transaction and writes nothing when any record is rejected; chunk committed imports
+commit each chunk on its own, skip the rejected records and, when they fail partway, keep the chunks
+committed before the failure (see ImportAborted). Exports write
+the same records back as NDJSON or a GeoJSON FeatureCollection, so a dump can be reloaded as is.
+"""
+import json
+
+from django.db import transaction
+from django.utils import six
+from django.utils.encoding import force_text
+
+from providers.models import ServiceArea
+from providers.pagination import keyset_chunks
+from providers.serializers import ServiceAreaSerializer
+from providers.signals import service_areas_bulk_created
+from providers.utils import dumps_json
+
+FORMATS = ('geojson', 'ndjson')
+
+
+class ImportAborted(Exception):
+    """
+    Raised when a chunk committed import fails partway. created areas were committed before the failure
+    """
+
+    def __init__(self, created, error):
+        super(ImportAborted, self).__init__('%d service areas were committed before the import failed: %s' % (
+            created, error))
+        self.created = created
+
+
+class UnreadableRecord(object):
+    """
+    Stands in for an NDJSON line that is not JSON, so the import rejects that record and goes on
+    """
+
+    def __init__(self, error):
+        self.errors = {'non_field_errors': ['Invalid JSON: %s' % error]}
+
+
+def read_ndjson(lines):
+    for line in lines:
+        try:
+            line = force_text(line).strip()
+            if line:
+                yield json.loads(line)
+        except ValueError as error:  # UnicodeDecodeError and JSONDecodeError are ValueErrors
+            yield UnreadableRecord(error)
+
+
+def read_geojson(stream):
+    data = json.loads(force_text(stream.read()))
+    if isinstance(data, dict):
+        data = data.get('features', [])
+    return iter(data)
+
+
+def read_records(stream, fmt):
+    if fmt == 'ndjson':
+        return read_ndjson(stream)
+    return read_geojson(stream)
+
+
+def to_record(item):
+    if isinstance(item, dict) and item.get('type') == 'Feature':
+        record = dict(item.get('properties') or {})
+        record['polygon'] = item.get('geometry')
+        return record
+    return item
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _import_chunks(provider, records, chunk_size, skip_rejected):
+    """
+    Yields the number of areas created and the errors of each chunk. Once a record was rejected
+    and skip_rejected is off, the following chunks are only validated
+    """
+    rejected = False
+    for chunk in _chunks(enumerate(records), chunk_size):
+        areas, errors = [], []
+        for index, item in chunk:
+            if isinstance(item, UnreadableRecord):
+                errors.append({'index': index, 'errors': item.errors})
+                continue
+            serializer = ServiceAreaSerializer(data=to_record(item))
+            if serializer.is_valid():
+                area = ServiceArea(provider=provider, **serializer.validated_data)
+                area.update_derived_geometries()  # bulk_create skips save()
+                areas.append(area)
+            else:
+                errors.append({'index': index, 'errors': serializer.errors})
+
+        rejected = rejected or bool(errors)
+        if areas and (skip_rejected or not rejected):
+            with transaction.atomic():
+                ServiceArea.objects.bulk_create(areas)
+                ServiceArea.objects.subdivide([area.pk for area in areas if area.subdivided])
+                service_areas_bulk_created.send(sender=ServiceArea, instances=areas)
+            yield len(areas), errors
+        else:
+            yield 0, errors
+
+
+def import_areas(provider, records, chunk_size=500, chunk_commit=False):
+    """
+    Validates and inserts records for the provider. Returns the number of areas created and a
+    list of {"index", "errors"} entries for the records that were rejected. Nothing is created when
+    any record is rejected, unless chunk_commit, which commits each chunk of valid records on its own
+    and raises ImportAborted when it fails partway
+    """
+    created, errors = 0, []
+    if chunk_commit:
+        try:
+            for chunk_created, chunk_errors in _import_chunks(provider, records, chunk_size, skip_rejected=True):
+                created += chunk_created
+                errors += chunk_errors
+        except Exception as error:
+            six.raise_from(ImportAborted(created, error), error)
+        return created, errors
+
+    with transaction.atomic():
+        for chunk_created, chunk_errors in _import_chunks(provider, records, chunk_size, skip_rejected=False):
+            created += chunk_created
+            errors += chunk_errors
+        if errors:
+            transaction.set_rollback(True)
+            created = 0
+    return created, errors
+
+
+def _polygon(area, wkb):
+    if wkb:
+        return force_text(area.polygon.hexewkb)
+    return json.loads(area.polygon.geojson)
+
+
+def export_areas(queryset, fmt, wkb=False, chunk_size=500):
+    """
+    Yields the areas of the queryset as text, one record or feature at a time.
+    wkb writes NDJSON polygons as hex EWKB, GeoJSON output always uses GeoJSON geometries
+    """
+    areas = keyset_chunks(queryset.only('id', 'name', 'price', 'polygon'), chunk_size)
+    if fmt == 'ndjson':
+        for area in areas:
+            yield dumps_json({'id': area.id, 'name': area.name, 'price': force_text(area.price),
+                              'polygon': _polygon(area, wkb)}) + '\n'
+        return
+
+    yield '{"type":"FeatureCollection","features":['
+    separator = ''
+    for area in areas:
+        yield separator + dumps_json({'type': 'Feature', 'id': area.id, 'geometry': _polygon(area, False),
+                                      'properties': {'name': area.name, 'price': force_text(area.price)}})
+        separator = ','
+    yield ']}'
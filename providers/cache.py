@@ -0,0 +1,135 @@
+"""
+Response cache for get_areas point lookups.
+
+Responses are cached per quantized lat/lng cell (PRECISION degrees, ~10 m by default). Every
+cache key also carries the version token of the coarse invalidation tile (TILE_SIZE degrees)
+the cell falls in, so a ServiceArea write only has to replace the tokens of the tiles its old
+and new bounding boxes overlap. Entries of other tiles stay valid.
+
+Entries are kept in ALIAS, which may be process local. The version tokens are kept in VERSION_ALIAS,
+which every worker has to share for a write made through one worker to drop the entries of the others.
+"""
+import math
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends import locmem
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from providers.utils import get_setting
+
+GLOBAL_VERSION_KEY = 'get_areas:version'
+
+# bounding boxes covering more tiles than this bump the global version instead
+MAX_TILES_PER_INVALIDATION = 1024
+
+
+class LRULocMemCache(locmem.LocMemCache):
+    """
+    LocMemCache that evicts the least recently used entries once MAX_ENTRIES is reached,
+    instead of culling an arbitrary slice of the cache
+    """
+
+    def __init__(self, name, params):
+        locmem._caches.setdefault(name, OrderedDict())
+        super(LRULocMemCache, self).__init__(name, params)
+
+    def get(self, key, default=None, version=None, acquire_lock=True):
+        value = super(LRULocMemCache, self).get(key, default, version, acquire_lock)
+        cache_key = self.make_key(key, version=version)
+        with (self._lock.writer() if acquire_lock else locmem.dummy()):
+            if cache_key in self._cache:
+                self._cache[cache_key] = self._cache.pop(cache_key)
+        return value
+
+    def _set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self._cache.pop(key, None)
+        super(LRULocMemCache, self)._set(key, value, timeout)
+
+    def _cull(self):
+        if self._cull_frequency == 0:
+            self.clear()
+            return
+        for _ in range(max(1, len(self._cache) // self._cull_frequency)):
+            self._delete(next(iter(self._cache)))
+
+
+def is_enabled():
+    return get_setting('PROVIDERS_QUERY_CACHE', 'ENABLED', False)
+
+
+def _cache():
+    return caches[get_setting('PROVIDERS_QUERY_CACHE', 'ALIAS', 'default')]
+
+
+def _version_cache():
+    return caches[get_setting('PROVIDERS_QUERY_CACHE', 'VERSION_ALIAS', 'default')]
+
+
+def _new_token():
+    return uuid.uuid4().hex[:12]
+
+
+def _tile(lat, lng):
+    size = get_setting('PROVIDERS_QUERY_CACHE', 'TILE_SIZE', 0.1)
+    return int(math.floor(lat / size)), int(math.floor(lng / size))
+
+
+def _tile_key(tile):
+    return 'get_areas:tile:%d:%d' % tile
+
+
+def _versions(tile):
+    """
+    Returns the global and tile version tokens, creating missing ones. Tokens are random rather
+    than counters so an evicted token can never bring back entries cached under an older one
+    """
+    cache = _version_cache()
+    keys = [GLOBAL_VERSION_KEY, _tile_key(tile)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _new_token(), None)
+            versions[key] = cache.get(key)
+    return versions[GLOBAL_VERSION_KEY], versions[_tile_key(tile)]
+
+
+def _entry_key(lat, lng):
+    precision = get_setting('PROVIDERS_QUERY_CACHE', 'PRECISION', 0.0001)
+    cell_lat, cell_lng = int(round(lat / precision)), int(round(lng / precision))
+    global_version, tile_version = _versions(_tile(cell_lat * precision, cell_lng * precision))
+    return 'get_areas:%s:%s:%d:%d' % (global_version, tile_version, cell_lat, cell_lng)
+
+
+def get_areas(lat, lng):
+    """
+    Returns the cached response data for the cell containing the point, or None
+    """
+    return _cache().get(_entry_key(lat, lng))
+
+
+def set_areas(lat, lng, data):
+    _cache().set(_entry_key(lat, lng), data, get_setting('PROVIDERS_QUERY_CACHE', 'TIMEOUT', 60))
+
+
+def invalidate_bbox(bbox):
+    """
+    Drops cached responses for every tile overlapping the (xmin, ymin, xmax, ymax) bounding box
+    """
+    xmin, ymin, xmax, ymax = bbox
+    # pad by one cell so responses cached for cells straddling the bbox edge are dropped too
+    pad = get_setting('PROVIDERS_QUERY_CACHE', 'PRECISION', 0.0001)
+    row_min, col_min = _tile(ymin - pad, xmin - pad)
+    row_max, col_max = _tile(ymax + pad, xmax + pad)
+    if (row_max - row_min + 1) * (col_max - col_min + 1) > MAX_TILES_PER_INVALIDATION:
+        invalidate_all()
+        return
+    _version_cache().set_many(dict(
+        (_tile_key((row, col)), _new_token())
+        for row in range(row_min, row_max + 1) for col in range(col_min, col_max + 1)
+    ), None)
+
+
+def invalidate_all():
+    _version_cache().set(GLOBAL_VERSION_KEY, _new_token(), None)
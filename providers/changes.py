@@ -0,0 +1,124 @@
+"""
+Append-only change log of Provider and ServiceArea writes, read by downstream caches and search
+indexes through /api/changes/?since=<cursor> instead of polling the full lists.
+
+Every create, update and delete appends a Change row in the transaction of the write: save() and
+delete() through the receivers in providers/signals.py, bulk inserts through the bulk signals. Rows
+carry the record as the API serializes it, so consumers need no extra request per change; deletes
+carry no record. Writes that bypass both, like queryset.update(), are not logged.
+
+Ids are handed out when rows are inserted, not when they commit, so a transaction committing late
+can add ids below ones a consumer has already read. The feed is therefore ordered by the id of the
+writing transaction (txid_current()) and only serves transactions older than every one still in
+flight; the cursor is "<txid>.<id>" of the last change read.
+"""
+from django.db.models import BigIntegerField, Func, Q
+from django.db.models.expressions import RawSQL
+
+from providers.models import Change, Provider, ServiceArea
+from providers.utils import InvalidArgumentsException, dumps_json, get_setting
+
+START = (0, 0)
+
+
+def is_enabled():
+    return get_setting('PROVIDERS_CHANGES', 'ENABLED', True)
+
+
+def _data(instance):
+    # imported here, the serializers send the bulk signals this module is wired to
+    from providers.serializers import ProviderSerializer, ServiceAreaSerializer
+    if isinstance(instance, Provider):
+        return ProviderSerializer.to_values((instance.pk, instance.name, instance.email, instance.language,
+                                             instance.currency, instance.phone_number))
+    return ServiceAreaSerializer.to_values((instance.pk, instance.name, instance.price, bytes(instance.polygon.wkb)))
+
+
+def _change(instance, action):
+    return Change(
+        txid=Func(function='txid_current', output_field=BigIntegerField()),
+        model=instance._meta.model_name,
+        object_id=instance.pk,
+        action=action,
+        data=dumps_json(_data(instance)) if action != 'delete' else None,
+    )
+
+
+def record(instance, action):
+    """
+    Logs a write to a Provider or ServiceArea, call it inside the transaction of the write
+    """
+    _change(instance, action).save()
+
+
+def record_many(instances, action):
+    if instances:
+        Change.objects.bulk_create([_change(instance, action) for instance in instances])
+
+
+def parse_cursor(value):
+    if not value:
+        return START
+    try:
+        txid, change_id = value.split('.')
+        return int(txid), int(change_id)
+    except ValueError:
+        raise InvalidArgumentsException('Invalid cursor')
+
+
+def parse_limit(value):
+    max_limit = get_setting('PROVIDERS_CHANGES', 'MAX_PAGE_SIZE', 10000)
+    if value is None:
+        return get_setting('PROVIDERS_CHANGES', 'PAGE_SIZE', 1000)
+    try:
+        limit = int(value)
+    except ValueError:
+        raise InvalidArgumentsException
+    if not 0 < limit <= max_limit:
+        raise InvalidArgumentsException('limit must be between 1 and %d' % max_limit)
+    return limit
+
+
+def format_cursor(position):
+    return '%d.%d' % position
+
+
+def changes_since(cursor, limit):
+    """
+    Up to limit (txid, id, created, model, object_id, action, data) rows of the changes committed after
+    cursor, in commit safe order
+    """
+    txid, change_id = cursor
+    # every transaction older than the snapshot's xmin has finished, so none can still add rows before it
+    return Change.objects.filter(
+        Q(txid__gt=txid) | Q(txid=txid, id__gt=change_id),
+        txid__lt=RawSQL('txid_snapshot_xmin(txid_current_snapshot())', (), output_field=BigIntegerField()),
+    ).order_by('txid', 'id').values_list(
+        'txid', 'id', 'created', 'model', 'object_id', 'action', 'data')[:limit]
+
+
+def feed(cursor, limit):
+    """
+    Yields the JSON document the change feed responds with, change by change:
+    {"changes": [{"cursor", "at", "model", "id", "action", "data"}, ...], "next": cursor}.
+    Stored records are copied into the output without being decoded again
+    """
+    yield '{"changes":['
+    position = cursor
+    separator = ''
+    for txid, change_id, created, model, object_id, action, data in changes_since(cursor, limit).iterator():
+        position = (txid, change_id)
+        yield '%s{"cursor":%s,"at":%s,"model":%s,"id":%d,"action":%s,"data":%s}' % (
+            separator, dumps_json(format_cursor(position)), dumps_json(created.isoformat()), dumps_json(model),
+            object_id, dumps_json(action), data if data is not None else 'null')
+        separator = ','
+    yield '],"next":%s}' % dumps_json(format_cursor(position))
+
+
+def prune(before):
+    """
+    Deletes the changes logged before the given datetime. Returns the number of rows deleted
+    """
+    deleted, _ = Change.objects.filter(created__lt=before).delete()
+    return deleted
+
@@ -0,0 +1,59 @@
+"""
+System checks for the cache aliases holding state the workers have to share.
+
+A LocMemCache or DummyCache alias is kept by each process on its own, so a write seen by one worker
+goes unnoticed by the others. That is fine for a single process, like runserver, and wrong for
+anything serving from several. Warnings are left out under DEBUG, errors never are and also stop
+the app from loading, see ProvidersConfig.ready().
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, Warning, register
+
+from providers.utils import get_setting
+
+
+def is_process_local(alias):
+    return isinstance(caches[alias], (LocMemCache, DummyCache))
+
+
+def shared_state():
+    """
+    (check id, setting, alias, what goes wrong when the alias is process local) for the enabled features
+    keeping state in a shared cache. E ids are errors, W ids warnings
+    """
+    state = [
+        ('W001', 'PROVIDERS_AUTH_CACHE["SHARED_ALIAS"]', get_setting('PROVIDERS_AUTH_CACHE', 'SHARED_ALIAS', 'default'),
+         'deleted tokens and deactivated providers stay authenticated on other workers until their entries expire'),
+    ]
+    if get_setting('PROVIDERS_QUERY_CACHE', 'ENABLED', False):
+        state.append(('W002', 'PROVIDERS_QUERY_CACHE["VERSION_ALIAS"]',
+                      get_setting('PROVIDERS_QUERY_CACHE', 'VERSION_ALIAS', 'default'),
+                      'other workers keep serving cached get_areas responses after ServiceArea writes'))
+    if get_setting('PROVIDERS_SPATIAL_INDEX', 'ENABLED', False):
+        state.append(('W003', 'PROVIDERS_SPATIAL_INDEX["CACHE"]', get_setting('PROVIDERS_SPATIAL_INDEX', 'CACHE', 'default'),
+                      'other workers keep answering get_areas from their indexes after ServiceArea writes'))
+    if get_setting('PROVIDERS_REPLICAS', 'ALIASES', ()):
+        state.append(('W004', 'PROVIDERS_REPLICAS["PIN_CACHE"]', get_setting('PROVIDERS_REPLICAS', 'PIN_CACHE', 'default'),
+                      'clients served by another worker after a write read replicas that may not have it yet'))
+    if get_setting('PROVIDERS_THROTTLE', 'ENABLED', False):
+        state.append(('E001', 'PROVIDERS_THROTTLE["CACHE"]', get_setting('PROVIDERS_THROTTLE', 'CACHE', 'default'),
+                      'every worker would let each client through at the full rate'))
+    return state
+
+
+@register(Tags.caches)
+def check_shared_caches(app_configs, **kwargs):
+    messages = []
+    for check_id, setting, alias, consequence in shared_state():
+        is_error = check_id.startswith('E')
+        if not is_process_local(alias) or not (is_error or not settings.DEBUG):
+            continue
+        level = Error if is_error else Warning
+        messages.append(level(
+            '%s names the process local cache %r, %s' % (setting, alias, consequence),
+            hint='Point it at a cache all workers share, e.g. set MEMCACHED_LOCATION for the "shared" alias',
+            id='providers.' + check_id))
+    return messages
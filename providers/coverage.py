@@ -0,0 +1,104 @@
+"""
+Precomputed coverage grid for get_areas.
+
+The plane is cut into RESOLUTION degree cells and CoverageCell stores, for every cell an area
+touches, whether the area covers the whole cell or only part of it. A point lookup then reads
+the rows of the point's cell through the (cell_x, cell_y) index: areas covering the whole cell
+match without any geometry test and only the partial ones go through the exact test.
+Whole-cell coverage is decided against the area's core (see providers/geometry.py), so the planar
+containment also holds for the geography polygon. Partial cells are found from the planar copy,
+which follows the great circle edges, grown by the bow left between its points (the bbox columns).
+
+Areas spanning more than MAX_CELLS_PER_AREA cells get a single row in the UNTILED cell instead,
+which every lookup reads, so they always go through the exact test.
+
+Rows are rewritten with the area whenever its polygon changes and cascade away with it. After
+enabling the grid or changing RESOLUTION run the rebuild_coverage_tiles command.
+"""
+import math
+
+from django.contrib.gis.geos import Point, Polygon
+from django.db import transaction
+
+from providers.models import CoverageCell, ServiceArea
+from providers.pagination import keyset_chunks
+from providers.utils import get_setting
+
+
+def is_enabled():
+    return get_setting('PROVIDERS_COVERAGE_TILES', 'ENABLED', False)
+
+
+def resolution():
+    return get_setting('PROVIDERS_COVERAGE_TILES', 'RESOLUTION', 0.05)
+
+
+def cell_of(lng, lat):
+    size = resolution()
+    return int(math.floor(lng / size)), int(math.floor(lat / size))
+
+
+def cells_for(area):
+    """
+    Returns (cell_x, cell_y, full) for every cell the area's polygon touches, or the UNTILED cell
+    for areas spanning more than MAX_CELLS_PER_AREA cells
+    """
+    size = resolution()
+    (x0, y0), (x1, y1) = cell_of(area.bbox_xmin, area.bbox_ymin), cell_of(area.bbox_xmax, area.bbox_ymax)
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > get_setting('PROVIDERS_COVERAGE_TILES', 'MAX_CELLS_PER_AREA', 4096):
+        return [(CoverageCell.UNTILED, CoverageCell.UNTILED, False)]
+
+    planar = area.polygon_planar
+    _, pymin, _, pymax = planar.extent
+    slack = max(pymin - area.bbox_ymin, area.bbox_ymax - pymax)
+    planar = (planar.buffer(slack) if slack > 0 else planar).prepared
+    core = area.polygon_core.prepared if area.polygon_core is not None else None
+
+    cells = []
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            box = Polygon.from_bbox((x * size, y * size, (x + 1) * size, (y + 1) * size))
+            if core is not None and core.contains(box):
+                cells.append((x, y, True))
+            elif planar.intersects(box):
+                cells.append((x, y, False))
+    return cells
+
+
+def tile_areas(areas, batch_size=1000):
+    """
+    Replaces the grid rows of saved areas. The areas need their derived geometries, which save()
+    and ServiceArea.update_derived_geometries() provide
+    """
+    areas = list(areas)
+    with transaction.atomic():
+        CoverageCell.objects.filter(area_id__in=[area.pk for area in areas]).delete()
+        CoverageCell.objects.bulk_create([
+            CoverageCell(cell_x=x, cell_y=y, area_id=area.pk, full=full)
+            for area in areas for x, y, full in cells_for(area)], batch_size=batch_size)
+
+
+def rebuild(chunk_size=500):
+    """
+    Recomputes the whole grid at the current RESOLUTION. Returns the number of cells written
+    """
+    with transaction.atomic():
+        CoverageCell.objects.all().delete()
+        chunk = []
+        areas = ServiceArea.objects.only('id', 'polygon_planar', 'polygon_core', 'bbox_xmin', 'bbox_ymin',
+                                         'bbox_xmax', 'bbox_ymax')
+        for area in keyset_chunks(areas, chunk_size):
+            chunk.append(area)
+            if len(chunk) == chunk_size:
+                tile_areas(chunk)
+                chunk = []
+        tile_areas(chunk)
+    return CoverageCell.objects.count()
+
+
+def areas_for_point(lng, lat):
+    """
+    (name, price, provider name) rows of the areas containing the point
+    """
+    cell_x, cell_y = cell_of(lng, lat)
+    return ServiceArea.objects.for_point_in_cell(Point(lng, lat), cell_x, cell_y)
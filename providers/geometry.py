@@ -0,0 +1,226 @@
+"""
+Derived geometries stored next to ServiceArea.polygon.
+
+polygon is a geography column, so every PostGIS test on it runs spheroidal math and its edges are
+great circles, which bow toward the pole past the straight lng/lat lines between the vertices.
+Alongside it we keep a planar copy with points added along the great circle edges every
+SEGMENT_LENGTH degrees, its bounding box grown by what is left of the bow in latitude, a
+simplified copy for display and coarse checks, and a "core": the planar copy shrunk by
+BORDER_MARGIN degrees. A point
+inside the core is inside the area without a geography test; only points between the core and the
+edge need the exact one. Areas whose planar copy still strays more than half of BORDER_MARGIN from
+the great circle edges get no core, every point test on them is exact.
+
+Polygons with more than PIECE_VERTICES vertices are flagged "subdivided" and also stored as small
+ServiceAreaPiece polygons, so the exact test near their edges runs against a few vertices instead
+of the whole polygon. polygon itself is kept whole for display.
+
+normalize_polygon() is the write-time pipeline ServiceAreaSerializer runs on every polygon.
+"""
+import math
+import struct
+from collections import OrderedDict
+
+from django.contrib.gis.geos import GEOSGeometry, LinearRing, MultiPolygon, Polygon
+from django.db import connection
+from django.utils.encoding import force_text
+
+from providers.utils import get_setting
+
+ROUNDING = 1e-9  # degrees, gaps below this between planar and great circle edges are float noise
+
+DERIVED_GEOMETRY_FIELDS = ('polygon_planar', 'polygon_simplified', 'polygon_core',
+                           'bbox_xmin', 'bbox_ymin', 'bbox_xmax', 'bbox_ymax', 'subdivided')
+
+
+class GeometryError(ValueError):
+    pass
+
+
+def _vector(lng, lat):
+    lng, lat = math.radians(lng), math.radians(lat)
+    return math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng), math.sin(lat)
+
+
+def _great_circle(start, end, fractions):
+    """
+    (lng, lat) points at the fractions of the great circle arc from start to end, and the arc in degrees
+    """
+    a, b = _vector(*start), _vector(*end)
+    angle = math.acos(max(-1.0, min(1.0, sum(x * y for x, y in zip(a, b)))))
+    if angle < 1e-12:
+        return [start for _ in fractions], 0.0
+    points = []
+    for fraction in fractions:
+        wa, wb = math.sin((1 - fraction) * angle), math.sin(fraction * angle)
+        x, y, z = (wa * p + wb * q for p, q in zip(a, b))
+        lng = math.degrees(math.atan2(y, x))
+        lng += 360 * round((start[0] - lng) / 360.0)  # keep the side of the antimeridian the edge starts on
+        points.append((lng, math.degrees(math.atan2(z, math.hypot(x, y)))))
+    return points, math.degrees(angle)
+
+
+def densify(polygon, max_segment):
+    """
+    The polygon with points added along its great circle edges, at most max_segment degrees of arc
+    apart, and the largest distances in degrees left between its planar edges and the great circles
+    bowing south and north of them
+    """
+    rings = []
+    south = north = 0.0
+    for ring in polygon:
+        coords = [coord[:2] for coord in ring.coords]
+        dense = [coords[0]]
+        for start, end in zip(coords, coords[1:]):
+            _, arc = _great_circle(start, end, ())
+            count = max(1, int(math.ceil(arc / max_segment)))
+            points, _ = _great_circle(start, end, [i / float(count) for i in range(1, count)])
+            points.append(end)
+            # the gap between a short planar segment and its arc is largest at the middle
+            middles, _ = _great_circle(start, end, [(i + 0.5) / count for i in range(count)])
+            for a, b, middle in zip([start] + points[:-1], points, middles):
+                gap = math.hypot((a[0] + b[0]) / 2.0 - middle[0], (a[1] + b[1]) / 2.0 - middle[1])
+                if gap < ROUNDING:
+                    continue
+                if middle[1] > (a[1] + b[1]) / 2.0:
+                    north = max(north, gap)
+                else:
+                    south = max(south, gap)
+            dense.extend(points)
+        rings.append(LinearRing(dense))
+    densified = Polygon(*rings)
+    densified.srid = polygon.srid
+    return densified, south, north
+
+
+def derived_geometries(polygon):
+    """
+    Returns the derived column values for a polygon, keyed by ServiceArea field name
+    """
+    margin = get_setting('PROVIDERS_GEOMETRY', 'BORDER_MARGIN', 0.001)
+    planar, south, north = densify(polygon, get_setting('PROVIDERS_GEOMETRY', 'SEGMENT_LENGTH', 0.1))
+    xmin, ymin, xmax, ymax = planar.extent
+
+    core = None
+    if max(south, north) <= margin / 2.0:
+        # shrinking by the margin and simplifying by half of it keeps the core half a margin inside the
+        # planar copy, which is at most half a margin off the great circle edges
+        core = planar.buffer(-margin).simplify(margin / 2.0, preserve_topology=True)
+        if isinstance(core, Polygon):
+            core = MultiPolygon(core) if not core.empty else None
+        elif not isinstance(core, MultiPolygon) or core.empty:
+            core = None
+    if core is not None:
+        core.srid = planar.srid
+
+    simplified = planar.simplify(get_setting('PROVIDERS_GEOMETRY', 'SIMPLIFY_TOLERANCE', 0.0005),
+                                 preserve_topology=True)
+    if not isinstance(simplified, Polygon) or simplified.empty:
+        simplified = planar
+    simplified.srid = planar.srid
+
+    return {
+        'polygon_planar': planar,
+        'polygon_simplified': simplified,
+        'polygon_core': core,
+        'bbox_xmin': xmin,  # longitude is monotonic along a great circle arc, edges only bow in latitude
+        'bbox_ymin': ymin - south,
+        'bbox_xmax': xmax,
+        'bbox_ymax': ymax + north,
+        'subdivided': polygon.num_points > get_setting('PROVIDERS_GEOMETRY', 'PIECE_VERTICES', 256),
+    }
+
+
+def make_valid(polygon):
+    """
+    Repairs an invalid polygon with PostGIS ST_MakeValid, keeping only the polygonal parts.
+    Returns a Polygon or MultiPolygon, or None when nothing polygonal is left
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT ST_AsHEXEWKB(ST_CollectionExtract(ST_MakeValid(%s::geometry), 3))',
+                       [force_text(polygon.hexewkb)])
+        hexewkb, = cursor.fetchone()
+    if hexewkb is None:
+        return None
+    repaired = GEOSGeometry(hexewkb)
+    return repaired if not repaired.empty else None
+
+
+def normalize_polygon(polygon):
+    """
+    Repairs invalid polygons, simplifies them within NORMALIZE_TOLERANCE when set and enforces
+    MAX_VERTICES. Returns the polygon to store, raises GeometryError when it cannot be stored
+    """
+    srid = polygon.srid
+    if not polygon.valid:
+        repaired = make_valid(polygon)
+        if isinstance(repaired, MultiPolygon) and len(repaired) == 1:
+            repaired = repaired[0]
+        if repaired is None:
+            raise GeometryError('Polygon has no area once repaired (%s)' % polygon.valid_reason)
+        if not isinstance(repaired, Polygon):
+            raise GeometryError('Polygon is invalid (%s) and repairing it gives %d separate polygons, '
+                                'send them as separate areas' % (polygon.valid_reason, len(repaired)))
+        polygon = repaired
+
+    tolerance = get_setting('PROVIDERS_GEOMETRY', 'NORMALIZE_TOLERANCE', 0)
+    if tolerance:
+        simplified = polygon.simplify(tolerance, preserve_topology=True)
+        if isinstance(simplified, Polygon) and not simplified.empty:
+            polygon = simplified
+
+    max_vertices = get_setting('PROVIDERS_GEOMETRY', 'MAX_VERTICES', 10000)
+    if polygon.num_points > max_vertices:
+        raise GeometryError('Polygon has %d vertices, at most %d are allowed' % (polygon.num_points, max_vertices))
+    polygon.srid = srid
+    return polygon
+
+
+def wkb_to_geojson(wkb):
+    """
+    GeoJSON dict for a Polygon or MultiPolygon WKB/EWKB value. Coordinates are unpacked straight from
+    the WKB doubles, so they are identical to GEOSGeometry.coords without building a GEOS geometry
+    """
+    geometry, _ = _read_geometry(bytes(wkb), 0)
+    return geometry
+
+
+def _read_geometry(data, offset):
+    byte_order = '<' if data[offset:offset + 1] == b'\x01' else '>'
+    geom_type, = struct.unpack_from(byte_order + 'I', data, offset + 1)
+    offset += 5
+    dims = 2
+    if geom_type & 0x20000000:  # EWKB srid
+        offset += 4
+    if geom_type & 0x80000000:  # EWKB z
+        dims = 3
+    geom_type &= 0xffff
+    if geom_type > 1000:  # ISO WKB z/m types
+        dims = 3 if geom_type < 3000 else 4
+        geom_type %= 1000
+
+    if geom_type == 3:
+        rings, offset = _read_polygon(data, offset, byte_order, dims)
+        return OrderedDict((('type', 'Polygon'), ('coordinates', rings))), offset
+    if geom_type == 6:
+        count, = struct.unpack_from(byte_order + 'I', data, offset)
+        offset += 4
+        polygons = []
+        for _ in range(count):
+            polygon, offset = _read_geometry(data, offset)
+            polygons.append(polygon['coordinates'])
+        return OrderedDict((('type', 'MultiPolygon'), ('coordinates', polygons))), offset
+    raise ValueError('Unsupported WKB geometry type %d' % geom_type)
+
+
+def _read_polygon(data, offset, byte_order, dims):
+    ring_count, = struct.unpack_from(byte_order + 'I', data, offset)
+    offset += 4
+    rings = []
+    for _ in range(ring_count):
+        point_count, = struct.unpack_from(byte_order + 'I', data, offset)
+        offset += 4
+        values = struct.unpack_from('%s%dd' % (byte_order, point_count * dims), data, offset)
+        offset += 8 * point_count * dims
+        rings.append([list(values[i:i + dims]) for i in range(0, len(values), dims)])
+    return rings, offset
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+
+from providers.geometry import ROUNDING, GeometryError, derived_geometries, normalize_polygon
+from providers.models import ServiceArea, ServiceAreaPiece
+from providers.pagination import keyset_chunks
+from providers.utils import get_setting
+
+
+class Command(BaseCommand):
+    help = ('Reports service areas whose polygon is invalid, over PROVIDERS_GEOMETRY["MAX_VERTICES"], with '
+            'missing or stale derived geometries, bounding boxes or pieces. --fix runs them through the '
+            'write-time pipeline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='normalize and resave the reported areas')
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        max_vertices = get_setting('PROVIDERS_GEOMETRY', 'MAX_VERTICES', 10000)
+        pieced = set(ServiceAreaPiece.objects.values_list('area_id', flat=True).distinct())
+        reported = fixed = 0
+        for area in keyset_chunks(ServiceArea.objects.all(), options['chunk_size']):
+            problems = []
+            if not area.polygon.valid:
+                problems.append('invalid: %s' % area.polygon.valid_reason)
+            if area.polygon.num_points > max_vertices:
+                problems.append('%d vertices' % area.polygon.num_points)
+            derived = derived_geometries(area.polygon)
+            if area.polygon_planar is None or area.subdivided != derived['subdivided']:
+                problems.append('stale derived geometries')
+            fresh = (derived['bbox_xmin'], derived['bbox_ymin'], derived['bbox_xmax'], derived['bbox_ymax'])
+            if any(stored is None or abs(stored - value) > ROUNDING for stored, value in zip(area.bbox, fresh)):
+                problems.append('stale bounding box')
+            if derived['subdivided'] and area.pk not in pieced:
+                problems.append('missing pieces')
+            elif not derived['subdivided'] and area.pk in pieced:
+                problems.append('stray pieces')
+            if not problems:
+                continue
+
+            reported += 1
+            self.stdout.write('area %d: %s' % (area.pk, ', '.join(problems)))
+            if options['fix']:
+                try:
+                    area.polygon = normalize_polygon(area.polygon)
+                except GeometryError as e:
+                    self.stderr.write('area %d: cannot fix, %s' % (area.pk, e))
+                    continue
+                area.save()
+                fixed += 1
+
+        self.stdout.write('%d areas reported, %d fixed' % (reported, fixed))
@@ -0,0 +1,87 @@
+import io
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from providers import benchmarks
+from providers.models import Provider, ServiceArea
+
+MODES = ('in_process', 'wsgi')
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks every providers API endpoint, reads, writes, deletes and bulk imports, against synthetic '
+            'data in a throwaway test database, reporting latency percentiles, throughput, SQL queries per '
+            'request, error responses and peak memory')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--areas', type=int, default=10000, help='number of synthetic service areas')
+        parser.add_argument('--areas-per-provider', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=200, help='requests per endpoint and mode')
+        parser.add_argument('--mode', choices=MODES + ('both',), default='both')
+        parser.add_argument('--scenario', action='append', help='only run the named scenario(s)')
+        parser.add_argument('--output', help='write the results as JSON to this file')
+        parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+        parser.add_argument('--keepdb', action='store_true', help='reuse the benchmark database between runs')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        settings.ALLOWED_HOSTS = list(settings.ALLOWED_HOSTS) + ['testserver', '127.0.0.1']
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        self.report(results)
+        if options['output']:
+            with io.open(options['output'], 'w', encoding='utf-8') as output:
+                output.write(json.dumps(results, indent=2, sort_keys=True))
+        if options['baseline']:
+            with io.open(options['baseline'], encoding='utf-8') as baseline:
+                self.report_comparison(benchmarks.compare(results, json.load(baseline)))
+
+    def run(self, options):
+        if ServiceArea.objects.count() < options['areas']:
+            self.stdout.write('Generating %d service areas...' % options['areas'])
+            benchmarks.generate(options['areas'], options['areas_per_provider'], options['seed'])
+        providers = list(Provider.objects.order_by('pk')[:1])
+
+        modes = MODES if options['mode'] == 'both' else (options['mode'],)
+        results = {
+            'started': timezone.now().isoformat(),
+            'areas': options['areas'],
+            'requests': options['requests'],
+            'scenarios': dict((mode, {}) for mode in modes),
+        }
+        for name, factory in benchmarks.scenarios(providers, options['areas'], options['seed']):
+            if options['scenario'] and name not in options['scenario']:
+                continue
+            if 'in_process' in modes:
+                results['scenarios']['in_process'][name] = benchmarks.run_in_process(factory, options['requests'])
+            if 'wsgi' in modes:
+                with benchmarks.WSGIServer() as server:
+                    results['scenarios']['wsgi'][name] = benchmarks.run_over_wsgi(
+                        server.base_url, factory, options['requests'])
+        results['peak_memory_kb'] = benchmarks.peak_memory_kb()
+        return results
+
+    def report(self, results):
+        self.stdout.write('%-32s %9s %9s %9s %10s %9s %7s' % ('scenario', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s',
+                                                             'queries', 'errors'))
+        for mode, scenario_results in sorted(results['scenarios'].items()):
+            for name, metrics in sorted(scenario_results.items()):
+                queries = metrics.get('queries_per_request')
+                self.stdout.write('%-32s %9.2f %9.2f %9.2f %10.1f %9s %7d' % (
+                    '%s/%s' % (mode, name), metrics['p50_ms'], metrics['p95_ms'], metrics['p99_ms'],
+                    metrics['throughput'], '%.1f' % queries if queries is not None else '-', metrics.get('errors', 0)))
+        self.stdout.write('peak memory: %d KB' % results['peak_memory_kb'])
+
+    def report_comparison(self, rows):
+        self.stdout.write('\n%-32s %-20s %12s %12s %8s' % ('scenario', 'metric', 'baseline', 'current', 'change'))
+        for scenario, metric, previous, current, change in rows:
+            self.stdout.write('%-32s %-20s %12.2f %12.2f %+7.1f%%' % (scenario, metric, previous, current, change * 100))
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from providers.benchmarks import count_queries
+from providers.models import Provider
+
+
+class Command(BaseCommand):
+    help = ('Measures provider creates per second and queries per create in a throwaway test database: save() '
+            'with the existence SELECT it used to make, save() as it is now and bulk_create_with_tokens()')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=1000, help='providers per bulk_create_with_tokens()')
+
+    def build(self, prefix, count):
+        return [Provider(name='Bench %d' % i, email='%s%d@bench.invalid' % (prefix, i), language='en',
+                         currency='USD', phone_number='+10000000000') for i in range(count)]
+
+    def measure(self, label, count, items, create):
+        """
+        Runs create on each item in autocommit, like a request would, counting the queries of each call
+        separately so the connection's query log never fills up
+        """
+        elapsed = queries = 0
+        for item in items:
+            started = time.time()
+            _, item_queries = count_queries(create, item)
+            elapsed += time.time() - started
+            queries += item_queries
+        self.stdout.write('%-14s %8.0f creates/s  %5.2f queries/create' % (
+            label, count / elapsed, queries / float(count)))
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(options['count'], options['batch_size'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, count, batch_size):
+        def save_with_lookup(provider):
+            list(Provider.objects.filter(pk=provider.pk))  # the lookup save() made before relying on _state.adding
+            provider.save()
+
+        self.measure('save() before', count, self.build('before', count), save_with_lookup)
+        self.measure('save()', count, self.build('save', count), lambda provider: provider.save())
+        providers = self.build('bulk', count)
+        self.measure('bulk', count, [providers[start:start + batch_size] for start in range(0, count, batch_size)],
+                     Provider.objects.bulk_create_with_tokens)
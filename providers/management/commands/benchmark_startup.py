@@ -0,0 +1,33 @@
+import io
+import json
+
+from django.core.management.base import BaseCommand
+
+from providers import benchmarks
+
+PROFILES = ('mozio.settings', 'mozio.settings_query')
+
+
+class Command(BaseCommand):
+    help = ('Compares worker cold starts (django.setup(), middleware and URLconf loading) across settings '
+            'modules, by default the full profile and the query worker profile')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', action='append', help='settings module to measure, repeatable')
+        parser.add_argument('--runs', type=int, default=5, help='fresh processes per profile, the median is reported')
+        parser.add_argument('--path', default='/api/get_areas/', help='URL resolved as the first request')
+        parser.add_argument('--output', help='write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        results = dict((profile, benchmarks.measure_startup(profile, options['runs'], options['path']))
+                       for profile in options['profile'] or PROFILES)
+
+        self.stdout.write('%-28s %10s %10s %9s %12s %12s' % (
+            'profile', 'setup ms', 'ready ms', 'modules', 'gis modules', 'memory KB'))
+        for profile, metrics in sorted(results.items()):
+            self.stdout.write('%-28s %10.1f %10.1f %9d %12d %12d' % (
+                profile, metrics['setup_ms'], metrics['ready_ms'], metrics['modules'], metrics['gis_modules'],
+                metrics['peak_memory_kb']))
+        if options['output']:
+            with io.open(options['output'], 'w', encoding='utf-8') as output:
+                output.write(json.dumps(results, indent=2, sort_keys=True))
@@ -0,0 +1,55 @@
+import io
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from providers import query_plans
+
+
+class Command(BaseCommand):
+    help = ('Runs EXPLAIN ANALYZE on the queries of every providers view and fails on sequential scans of large '
+            'tables, missing indexes and plan regressions against a baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lat', type=float, help='point the spatial queries look up, by default inside the '
+                                                      'first service area')
+        parser.add_argument('--lng', type=float)
+        parser.add_argument('--view', action='append', help='only check the named query(s)')
+        parser.add_argument('--no-analyze', action='store_true', help='only plan the queries, without running them')
+        parser.add_argument('--seq-scan-rows', type=int, help='flag sequential scans from this many rows on')
+        parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+        parser.add_argument('--output', help='write the results as JSON to this file, to use as a baseline')
+
+    def handle(self, *args, **options):
+        arguments = query_plans.sample_arguments()
+        if arguments is None:
+            raise CommandError('There are no service areas to sample the queries from')
+        if options['lat'] is not None and options['lng'] is not None:
+            arguments.update(lat=options['lat'], lng=options['lng'])
+
+        summaries = query_plans.check_views(arguments, analyze=not options['no_analyze'], names=options['view'])
+        baseline = None
+        if options['baseline']:
+            with io.open(options['baseline'], encoding='utf-8') as baseline_file:
+                baseline = json.load(baseline_file)['queries']
+        found = query_plans.problems(summaries, baseline, options['seq_scan_rows'])
+        found += [('indexes', 'no %s index on %s.%s' % (method, table, column))
+                  for table, column, method in query_plans.missing_indexes()]
+
+        self.report(summaries)
+        if options['output']:
+            with io.open(options['output'], 'w', encoding='utf-8') as output:
+                output.write(json.dumps({'checked': timezone.now().isoformat(), 'arguments': arguments,
+                                         'queries': summaries}, indent=2, sort_keys=True))
+        for name, problem in found:
+            self.stderr.write('%-32s %s' % (name, problem))
+        if found:
+            raise CommandError('%d query plan problem(s)' % len(found))
+
+    def report(self, summaries):
+        self.stdout.write('%-32s %10s %9s  %s' % ('query', 'cost', 'ms', 'indexes / sequential scans'))
+        for name, summary in sorted(summaries.items()):
+            self.stdout.write('%-32s %10.1f %9s  %s' % (
+                name, summary['cost'], '%.2f' % summary['ms'] if summary['ms'] is not None else '-',
+                ', '.join(summary['indexes'] + ['seq:' + table for table in summary['seq_scans']]) or '-'))
@@ -0,0 +1,33 @@
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+
+from providers import bulk
+from providers.models import Provider, ServiceArea
+
+
+class Command(BaseCommand):
+    help = "Streams a provider's service areas out as a GeoJSON FeatureCollection or NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help="provider's email")
+        parser.add_argument('--format', choices=bulk.FORMATS, default='geojson')
+        parser.add_argument('--wkb', action='store_true', help='write NDJSON polygons as hex EWKB')
+        parser.add_argument('--output', help='file to write to, defaults to stdout')
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            provider = Provider.objects.get(email=options['email'])
+        except Provider.DoesNotExist:
+            raise CommandError('No provider with email %s' % options['email'])
+
+        lines = bulk.export_areas(ServiceArea.objects.filter(provider_id=provider.pk), options['format'],
+                                  wkb=options['wkb'], chunk_size=options['chunk_size'])
+        if options['output']:
+            with io.open(options['output'], 'w', encoding='utf-8') as output:
+                for line in lines:
+                    output.write(line)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,44 @@
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+
+from providers import bulk
+from providers.models import Provider
+
+
+class Command(BaseCommand):
+    help = ('Bulk imports service areas for a provider from a GeoJSON FeatureCollection or NDJSON file, in one '
+            'transaction: when any record is rejected nothing is imported. With --chunk-commit every chunk is '
+            'committed on its own and rejected records are skipped, a failure partway keeps the chunks committed '
+            'before it')
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help="provider's email")
+        parser.add_argument('path', help='file to import, .ndjson/.jsonl files are read as NDJSON')
+        parser.add_argument('--format', choices=bulk.FORMATS, help='overrides the format guessed from the file name')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--chunk-commit', action='store_true',
+                            help='commit every chunk on its own and skip rejected records')
+
+    def handle(self, *args, **options):
+        try:
+            provider = Provider.objects.get(email=options['email'])
+        except Provider.DoesNotExist:
+            raise CommandError('No provider with email %s' % options['email'])
+
+        fmt = options['format']
+        if fmt is None:
+            fmt = 'ndjson' if options['path'].endswith(('.ndjson', '.jsonl')) else 'geojson'
+
+        with io.open(options['path'], encoding='utf-8') as stream:
+            try:
+                created, errors = bulk.import_areas(provider, bulk.read_records(stream, fmt), options['chunk_size'],
+                                                    chunk_commit=options['chunk_commit'])
+            except bulk.ImportAborted as error:
+                raise CommandError(str(error))
+
+        for error in errors:
+            self.stderr.write('record %d: %s' % (error['index'], error['errors']))
+        if errors and not options['chunk_commit']:
+            raise CommandError('Rejected %d records, nothing was imported' % len(errors))
+        self.stdout.write('Imported %d service areas, rejected %d' % (created, len(errors)))
@@ -0,0 +1,57 @@
+import io
+import sys
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from providers import offline
+
+
+class Command(BaseCommand):
+    help = ('Matches a CSV file of "lat,lng" points against every service area offline and writes one '
+            '(point, lat, lng, area_id, area, provider, price) row per match as CSV or Parquet')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='points file, "-" reads stdin')
+        parser.add_argument('--format', choices=('csv', 'parquet'), default='csv')
+        parser.add_argument('--output', help='file to write to, CSV defaults to stdout')
+        parser.add_argument('--processes', type=int, default=None, help='worker processes, defaults to one per core')
+        parser.add_argument('--block-size', type=int, default=100000, help='points matched per task')
+
+    def handle(self, *args, **options):
+        if options['format'] == 'parquet' and not options['output']:
+            raise CommandError('Parquet output needs --output')
+
+        started = time.time()
+        try:
+            areas = offline.load_areas()
+            writer, output = self.open_writer(options['format'], options['output'])
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        self.stderr.write('Loaded %d service areas in %.1fs' % (len(areas), time.time() - started))
+
+        stream = sys.stdin if options['path'] == '-' else io.open(options['path'], encoding='utf-8', newline='')
+        matches = 0
+        try:
+            blocks = offline.read_points(stream, options['block_size'])
+            for columns in offline.match_blocks(areas, blocks, options['processes']):
+                writer.write(columns)
+                matches += len(columns['point'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            writer.close()
+            if output is not None:
+                output.close()
+            if stream is not sys.stdin:
+                stream.close()
+        self.stderr.write('Wrote %d matches in %.1fs' % (matches, time.time() - started))
+
+    def open_writer(self, fmt, path):
+        if fmt == 'parquet':
+            return offline.ParquetWriter(path), None
+        if path:
+            output = io.open(path, 'w', encoding='utf-8', newline='')
+            return offline.CSVWriter(output), output
+        return offline.CSVWriter(self.stdout), None
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from providers import changes
+from providers.utils import get_setting
+
+
+class Command(BaseCommand):
+    help = 'Deletes change feed entries older than PROVIDERS_CHANGES["KEEP_DAYS"] days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='keep this many days instead')
+
+    def handle(self, *args, **options):
+        days = options['days'] if options['days'] is not None else get_setting('PROVIDERS_CHANGES', 'KEEP_DAYS', 7)
+        deleted = changes.prune(timezone.now() - timedelta(days=days))
+        self.stdout.write('Deleted %d changes older than %d days' % (deleted, days))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from providers import coverage
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the coverage grid used by get_areas for every service area'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        cells = coverage.rebuild(options['chunk_size'])
+        self.stdout.write('Wrote %d coverage cells at %s degrees' % (cells, coverage.resolution()))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from providers import provider_coverage
+from providers.models import ProviderCoverage
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the per-provider coverage unions used by get_providers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--provider', type=int, action='append', dest='providers',
+                            help='only rebuild this provider, may be repeated')
+
+    def handle(self, *args, **options):
+        provider_coverage.rebuild(options['providers'])
+        self.stdout.write('Wrote %d coverage rows for %d price tiers' % (
+            ProviderCoverage.objects.count(), len(provider_coverage.tiers())))
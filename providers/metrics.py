@@ -0,0 +1,187 @@
+"""
+Per-request timing and per-endpoint latency histograms for the providers API.
+
+InstrumentationMiddleware opens a RequestMetrics for every request. Code that wants its time
+reported wraps itself in timed(<phase>); serializers and the JSON renderer already do. SQL is
+counted and timed by a thin wrapper around the cursors of instrumented connections, which only adds
+to the current request, unlike debug cursors it keeps no query log. The registry is process local,
+every worker exposes its own histograms on the metrics endpoint.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.db.backends.utils import CursorWrapper
+
+from providers.utils import get_setting
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_LATENCY_WEIGHT = 0.2  # of the latest request in the moving average
+
+_local = threading.local()
+
+
+class RequestMetrics(object):
+    def __init__(self):
+        self.started = time.time()
+        self.phases = OrderedDict()
+        self.sql_count = 0
+        self.sql_time = 0.0
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @property
+    def total(self):
+        return time.time() - self.started
+
+
+def start_request():
+    _local.metrics = RequestMetrics()
+    return _local.metrics
+
+
+def end_request():
+    _local.metrics = None
+
+
+def current():
+    return getattr(_local, 'metrics', None)
+
+
+class timed(object):
+    """
+    Context manager adding the time spent in its block to a phase of the current request
+    """
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        metrics = current()
+        if metrics is not None:
+            metrics.add(self.phase, time.time() - self.started)
+
+
+class _TimedCursor(CursorWrapper):
+    """
+    Adds the count and time of its queries to the current request, wraps Django's own cursor wrapper
+    """
+
+    def execute(self, sql, params=None):
+        return self._timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(self.cursor.executemany, sql, param_list)
+
+    def _timed(self, method, *args):
+        started = time.time()
+        try:
+            return method(*args)
+        finally:
+            metrics = current()
+            if metrics is not None:
+                metrics.sql_count += 1
+                metrics.sql_time += time.time() - started
+
+
+def instrument(connection):
+    """
+    Makes the cursors of a connection report to the current request, once per connection
+    """
+    if getattr(connection, 'providers_instrumented', False):
+        return
+    make_cursor, make_debug_cursor = connection.make_cursor, connection.make_debug_cursor
+    connection.make_cursor = lambda cursor: _TimedCursor(make_cursor(cursor), connection)
+    connection.make_debug_cursor = lambda cursor: _TimedCursor(make_debug_cursor(cursor), connection)
+    connection.providers_instrumented = True
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Registry(object):
+    """
+    Request latency, SQL time and SQL query count per endpoint
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.latency = {}
+        self.sql_time = {}
+        self.sql_queries = {}
+        self.query_latency = 0.0  # moving average of the time per SQL query
+        self.query_latency_at = 0.0
+
+    def _histogram(self, histograms, key):
+        if key not in histograms:
+            histograms[key] = Histogram(get_setting('PROVIDERS_METRICS', 'BUCKETS', DEFAULT_BUCKETS))
+        return histograms[key]
+
+    def observe(self, endpoint, method, status_code, metrics):
+        key = (endpoint, method, str(status_code))
+        with self._lock:
+            self._histogram(self.latency, key).observe(metrics.total)
+            self._histogram(self.sql_time, key).observe(metrics.sql_time)
+            self.sql_queries[key] = self.sql_queries.get(key, 0) + metrics.sql_count
+            if metrics.sql_count:
+                per_query = metrics.sql_time / metrics.sql_count
+                weight = QUERY_LATENCY_WEIGHT if self.query_latency_at else 1.0
+                self.query_latency += weight * (per_query - self.query_latency)
+                self.query_latency_at = time.time()
+
+    def recent_query_latency(self, max_age):
+        """
+        Average time per SQL query of the latest requests, 0 when no request ran a query in the last max_age seconds
+        """
+        if time.time() - self.query_latency_at > max_age:
+            return 0.0
+        return self.query_latency
+
+    def exposition(self):
+        """
+        Renders the registry in the Prometheus text format
+        """
+        lines = []
+        with self._lock:
+            for name, histograms in (('providers_request_seconds', self.latency),
+                                     ('providers_request_sql_seconds', self.sql_time)):
+                lines.append('# TYPE %s histogram' % name)
+                for (endpoint, method, status_code), histogram in sorted(histograms.items()):
+                    labels = 'endpoint="%s",method="%s",status="%s"' % (endpoint, method, status_code)
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, count))
+                    lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, histogram.count))
+                    lines.append('%s_sum{%s} %f' % (name, labels, histogram.sum))
+                    lines.append('%s_count{%s} %d' % (name, labels, histogram.count))
+            lines.append('# TYPE providers_request_sql_queries_total counter')
+            for (endpoint, method, status_code), queries in sorted(self.sql_queries.items()):
+                lines.append('providers_request_sql_queries_total{endpoint="%s",method="%s",status="%s"} %d' % (
+                    endpoint, method, status_code, queries))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def is_enabled():
+    return get_setting('PROVIDERS_METRICS', 'ENABLED', False)
@@ -0,0 +1,117 @@
+import json
+import logging
+
+from django.db import connections
+from django.http import HttpResponse
+
+from providers import metrics, routers, throttling
+from providers.utils import dumps_json
+
+logger = logging.getLogger('providers.metrics')
+
+
+class InstrumentationMiddleware(object):
+    """
+    Records SQL count and time, serialization and render time of every request, sends them back in a
+    Server-Timing header, logs them as one JSON line and feeds the per-endpoint histograms.
+    Streaming responses are measured up to the first byte only
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not metrics.is_enabled():
+            return self.get_response(request)
+
+        for connection in connections.all():
+            metrics.instrument(connection)
+        request_metrics = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request()
+
+        self.report(request, response, request_metrics)
+        return response
+
+    def report(self, request, response, request_metrics):
+        match = getattr(request, 'resolver_match', None)
+        endpoint = match.view_name if match is not None else 'unmatched'
+        total = request_metrics.total
+
+        timings = [('db', request_metrics.sql_time, '%d queries' % request_metrics.sql_count)]
+        timings += [(phase, seconds, None) for phase, seconds in request_metrics.phases.items()]
+        timings.append(('total', total, None))
+        response['Server-Timing'] = ', '.join(
+            '%s;dur=%.2f' % (name, seconds * 1000) + (';desc="%s"' % desc if desc else '')
+            for name, seconds, desc in timings)
+
+        metrics.registry.observe(endpoint, request.method, response.status_code, request_metrics)
+        logger.info(json.dumps({
+            'endpoint': endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'sql_count': request_metrics.sql_count,
+            'sql_ms': round(request_metrics.sql_time * 1000, 2),
+            'phases_ms': dict((phase, round(seconds * 1000, 2)) for phase, seconds in request_metrics.phases.items()),
+            'total_ms': round(total * 1000, 2),
+        }))
+
+
+def _client_key(request):
+    return request.META.get('HTTP_AUTHORIZATION') or request.META.get('REMOTE_ADDR', '')
+
+
+def _view_class(view_func):
+    return getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+
+
+class ThrottleMiddleware(object):
+    """
+    Rate limits and sheds load for views listing the request method in throttle_methods, answering
+    429 or 503 before the view runs. See providers/throttling.py
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with throttling.request_queue:
+            return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not throttling.is_enabled() or request.method not in getattr(_view_class(view_func), 'throttle_methods', ()):
+            return None
+        rejection = throttling.check(request.META.get('REMOTE_ADDR', ''), request.META.get('HTTP_AUTHORIZATION'),
+                                     throttling.request_queue.load())
+        if rejection is None:
+            return None
+        response = HttpResponse(dumps_json({'detail': rejection.detail}), status=rejection.status,
+                                content_type='application/json')
+        response['Retry-After'] = throttling.retry_after_header(rejection)
+        return response
+
+
+class ReplicaRoutingMiddleware(object):
+    """
+    Lets views read from a replica for the methods they list in replica_methods, unless the client
+    wrote something in the last PROVIDERS_REPLICAS["PIN_SECONDS"]. See providers/routers.py
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with routers.routing() as state:
+            request.db_routing = state
+            response = self.get_response(request)
+            if state.wrote:
+                routers.pin(_client_key(request))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method in getattr(_view_class(view_func), 'replica_methods', ()) and routers.replica_aliases() \
+                and not routers.is_pinned(_client_key(request)):
+            request.db_routing.use_replicas = True
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import providers.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('providers', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='provider',
+            managers=[
+                ('objects', providers.models.ProviderManager()),
+            ],
+        ),
+    ]
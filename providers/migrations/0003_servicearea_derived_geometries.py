@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+from providers.geometry import derived_geometries
+
+# the derived columns as of this migration, later migrations add their own
+DERIVED_GEOMETRY_FIELDS = ('polygon_planar', 'polygon_simplified', 'polygon_core',
+                           'bbox_xmin', 'bbox_ymin', 'bbox_xmax', 'bbox_ymax')
+
+
+def backfill_derived_geometries(apps, schema_editor):
+    ServiceArea = apps.get_model('providers', 'ServiceArea')
+    for area in ServiceArea.objects.only('id', 'polygon').iterator():
+        for field_name, value in derived_geometries(area.polygon).items():
+            if field_name in DERIVED_GEOMETRY_FIELDS:
+                setattr(area, field_name, value)
+        area.save(update_fields=DERIVED_GEOMETRY_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('providers', '0002_provider_manager'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicearea',
+            name='polygon_planar',
+            field=django.contrib.gis.db.models.fields.PolygonField(editable=False, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='servicearea',
+            name='polygon_simplified',
+            field=django.contrib.gis.db.models.fields.PolygonField(editable=False, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='servicearea',
+            name='polygon_core',
+            field=django.contrib.gis.db.models.fields.MultiPolygonField(editable=False, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='servicearea',
+            name='bbox_xmin',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicearea',
+            name='bbox_ymin',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicearea',
+            name='bbox_xmax',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicearea',
+            name='bbox_ymax',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_derived_geometries, migrations.RunPython.noop),
+    ]
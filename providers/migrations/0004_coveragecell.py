@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('providers', '0003_servicearea_derived_geometries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoverageCell',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell_x', models.IntegerField()),
+                ('cell_y', models.IntegerField()),
+                ('full', models.BooleanField(default=False)),
+                ('area', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='coverage_cells', to='providers.ServiceArea')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='coveragecell',
+            index_together=set([('cell_x', 'cell_y')]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('providers', '0004_coveragecell'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicearea',
+            name='subdivided',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ServiceAreaPiece',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('polygon', django.contrib.gis.db.models.fields.PolygonField(geography=True, srid=4326)),
+                ('area', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pieces', to='providers.ServiceArea')),
+            ],
+        ),
+    ]
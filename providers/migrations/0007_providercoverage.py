@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('providers', '0006_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderCoverage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tier', models.PositiveSmallIntegerField()),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=10, null=True)),
+                ('polygon', django.contrib.gis.db.models.fields.MultiPolygonField(srid=4326)),
+                ('polygon_outer', django.contrib.gis.db.models.fields.MultiPolygonField(srid=4326)),
+                ('polygon_inner', django.contrib.gis.db.models.fields.MultiPolygonField(srid=4326)),
+                ('area_count', models.IntegerField()),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='coverage', to='providers.Provider')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='providercoverage',
+            unique_together=set([('provider', 'tier')]),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from providers.geometry import DERIVED_GEOMETRY_FIELDS, derived_geometries
+from providers.utils import get_setting
+
+
+def recompute_derived_geometries(apps, schema_editor):
+    """
+    Rewrites the planar copies, cores and bboxes along the great circle edges, and the pieces cut from them
+    """
+    ServiceArea = apps.get_model('providers', 'ServiceArea')
+    ServiceAreaPiece = apps.get_model('providers', 'ServiceAreaPiece')
+    for area in ServiceArea.objects.only('id', 'polygon').iterator():
+        for field_name, value in derived_geometries(area.polygon).items():
+            setattr(area, field_name, value)
+        area.save(update_fields=DERIVED_GEOMETRY_FIELDS)
+
+    ServiceAreaPiece.objects.all().delete()
+    schema_editor.execute(
+        'INSERT INTO {piece_table} (area_id, polygon) '
+        'SELECT area.id, ST_Subdivide(area.polygon_planar, %s)::geography '
+        'FROM {area_table} area WHERE area.subdivided'.format(
+            piece_table=ServiceAreaPiece._meta.db_table, area_table=ServiceArea._meta.db_table),
+        [get_setting('PROVIDERS_GEOMETRY', 'PIECE_VERTICES', 256)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('providers', '0007_providercoverage'),
+    ]
+
+    operations = [
+        migrations.RunPython(recompute_derived_geometries, migrations.RunPython.noop),
+    ]
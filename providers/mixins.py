@@ -0,0 +1,120 @@
+import hashlib
+from calendar import timegm
+
+from django.db.models import Count, Max
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from providers.pagination import keyset_chunks
+from providers.utils import InvalidArgumentsException, dumps_json, get_setting
+
+
+class StreamingListMixin(object):
+    """
+    Opt-in streaming for list endpoints. "?stream=json" writes the same JSON array as the regular
+    response and, for views with a geojson_geometry_field, "?stream=geojson" writes a GeoJSON
+    FeatureCollection. Rows are read in keyset chunks and serialized one at a time.
+    """
+    geojson_geometry_field = None
+
+    def list(self, request, *args, **kwargs):
+        mode = request.query_params.get('stream', None)
+        if not mode:
+            return super(StreamingListMixin, self).list(request, *args, **kwargs)
+
+        if mode == 'json':
+            start, end, encode = '[', ']', self.encode_json
+            content_type = 'application/json'
+        elif mode == 'geojson' and self.geojson_geometry_field:
+            start, end, encode = '{"type":"FeatureCollection","features":[', ']}', self.encode_feature
+            content_type = 'application/vnd.geo+json'
+        else:
+            raise InvalidArgumentsException('Unsupported stream mode')
+
+        rows = keyset_chunks(self.filter_queryset(self.get_queryset()),
+                             get_setting('PROVIDERS_PAGINATION', 'STREAM_CHUNK_SIZE', 500))
+        return StreamingHttpResponse(self.stream(rows, start, end, encode), content_type=content_type)
+
+    def stream(self, rows, start, end, encode):
+        yield start.encode('utf-8')
+        separator = ''
+        for row in rows:
+            yield (separator + encode(row)).encode('utf-8')
+            separator = ','
+        yield end.encode('utf-8')
+
+    def encode_json(self, row):
+        return dumps_json(self.get_serializer(row).data)
+
+    def encode_feature(self, row):
+        properties = dict(self.get_serializer(row).data)
+        geometry = properties.pop(self.geojson_geometry_field)
+        return dumps_json({'type': 'Feature', 'id': row.pk, 'geometry': geometry, 'properties': properties})
+
+
+class ValuesListMixin(object):
+    """
+    Serves unstreamed list responses from values_list() rows through the serializer's
+    values fast path (see serializers.ValuesSerializerMixin). The JSON is the same as the
+    regular list response, only built without model instances
+    """
+
+    def list(self, request, *args, **kwargs):
+        serializer_class = self.get_serializer_class()
+        if request.query_params.get('stream', None) or \
+                not get_setting('PROVIDERS_JSON', 'VALUES_SERIALIZERS', True):
+            return super(ValuesListMixin, self).list(request, *args, **kwargs)
+
+        rows = serializer_class.values_queryset(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer_class.values_data(page))
+        return Response(serializer_class.values_data(rows))
+
+
+class ConditionalGetMixin(object):
+    """
+    ETag and Last-Modified on GET, so a matching If-None-Match or If-Modified-Since gets a 304 without
+    serializing anything. Lists take them from max(modified) and the row count in one aggregate query.
+    Details take them from the object itself, which the response then reuses, so they stay one query.
+    Deleting a list row leaves max(modified) as it was, so lists only answer 304 to If-None-Match.
+    Writes that skip auto_now, like queryset.update(), are not noticed
+    """
+    _conditional_object = None
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified, is_list = self.get_validators(request)
+        timestamp = timegm(last_modified.utctimetuple()) if last_modified is not None else None
+        response = get_conditional_response(request, etag=etag, last_modified=None if is_list else timestamp)
+        if response is None:
+            response = super(ConditionalGetMixin, self).get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = quote_etag(etag)
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def get_object(self):
+        if self._conditional_object is not None:
+            return self._conditional_object
+        return super(ConditionalGetMixin, self).get_object()
+
+    def get_validators(self, request):
+        """
+        Returns (etag, last modified, is list) for the response a GET would get. A missing object
+        raises the regular 404
+        """
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        is_list = lookup_url_kwarg not in self.kwargs
+        if is_list:
+            state = self.filter_queryset(self.get_queryset()).aggregate(modified=Max('modified'), count=Count('pk'))
+        else:
+            self._conditional_object = self.get_object()
+            state = {'modified': self._conditional_object.modified, 'count': 1}
+
+        modified = state['modified'].isoformat() if state['modified'] is not None else ''
+        etag = hashlib.md5(('%s|%s|%s|%s' % (request.get_full_path(), request.user.pk, state['count'],
+                                             modified)).encode('utf-8')).hexdigest()
+        return etag, state['modified'], is_list
@@ -1,10 +1,14 @@
 from __future__ import unicode_literals
 
 from django.contrib.auth.base_user import AbstractBaseUser
-from django.contrib.auth.models import User
+from django.contrib.auth.models import User, UserManager
 from django.contrib.gis.db import models
+from django.db import connections, router, transaction
 from rest_framework.authtoken.models import Token
 
+from providers.geometry import DERIVED_GEOMETRY_FIELDS, derived_geometries
+from providers.utils import get_setting
+
 
 class DateTimeMixin(models.Model):
     created = models.DateTimeField(auto_now_add=True)
@@ -14,26 +18,165 @@ class DateTimeMixin(models.Model):
         abstract = True
 
 
+class ProviderManager(UserManager):
+    def bulk_create_with_tokens(self, providers, batch_size=1000):
+        """
+        Inserts providers together with their auth tokens using one multi-row INSERT per table and batch,
+        instead of the three round trips Provider.save() makes per row. Needs a backend that returns ids
+        from bulk inserts (PostgreSQL). Like bulk_create, save() is not called and no signals are sent
+        """
+        parent_fields = [field for field in User._meta.local_concrete_fields if not field.primary_key]
+        child_fields = Provider._meta.local_concrete_fields
+        with transaction.atomic(using=self.db):
+            for start in range(0, len(providers), batch_size):
+                batch = providers[start:start + batch_size]
+                for provider in batch:
+                    provider.username = provider.email
+                users = [User(**dict((field.attname, getattr(provider, field.attname)) for field in parent_fields))
+                         for provider in batch]
+                User.objects.using(self.db).bulk_create(users)
+                for provider, user in zip(batch, users):
+                    provider.id = provider.user_ptr_id = user.pk
+                    provider._state.adding = False
+                    provider._state.db = self.db
+                self._insert(batch, fields=child_fields, using=self.db)
+                Token.objects.using(self.db).bulk_create(
+                    [Token(user_id=provider.pk, key=Token().generate_key()) for provider in batch])
+        return providers
+
+
 class Provider(User, DateTimeMixin):
     name = models.CharField(max_length=100)
     language = models.CharField(max_length=100)
     currency = models.CharField(max_length=3)
     phone_number = models.CharField(max_length=15)
 
+    objects = ProviderManager()
+
     def __unicode__(self):
         return self.name
 
     def save(self, *args, **kwargs):
-        create_token = False
-        try:
-            provider = Provider.objects.get(id=self.id)
-        except Provider.DoesNotExist:
-            create_token = True
-
         self.username = self.email  # setting username as email as username taken in api
-        super(Provider, self).save(*args, **kwargs)
-        if create_token:
-            Token.objects.create(user=self)  # creating token for provider auth
+        adding = self._state.adding
+        # atomic for updates too, post_save receivers write the change log in the same transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            super(Provider, self).save(*args, **kwargs)
+            if adding:
+                Token.objects.create(user=self)  # creating token for provider auth
+
+
+class ServiceAreaManager(models.Manager):
+    def for_point(self, point):
+        """
+        (name, price, provider name) rows of the areas containing the point, the values_list() shape
+        ServiceAreaQueryResponseSerializer.to_values reads, with the provider joined in a single query
+        """
+        return self.filter(self.contains_point_q(point)).values_list('name', 'price', 'provider__name')
+
+    def for_point_in_cell(self, point, cell_x, cell_y):
+        """
+        Same rows as for_point, read through the coverage grid (see providers/coverage.py): areas
+        covering the whole cell match on the indexed cell lookup alone, only partial and untiled ones are tested
+        """
+        untiled = CoverageCell.UNTILED
+        return self.filter((models.Q(coverage_cells__cell_x=cell_x, coverage_cells__cell_y=cell_y) |
+                            models.Q(coverage_cells__cell_x=untiled, coverage_cells__cell_y=untiled)) & (
+            models.Q(coverage_cells__full=True) | self.contains_point_q(point))).values_list(
+            'name', 'price', 'provider__name')
+
+    def contains_point_q(self, point):
+        """
+        Geography bbox prefilter on the polygon's GiST index, then the cheap planar core test, then the
+        exact geography test only for points near the polygon edge, against the area's pieces when it is
+        subdivided. The geography box holds the great circle edges, a planar one would miss their bow
+        """
+        pieces = ServiceAreaPiece.objects.filter(polygon__intersects=point).values('area_id')
+        return models.Q(polygon__bboverlaps=point) & (
+            models.Q(polygon_core__intersects=point) |
+            models.Q(subdivided=False, polygon__intersects=point) |
+            models.Q(subdivided=True, pk__in=pieces))
+
+    def intersecting(self, geometry):
+        """
+        (name, price, provider name) rows of the areas intersecting a LineString or Polygon, like for_point
+        """
+        return self.filter(self.intersects_q(geometry)).values_list('name', 'price', 'provider__name')
+
+    def intersects_q(self, geometry):
+        """
+        contains_point_q for lines and polygons: the geography bbox overlap prefilter, then the core,
+        then the exact geography test against the polygon or its pieces
+        """
+        pieces = ServiceAreaPiece.objects.filter(polygon__intersects=geometry).values('area_id')
+        return models.Q(polygon__bboverlaps=geometry) & (
+            models.Q(polygon_core__intersects=geometry) |
+            models.Q(subdivided=False, polygon__intersects=geometry) |
+            models.Q(subdivided=True, pk__in=pieces))
+
+    def for_trip(self, pickup, dropoff):
+        """
+        (name, price, provider name, at pickup, at dropoff) rows of the areas containing either point,
+        of the providers with areas containing both, in a single query
+        """
+        pickup_q, dropoff_q = self.contains_point_q(pickup), self.contains_point_q(dropoff)
+        return self.filter(pickup_q | dropoff_q).filter(
+            provider_id__in=self.filter(pickup_q).values('provider_id')).filter(
+            provider_id__in=self.filter(dropoff_q).values('provider_id')).annotate(
+            at_pickup=models.Case(models.When(pickup_q, then=models.Value(True)), default=models.Value(False),
+                                  output_field=models.BooleanField()),
+            at_dropoff=models.Case(models.When(dropoff_q, then=models.Value(True)), default=models.Value(False),
+                                   output_field=models.BooleanField())).values_list(
+            'name', 'price', 'provider__name', 'at_pickup', 'at_dropoff').order_by('id')
+
+    def subdivide(self, area_ids):
+        """
+        Rewrites the pieces of the areas with ST_Subdivide, in one statement for all of them.
+        Only areas flagged subdivided get pieces
+        """
+        ServiceAreaPiece.objects.filter(area_id__in=area_ids).delete()
+        sql = (
+            'INSERT INTO {piece_table} (area_id, polygon) '
+            'SELECT area.id, ST_Subdivide(area.polygon_planar, %s)::geography '
+            'FROM {area_table} area WHERE area.subdivided AND area.id = ANY(%s)'
+        ).format(piece_table=ServiceAreaPiece._meta.db_table, area_table=self.model._meta.db_table)
+        with connections[router.db_for_write(ServiceAreaPiece)].cursor() as cursor:
+            cursor.execute(sql, [get_setting('PROVIDERS_GEOMETRY', 'PIECE_VERTICES', 256), list(area_ids)])
+
+    def matching_points(self, points):
+        """
+        Resolves a list of (lat, lng) points with a single set based spatial join.
+        Returns one list of (name, price, provider name) rows per point, in input order
+        """
+        results = [[] for _ in points]
+        if not points:
+            return results
+
+        with connections[router.db_for_read(self.model)].cursor() as cursor:
+            cursor.execute(*self.matching_points_sql(points))
+            for idx, name, price, provider_name in cursor.fetchall():
+                results[idx - 1].append((name, price, provider_name))
+        return results
+
+    def matching_points_sql(self, points):
+        """
+        (sql, params) of the spatial join behind matching_points, yielding (point index, name, price, provider name)
+        """
+        sql = (
+            'SELECT pts.idx, area.name, area.price, provider.name '
+            'FROM unnest(%s::double precision[], %s::double precision[]) WITH ORDINALITY AS pts(lat, lng, idx) '
+            'JOIN {area_table} area '
+            'ON area.polygon && ST_SetSRID(ST_MakePoint(pts.lng, pts.lat), 4326)::geography '
+            'AND (ST_Intersects(area.polygon_core, ST_SetSRID(ST_MakePoint(pts.lng, pts.lat), 4326)) '
+            'OR (NOT area.subdivided '
+            'AND ST_Intersects(area.polygon, ST_SetSRID(ST_MakePoint(pts.lng, pts.lat), 4326)::geography)) '
+            'OR (area.subdivided AND EXISTS (SELECT 1 FROM {piece_table} piece WHERE piece.area_id = area.id '
+            'AND ST_Intersects(piece.polygon, ST_SetSRID(ST_MakePoint(pts.lng, pts.lat), 4326)::geography)))) '
+            'JOIN {provider_table} provider ON provider.user_ptr_id = area.provider_id '
+            'ORDER BY pts.idx, area.id'
+        ).format(area_table=self.model._meta.db_table, provider_table=Provider._meta.db_table,
+                 piece_table=ServiceAreaPiece._meta.db_table)
+        return sql, [[lat for lat, lng in points], [lng for lat, lng in points]]
 
 
 class ServiceArea(DateTimeMixin):
@@ -43,5 +186,100 @@ class ServiceArea(DateTimeMixin):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     polygon = models.PolygonField(geography=True)  # Polygon field with 3d measurements from GeoDjango
 
+    # planar copies and bounding box of polygon, kept in sync by save(), see providers/geometry.py
+    polygon_planar = models.PolygonField(null=True, editable=False)
+    polygon_simplified = models.PolygonField(null=True, editable=False)
+    polygon_core = models.MultiPolygonField(null=True, editable=False)
+    bbox_xmin = models.FloatField(null=True, editable=False)
+    bbox_ymin = models.FloatField(null=True, editable=False)
+    bbox_xmax = models.FloatField(null=True, editable=False)
+    bbox_ymax = models.FloatField(null=True, editable=False)
+    subdivided = models.BooleanField(default=False, editable=False)  # point tests go through the pieces
+
+    objects = ServiceAreaManager()
+
     def __unicode__(self):
         return self.name
+
+    @property
+    def bbox(self):
+        """
+        (xmin, ymin, xmax, ymax) of the area, great circle edges included, see providers/geometry.py
+        """
+        return self.bbox_xmin, self.bbox_ymin, self.bbox_xmax, self.bbox_ymax
+
+    def update_derived_geometries(self):
+        """
+        Recomputes the planar, simplified and bbox columns from polygon. Bulk paths that skip save() call this
+        """
+        for field_name, value in derived_geometries(self.polygon).items():
+            setattr(self, field_name, value)
+
+    def save(self, *args, **kwargs):
+        self.update_derived_geometries()
+        update_fields = kwargs.get('update_fields', None)
+        if update_fields is not None and 'polygon' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | set(DERIVED_GEOMETRY_FIELDS)
+        # new areas only need pieces when subdivided, updated ones may have stale pieces to drop
+        rewrite_pieces = self.subdivided if self._state.adding else update_fields is None or 'polygon' in update_fields
+        with transaction.atomic(using=kwargs.get('using')):
+            super(ServiceArea, self).save(*args, **kwargs)
+            if rewrite_pieces:
+                ServiceArea.objects.subdivide([self.pk])
+
+
+class ServiceAreaPiece(models.Model):
+    """
+    Piece of a subdivided ServiceArea.polygon, see providers/geometry.py
+    """
+    area = models.ForeignKey('ServiceArea', related_name="pieces")
+    polygon = models.PolygonField(geography=True)
+
+
+class CoverageCell(models.Model):
+    """
+    One row per coverage grid cell an area touches, maintained by providers/coverage.py
+    """
+    UNTILED = -2 ** 31  # the cell of areas too large to tile
+    cell_x = models.IntegerField()
+    cell_y = models.IntegerField()
+    area = models.ForeignKey('ServiceArea', related_name="coverage_cells")
+    full = models.BooleanField(default=False)  # the area covers the whole cell
+
+    class Meta:
+        index_together = (('cell_x', 'cell_y'),)
+
+
+class ProviderCoverage(models.Model):
+    """
+    Union of a provider's service areas, of all of them (tier 0) or of those priced up to
+    PRICE_TIERS[tier - 1], maintained by providers/provider_coverage.py
+    """
+    provider = models.ForeignKey('Provider', related_name="coverage")
+    tier = models.PositiveSmallIntegerField()
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True)  # null for tier 0
+    polygon = models.MultiPolygonField()  # planar union of the areas' polygons
+    polygon_outer = models.MultiPolygonField()  # grown by BORDER_MARGIN, holds every point of the areas
+    polygon_inner = models.MultiPolygonField()  # shrunk by BORDER_MARGIN, each of its points is in an area
+    area_count = models.IntegerField()
+
+    class Meta:
+        unique_together = (('provider', 'tier'),)
+
+
+class Change(models.Model):
+    """
+    One row per Provider or ServiceArea write, appended by providers/changes.py
+    """
+    ACTIONS = (('create', 'create'), ('update', 'update'), ('delete', 'delete'))
+
+    id = models.BigAutoField(primary_key=True)
+    txid = models.BigIntegerField()  # txid_current() of the writing transaction
+    created = models.DateTimeField(auto_now_add=True)
+    model = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=6, choices=ACTIONS)
+    data = models.TextField(null=True)  # the record as JSON, null for deletes
+
+    class Meta:
+        index_together = (('txid', 'id'),)
@@ -0,0 +1,258 @@
+"""
+Offline point-in-polygon evaluation for analytics replays, driven by the match_points command.
+
+Every service area is loaded once into flat NumPy arrays: its stored bounding box and the edges of
+all the rings of its planar copy, which follows the great circle edges (see providers/geometry.py). Points are then matched in blocks: sorted by longitude so each area's bbox selects
+its candidates with two binary searches, and the candidates are decided by a vectorized even-odd ray
+cast. Blocks are spread over worker processes and the matches come back as columns, in input order.
+
+Tests are planar on that copy, so they can only differ from the geography test of the API for points
+between its segments and the arcs they stand for, within half of PROVIDERS_GEOMETRY["BORDER_MARGIN"]
+of an edge for areas with a core. Points exactly on an
+edge may fall either way. NumPy, and pyarrow for Parquet output, are only needed here and are
+imported lazily.
+"""
+import csv
+import multiprocessing
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models import BinaryField, F, Func
+
+from providers.geometry import wkb_to_geojson
+from providers.models import ServiceArea
+from providers.serializers import format_price
+
+COLUMNS = ('point', 'lat', 'lng', 'area_id', 'area', 'provider', 'price')
+MAX_PAIRS = 2 ** 22  # point x edge pairs ray cast at once, bounds the scratch arrays
+
+
+def _require_numpy():
+    if np is None:
+        raise ImproperlyConfigured('Offline matching needs numpy')
+
+
+class AreaSet(object):
+    """
+    Service areas as NumPy arrays. The edges of area i are edges[offsets[i]:offsets[i + 1]], one
+    (x1, y1, x2, y2) row per edge of every ring, holes included
+    """
+
+    def __init__(self, ids, names, providers, prices, bboxes, edges, offsets):
+        self.ids = ids
+        self.names = names
+        self.providers = providers
+        self.prices = prices
+        self.bboxes = bboxes
+        self.edges = edges
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def load_areas(queryset=None):
+    """
+    Reads the planar copies and bounding boxes of the queryset (all areas by default) into an AreaSet
+    with one query
+    """
+    _require_numpy()
+    queryset = ServiceArea.objects.all() if queryset is None else queryset
+    rows = queryset.annotate(
+        polygon_wkb=Func(F('polygon_planar'), function='ST_AsBinary', output_field=BinaryField())).values_list(
+        'id', 'name', 'provider__name', 'price', 'polygon_wkb', 'bbox_xmin', 'bbox_ymin', 'bbox_xmax',
+        'bbox_ymax').order_by('id')
+
+    ids, names, providers, prices, bboxes, edges, offsets = [], [], [], [], [], [], [0]
+    for area_id, name, provider_name, price, polygon_wkb, xmin, ymin, xmax, ymax in rows.iterator():
+        rings = [np.array(ring, dtype=np.float64)[:, :2] for ring in wkb_to_geojson(polygon_wkb)['coordinates']]
+        for ring in rings:
+            edges.append(np.hstack([ring[:-1], ring[1:]]))
+        offsets.append(offsets[-1] + sum(len(ring) - 1 for ring in rings))
+        bboxes.append((xmin, ymin, xmax, ymax))
+        ids.append(area_id)
+        names.append(name)
+        providers.append(provider_name)
+        prices.append(format_price(price))
+
+    return AreaSet(
+        np.array(ids, dtype=np.int64),
+        np.array(names, dtype=object),
+        np.array(providers, dtype=object),
+        np.array(prices, dtype=object),
+        np.array(bboxes, dtype=np.float64).reshape(-1, 4),
+        np.vstack(edges) if edges else np.empty((0, 4)),
+        np.array(offsets, dtype=np.int64),
+    )
+
+
+def ray_cast(xs, ys, edges):
+    """
+    Even-odd rule: a point is inside when a ray towards +x crosses the edges an odd number of times
+    """
+    inside = np.zeros(len(xs), dtype=bool)
+    x1, y1, x2, y2 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+    step = max(1, MAX_PAIRS // max(len(edges), 1))
+    for start in range(0, len(xs), step):
+        px, py = xs[start:start + step, None], ys[start:start + step, None]
+        spans = (y1 > py) != (y2 > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        inside[start:start + step] = np.count_nonzero(spans & (px < x_cross), axis=1) % 2 == 1
+    return inside
+
+
+def match_block(areas, lats, lngs):
+    """
+    Returns (point index, area index) arrays of the matches among the points, ordered by point then area id
+    """
+    order = np.argsort(lngs, kind='mergesort')
+    sorted_lngs = lngs[order]
+    starts = np.searchsorted(sorted_lngs, areas.bboxes[:, 0], side='left')
+    ends = np.searchsorted(sorted_lngs, areas.bboxes[:, 2], side='right')
+
+    point_parts, area_parts = [], []
+    for area in np.nonzero(ends > starts)[0]:
+        candidates = order[starts[area]:ends[area]]
+        ys = lats[candidates]
+        candidates = candidates[(ys >= areas.bboxes[area, 1]) & (ys <= areas.bboxes[area, 3])]
+        if not len(candidates):
+            continue
+        edges = areas.edges[areas.offsets[area]:areas.offsets[area + 1]]
+        hits = candidates[ray_cast(lngs[candidates], lats[candidates], edges)]
+        point_parts.append(hits)
+        area_parts.append(np.full(len(hits), area, dtype=np.int64))
+
+    if not point_parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    points, area_index = np.concatenate(point_parts), np.concatenate(area_parts)
+    order = np.lexsort((area_index, points))
+    return points[order], area_index[order]
+
+
+def to_columns(areas, offset, lats, lngs, points, area_index):
+    return {
+        'point': points + offset,
+        'lat': lats[points],
+        'lng': lngs[points],
+        'area_id': areas.ids[area_index],
+        'area': areas.names[area_index],
+        'provider': areas.providers[area_index],
+        'price': areas.prices[area_index],
+    }
+
+
+def match_points(lats, lngs, areas=None):
+    """
+    Result columns for in-memory sequences of points, matched in this process
+    """
+    areas = load_areas() if areas is None else areas
+    lats, lngs = np.asarray(lats, dtype=np.float64), np.asarray(lngs, dtype=np.float64)
+    points, area_index = match_block(areas, lats, lngs)
+    return to_columns(areas, 0, lats, lngs, points, area_index)
+
+
+_worker_areas = None
+
+
+def _init_worker(areas):
+    global _worker_areas
+    _worker_areas = areas
+
+
+def _match_in_worker(block):
+    offset, lats, lngs = block
+    points, area_index = match_block(_worker_areas, lats, lngs)
+    return offset, lats, lngs, points, area_index
+
+
+def match_blocks(areas, blocks, processes=None):
+    """
+    Yields result columns for each (offset, lats, lngs) block, in order. Blocks are matched on
+    processes worker processes, one per core by default; processes=1 matches them in this process
+    """
+    if processes == 1:
+        for offset, lats, lngs in blocks:
+            points, area_index = match_block(areas, lats, lngs)
+            yield to_columns(areas, offset, lats, lngs, points, area_index)
+        return
+
+    connection.close()  # forked workers must not share the parent's database socket
+    pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(areas,))
+    try:
+        for result in pool.imap(_match_in_worker, blocks):
+            yield to_columns(areas, *result)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def read_points(stream, block_size=100000):
+    """
+    Yields (offset, lats, lngs) blocks of block_size points from "lat,lng" CSV lines. A header line is skipped
+    """
+    _require_numpy()
+    offset, lats, lngs = 0, [], []
+    for line_number, row in enumerate(csv.reader(stream), 1):
+        if not row:
+            continue
+        try:
+            lat, lng = float(row[0]), float(row[1])
+        except (IndexError, ValueError):
+            if line_number == 1:
+                continue
+            raise ValueError('line %d: expected "lat,lng"' % line_number)
+        lats.append(lat)
+        lngs.append(lng)
+        if len(lats) == block_size:
+            yield offset, np.array(lats), np.array(lngs)
+            offset, lats, lngs = offset + len(lats), [], []
+    if lats:
+        yield offset, np.array(lats), np.array(lngs)
+
+
+class CSVWriter(object):
+    def __init__(self, stream):
+        self.writer = csv.writer(stream)
+        self.writer.writerow(COLUMNS)
+
+    def write(self, columns):
+        self.writer.writerows(zip(*[columns[name].tolist() for name in COLUMNS]))
+
+    def close(self):
+        pass
+
+
+class ParquetWriter(object):
+    """
+    Writes every block as a Parquet row group, so the output is never held in memory as a whole
+    """
+
+    def __init__(self, path):
+        if pyarrow is None:
+            raise ImproperlyConfigured('Parquet output needs pyarrow')
+        self.schema = pyarrow.schema([
+            ('point', pyarrow.int64()), ('lat', pyarrow.float64()), ('lng', pyarrow.float64()),
+            ('area_id', pyarrow.int64()), ('area', pyarrow.string()), ('provider', pyarrow.string()),
+            ('price', pyarrow.string()),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, columns):
+        arrays = [pyarrow.array(columns[field.name], type=field.type) for field in self.schema]
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
@@ -0,0 +1,46 @@
+from django.utils import six
+from rest_framework.pagination import CursorPagination, _positive_int
+
+from providers.utils import get_setting
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Opt-in keyset pagination on the primary key. Lists stay unpaginated unless the client sends
+    a "cursor" or "page_size" query param, so existing clients keep getting plain arrays
+    """
+    ordering = 'pk'  # ids grow with "created", and unlike it are unique
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        page_size = get_setting('PROVIDERS_PAGINATION', 'PAGE_SIZE', 100)
+        try:
+            page_size = _positive_int(params[self.page_size_query_param], strict=True)
+        except (KeyError, ValueError):
+            pass
+        return min(page_size, get_setting('PROVIDERS_PAGINATION', 'MAX_PAGE_SIZE', 1000))
+
+    def _get_position_from_instance(self, instance, ordering):
+        if isinstance(instance, tuple):
+            return six.text_type(instance[0])  # values_list() rows carry the pk first
+        return super(KeysetPagination, self)._get_position_from_instance(instance, ordering)
+
+
+def keyset_chunks(queryset, chunk_size):
+    """
+    Yields the rows of the queryset in pk order, fetching chunk_size rows per query so memory
+    use does not grow with the size of the result
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(chunk[:chunk_size])
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        last_pk = rows[-1].pk
@@ -0,0 +1,24 @@
+from rest_framework.parsers import BaseParser
+
+
+class CSVPointsParser(BaseParser):
+    """
+    Parses a text/csv body of "lat,lng" lines into a list of [lat, lng] string pairs
+    """
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        text = stream.read().decode('utf-8')
+        return [line.split(',') for line in text.splitlines() if line.strip()]
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline delimited JSON lazily, yielding one decoded record per line
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        from providers.bulk import read_ndjson
+
+        return read_ndjson(stream)
@@ -0,0 +1,190 @@
+"""
+Per-provider coverage: the union of every provider's service areas, kept in ProviderCoverage.
+
+Tier 0 is the union of all the provider's areas. Tier i is the union of the areas priced up to
+PRICE_TIERS[i - 1], so "does the provider serve this point for at most that price" is a single
+lookup as well. The unions are built from the areas' planar copies, which follow the great circle
+edges (see providers/geometry.py). Next to the union each row keeps polygon_outer, the union of the
+copies grown by BORDER_MARGIN plus the bow left between their points, and polygon_inner, the union of
+the areas' cores. A point outside polygon_outer is in none of the areas and a point inside
+polygon_inner is in one of them. Only points between the two need the per-area test.
+
+New areas are merged into the existing unions and updated areas have the unions of their provider
+recomputed, in the transaction of the write. Deleting areas empties the inner unions of their
+providers right away and recomputes each provider once, after the transaction commits. After
+enabling the table or changing PRICE_TIERS run the rebuild_provider_coverage command.
+"""
+import threading
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from providers.models import Provider, ProviderCoverage, ServiceArea
+from providers.utils import get_setting
+
+# each area grown by the margin and by what is left of the great circle bow past its planar copy
+GROWN = ('ST_Buffer(area.polygon_planar, {margin} + GREATEST(area.bbox_ymax - ST_YMax(area.polygon_planar), '
+         'ST_YMin(area.polygon_planar) - area.bbox_ymin, 0))')
+EMPTY_SQL = "ST_GeomFromText('MULTIPOLYGON EMPTY', 4326)"
+
+UNION_SQL = (
+    'INSERT INTO {coverage_table} AS coverage '
+    '(provider_id, tier, max_price, polygon, polygon_outer, polygon_inner, area_count) '
+    'SELECT area.provider_id, %s, %s, '
+    'ST_Multi(ST_CollectionExtract(ST_Union(area.polygon_planar), 3)), '
+    'ST_Multi(ST_CollectionExtract(ST_Union(' + GROWN + '), 3)), '
+    'COALESCE(ST_Multi(ST_CollectionExtract(ST_Union(area.polygon_core), 3)), ' + EMPTY_SQL + '), '
+    'count(*) FROM {area_table} area WHERE {where} GROUP BY area.provider_id '
+    'ON CONFLICT (provider_id, tier) DO UPDATE SET {update}'
+)
+
+REPLACE = ('polygon = EXCLUDED.polygon, polygon_outer = EXCLUDED.polygon_outer, '
+           'polygon_inner = EXCLUDED.polygon_inner, area_count = EXCLUDED.area_count')
+
+EMPTY_INNER_SQL = ('UPDATE {coverage_table} SET polygon_inner = ' + EMPTY_SQL +
+                   ' WHERE provider_id = ANY(%s) AND NOT ST_IsEmpty(polygon_inner)')
+
+MERGE = ', '.join(
+    '{0} = ST_Multi(ST_CollectionExtract(ST_Union(coverage.{0}, EXCLUDED.{0}), 3))'.format(column)
+    for column in ('polygon', 'polygon_outer', 'polygon_inner')) + ', area_count = coverage.area_count + EXCLUDED.area_count'
+
+_local = threading.local()
+
+
+def is_enabled():
+    return get_setting('PROVIDERS_PROVIDER_COVERAGE', 'ENABLED', False)
+
+
+def tiers():
+    """
+    (tier, max price) pairs, tier 0 (None, every area) first
+    """
+    prices = get_setting('PROVIDERS_PROVIDER_COVERAGE', 'PRICE_TIERS', ())
+    return [(0, None)] + [(index, Decimal(str(price))) for index, price in enumerate(sorted(prices), 1)]
+
+
+def _write_unions(where, params, update):
+    margin = get_setting('PROVIDERS_GEOMETRY', 'BORDER_MARGIN', 0.001)
+    with connection.cursor() as cursor:
+        for tier, max_price in tiers():
+            tier_where = where if max_price is None else where + ' AND area.price <= %s'
+            tier_params = list(params) if max_price is None else list(params) + [max_price]
+            sql = UNION_SQL.format(coverage_table=ProviderCoverage._meta.db_table,
+                                   area_table=ServiceArea._meta.db_table, where=tier_where,
+                                   update=update, margin=float(margin))
+            cursor.execute(sql, [tier, max_price] + tier_params)
+
+
+def areas_created(area_ids):
+    """
+    Merges newly created areas into their providers' unions
+    """
+    if area_ids:
+        _write_unions('area.id = ANY(%s)', [list(area_ids)], MERGE)
+
+
+def rebuild(provider_ids=None):
+    """
+    Recomputes the unions of the providers, of every provider when provider_ids is None
+    """
+    with transaction.atomic():
+        if provider_ids is None:
+            ProviderCoverage.objects.all().delete()
+            _write_unions('TRUE', [], REPLACE)
+            return
+        provider_ids = list(set(provider_ids))
+        _write_unions('area.provider_id = ANY(%s)', [provider_ids], REPLACE)
+        # the upsert leaves the rows of tiers the providers no longer have any area in
+        for tier, max_price in tiers():
+            areas = ServiceArea.objects.filter(provider_id__in=provider_ids)
+            if max_price is not None:
+                areas = areas.filter(price__lte=max_price)
+            ProviderCoverage.objects.filter(provider_id__in=provider_ids, tier=tier).exclude(
+                provider_id__in=areas.values('provider_id')).delete()
+        ProviderCoverage.objects.filter(provider_id__in=provider_ids, tier__gt=len(tiers()) - 1).delete()
+
+
+def pending_rebuilds():
+    """
+    This thread's set of the providers whose areas were deleted since the last rebuild on commit
+    """
+    if not hasattr(_local, 'provider_ids'):
+        _local.provider_ids = set()
+    return _local.provider_ids
+
+
+def _rebuild_pending():
+    """
+    on_commit callback queued by every delete. The first one to run recomputes the pending providers,
+    once each, the others find nothing left. Providers left pending by a rolled back transaction are
+    recomputed at the next commit, which is harmless
+    """
+    provider_ids = set(pending_rebuilds())
+    pending_rebuilds().clear()
+    if provider_ids:
+        rebuild(provider_ids)
+
+
+def areas_deleted(provider_ids):
+    """
+    Empties the inner unions of the providers, so lookups near the deleted areas take the per-area test
+    until their rebuild when the transaction commits. Unions already emptied are not written again
+    """
+    provider_ids = set(provider_ids)
+    pending_rebuilds().update(provider_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(EMPTY_INNER_SQL.format(coverage_table=ProviderCoverage._meta.db_table), [list(provider_ids)])
+    transaction.on_commit(_rebuild_pending)
+
+
+def _tiers_for(max_price):
+    """
+    The tier whose every area is priced at most max_price, and the smallest tier holding every such
+    area. Either may be None
+    """
+    if max_price is None:
+        return 0, 0
+    within, covering = None, 0
+    for tier, tier_price in tiers()[1:]:
+        if tier_price <= max_price:
+            within = tier
+        elif covering == 0:
+            covering = tier
+    return within, covering
+
+
+def providers_q(point, max_price=None):
+    """
+    Q on Provider for the providers with an area containing the point, priced at most max_price
+    when given. Decided by the unions where they can, by the per-area test for points near the edges
+    """
+    areas = ServiceArea.objects.filter(ServiceArea.objects.contains_point_q(point))
+    if max_price is not None:
+        areas = areas.filter(price__lte=max_price)
+    if not is_enabled():
+        return Q(pk__in=areas.values('provider_id'))
+
+    within, covering = _tiers_for(max_price)
+    candidates = ProviderCoverage.objects.filter(tier=covering, polygon_outer__intersects=point).values('provider_id')
+    q = Q(pk__in=areas.filter(provider_id__in=candidates).values('provider_id'))
+    if within is not None:
+        q |= Q(pk__in=ProviderCoverage.objects.filter(tier=within, polygon_inner__intersects=point).values('provider_id'))
+    return q
+
+
+def providers_for_point(point, max_price=None):
+    """
+    (id, name) rows of the providers serving the point, in one query
+    """
+    return Provider.objects.filter(providers_q(point, max_price)).values_list('id', 'name').order_by('id')
+
+
+def prune(rows, point):
+    """
+    Narrows a ServiceArea queryset to the providers whose coverage may hold the point, before the per-area test
+    """
+    if not (is_enabled() and get_setting('PROVIDERS_PROVIDER_COVERAGE', 'PRUNE', False)):
+        return rows
+    return rows.filter(provider_id__in=ProviderCoverage.objects.filter(
+        tier=0, polygon_outer__intersects=point).values('provider_id'))
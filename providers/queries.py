@@ -0,0 +1,243 @@
+"""
+Point lookups behind get_areas/ and get_areas/batch/, shared by the DRF views and the ASGI query path,
+the route, region and trip lookups behind get_areas/shape/ and get_areas/trip/ and the provider
+lookups behind get_providers/
+"""
+import json
+import math
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.gis.gdal import GDALException
+from django.contrib.gis.geos import GEOSException, GEOSGeometry, Point, Polygon
+
+from providers import cache, coverage, provider_coverage, spatial_index
+from providers.models import ServiceArea
+from providers.serializers import ServiceAreaQueryResponseSerializer
+from providers.utils import InvalidArgumentsException, get_setting
+
+
+def _finite(value):
+    """
+    float(value), refusing the nan and infinities float() accepts
+    """
+    number = float(value)
+    if math.isnan(number) or math.isinf(number):
+        raise ValueError('%r is not a finite number' % (value,))
+    return number
+
+
+def parse_point(lat, lng):
+    if not (lat and lng):
+        raise InvalidArgumentsException
+    try:
+        return _finite(lat), _finite(lng)
+    except (TypeError, ValueError):
+        raise InvalidArgumentsException
+
+
+def parse_points(data):
+    """
+    Accepts a list of [lat, lng] pairs or {"lat": .., "lng": ..} objects, optionally wrapped in {"points": [..]}
+    """
+    if isinstance(data, dict):
+        data = data.get('points', None)
+    if not isinstance(data, list) or not data:
+        raise InvalidArgumentsException
+    if len(data) > get_setting('PROVIDERS_BATCH_QUERY', 'MAX_POINTS', 10000):
+        raise InvalidArgumentsException('Too many points in one batch')
+
+    points = []
+    for item in data:
+        try:
+            if isinstance(item, dict):
+                lat, lng = item['lat'], item['lng']
+            else:
+                lat, lng = item
+            points.append((_finite(lat), _finite(lng)))
+        except (KeyError, TypeError, ValueError):
+            raise InvalidArgumentsException
+    return points
+
+
+SHAPE_TYPES = ('LineString', 'Polygon')
+
+
+def parse_bbox(value):
+    """
+    Parses a "min_lng,min_lat,max_lng,max_lat" bbox, in GeoJSON order, into a Polygon
+    """
+    try:
+        xmin, ymin, xmax, ymax = [_finite(part) for part in value.split(',')]
+    except (AttributeError, ValueError):
+        raise InvalidArgumentsException
+    if not (xmin < xmax and ymin < ymax):
+        raise InvalidArgumentsException('bbox must be min_lng,min_lat,max_lng,max_lat')
+    bbox = Polygon.from_bbox((xmin, ymin, xmax, ymax))
+    bbox.srid = 4326
+    return bbox
+
+
+def parse_shape(data):
+    """
+    Accepts a GeoJSON LineString (a route) or Polygon (a region) geometry, or a Feature carrying one
+    """
+    if isinstance(data, dict) and data.get('type') == 'Feature':
+        data = data.get('geometry', None)
+    if not isinstance(data, dict) or data.get('type') not in SHAPE_TYPES:
+        raise InvalidArgumentsException('Expected a GeoJSON %s geometry' % ' or '.join(SHAPE_TYPES))
+    try:
+        shape = GEOSGeometry(json.dumps(data))
+    except (GDALException, GEOSException, ValueError, TypeError):
+        raise InvalidArgumentsException
+    max_vertices = get_setting('PROVIDERS_SHAPE_QUERY', 'MAX_VERTICES', 10000)
+    if shape.num_points > max_vertices:
+        raise InvalidArgumentsException('At most %d vertices are allowed' % max_vertices)
+    if shape.empty or not shape.valid:
+        raise InvalidArgumentsException('Invalid %s' % shape.geom_type)
+    shape.srid = 4326
+    return shape
+
+
+Quote = namedtuple('Quote', ('limit', 'currency', 'language'))
+
+
+def parse_quote(limit, currency, language):
+    """
+    Quote mode is on when any of "limit", "currency" or "language" is sent: only the limit cheapest
+    areas come back, from providers with that currency and language. Returns None otherwise
+    """
+    if limit is None and not currency and not language:
+        return None
+    max_limit = get_setting('PROVIDERS_QUOTE', 'MAX_LIMIT', 100)
+    if limit is None:
+        limit = get_setting('PROVIDERS_QUOTE', 'DEFAULT_LIMIT', 5)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise InvalidArgumentsException
+    if not 0 < limit <= max_limit:
+        raise InvalidArgumentsException('limit must be between 1 and %d' % max_limit)
+    return Quote(limit, currency or None, language or None)
+
+
+def quote_rows(rows, quote):
+    """
+    Pushes the quote filters, price ordering and limit into a for_point style values_list queryset
+    """
+    if quote.currency is not None:
+        rows = rows.filter(provider__currency=quote.currency)
+    if quote.language is not None:
+        rows = rows.filter(provider__language=quote.language)
+    return rows.order_by('price', 'id')[:quote.limit]
+
+
+def index_rows(areas):
+    return [(area.name, area.price, area.provider.name) for area in areas]
+
+
+def point_rows(lat, lng):
+    """
+    for_point style values_list queryset of the areas containing the point, through the coverage grid
+    and the provider unions when they are enabled
+    """
+    if coverage.is_enabled():
+        rows = coverage.areas_for_point(lng, lat)
+    else:
+        rows = ServiceArea.objects.for_point(Point(lng, lat))
+    return provider_coverage.prune(rows, Point(lng, lat))
+
+
+def areas_for_point(lat, lng, quote=None):
+    """
+    Serialized areas containing the point, from the response cache, the in-process index, the coverage
+    grid or PostGIS. Quotes skip the response cache, which holds full answers only
+    """
+    use_cache = cache.is_enabled() and quote is None
+    if use_cache:
+        data = cache.get_areas(lat, lng)
+        if data is not None:
+            return data
+
+    if spatial_index.is_enabled():
+        index = spatial_index.get_index()
+        if quote is None:
+            rows = index_rows(index.query(lng, lat))
+        else:
+            rows = index_rows(index.quote(lng, lat, quote.limit, quote.currency, quote.language))
+    else:
+        rows = point_rows(lat, lng)
+        if quote is not None:
+            rows = quote_rows(rows, quote)
+    data = ServiceAreaQueryResponseSerializer.values_data(rows)
+    if use_cache:
+        cache.set_areas(lat, lng, data)
+    return data
+
+
+def areas_for_points(points):
+    """
+    Serialized areas for each (lat, lng) point, resolved with a single spatial join
+    """
+    if spatial_index.is_enabled():
+        index = spatial_index.get_index()
+        matches = [index_rows(index.query(lng, lat)) for lat, lng in points]
+    else:
+        matches = ServiceArea.objects.matching_points(points)
+
+    return [
+        {'lat': lat, 'lng': lng, 'areas': ServiceAreaQueryResponseSerializer.values_data(rows)}
+        for (lat, lng), rows in zip(points, matches)
+    ]
+
+
+def areas_for_shape(shape, quote=None):
+    """
+    Serialized areas intersecting the route or region, in one spatial query
+    """
+    rows = ServiceArea.objects.intersecting(shape)
+    if quote is not None:
+        rows = quote_rows(rows, quote)
+    return ServiceAreaQueryResponseSerializer.values_data(rows)
+
+
+def areas_for_trip(pickup, dropoff):
+    """
+    Serialized areas containing the pickup and the dropoff (lat, lng) points, keeping only providers
+    with areas containing both
+    """
+    if spatial_index.is_enabled():
+        index = spatial_index.get_index()
+        pickup_areas = index.query(pickup[1], pickup[0])
+        dropoff_areas = index.query(dropoff[1], dropoff[0])
+        both = set(area.provider.id for area in pickup_areas) & set(area.provider.id for area in dropoff_areas)
+        pickup_rows = index_rows(area for area in pickup_areas if area.provider.id in both)
+        dropoff_rows = index_rows(area for area in dropoff_areas if area.provider.id in both)
+    else:
+        rows = list(ServiceArea.objects.for_trip(Point(pickup[1], pickup[0]), Point(dropoff[1], dropoff[0])))
+        pickup_rows = [row[:3] for row in rows if row[3]]
+        dropoff_rows = [row[:3] for row in rows if row[4]]
+    return {
+        'pickup': ServiceAreaQueryResponseSerializer.values_data(pickup_rows),
+        'dropoff': ServiceAreaQueryResponseSerializer.values_data(dropoff_rows),
+    }
+
+
+def parse_price(value):
+    if value is None:
+        return None
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        raise InvalidArgumentsException
+    if not price.is_finite() or price < 0:
+        raise InvalidArgumentsException
+    return price
+
+
+def providers_for_point(lat, lng, max_price=None):
+    """
+    Providers with an area containing the point, priced at most max_price when given
+    """
+    return [{'id': provider_id, 'name': name}
+            for provider_id, name in provider_coverage.providers_for_point(Point(lng, lat), max_price)]
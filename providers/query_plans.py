@@ -0,0 +1,211 @@
+"""
+Query plan guard, driven by the check_query_plans management command and QueryPlanTestMixin.
+
+view_queries() builds the querysets (or raw SQL) the views in providers/views.py run, for a sample
+point, provider and area. Each one is run through EXPLAIN (ANALYZE, FORMAT JSON) in a transaction
+that is rolled back, and its plan boiled down to the node types, indexes and sequentially scanned
+tables it uses, its estimated cost and its run time.
+
+problems() flags sequential scans on tables above SEQ_SCAN_ROWS rows and, given a baseline saved by
+an earlier run, plans that stopped using an index, started scanning a table or cost more than
+COST_FACTOR times as much. Costs are compared rather than run times, they only move with the data and
+the plan. missing_indexes() checks the GiST indexes GeoDjango creates for spatial fields, and the
+btree ones of foreign keys, are still there.
+"""
+import json
+
+from django.apps import apps
+from django.contrib.gis.db.models.fields import BaseSpatialField
+from django.contrib.gis.geos import Point, Polygon
+from django.db import connection, transaction
+from django.utils import six
+
+from providers import changes, provider_coverage, queries
+from providers.models import Provider, ServiceArea
+from providers.serializers import ProviderSerializer, ServiceAreaSerializer
+from providers.utils import get_setting
+
+NEARBY = 0.01  # degrees between the sample point and the second point of trip, batch and bbox queries
+
+INDEX_SQL = (
+    'SELECT am.amname, attribute.attname FROM pg_index i '
+    'JOIN pg_class tbl ON tbl.oid = i.indrelid '
+    'JOIN pg_class idx ON idx.oid = i.indexrelid '
+    'JOIN pg_am am ON am.oid = idx.relam '
+    'JOIN pg_attribute attribute ON attribute.attrelid = tbl.oid AND attribute.attnum = i.indkey[0] '
+    'WHERE tbl.relname = %s'
+)
+
+
+def sample_arguments():
+    """
+    view_queries() keyword arguments taken from the first service area, or None without any
+    """
+    area = ServiceArea.objects.select_related('provider').order_by('pk').first()
+    if area is None:
+        return None
+    point = area.polygon_planar.point_on_surface
+    return {'lat': point.y, 'lng': point.x, 'provider_id': area.provider_id, 'area_id': area.pk,
+            'email': area.provider.email}
+
+
+def view_queries(lat, lng, provider_id, area_id, email):
+    """
+    (name, query) pairs, one per query the views run, the query being a queryset or (sql, params)
+    """
+    point, nearby = Point(lng, lat), Point(lng + NEARBY, lat)
+    page_size = get_setting('PROVIDERS_PAGINATION', 'PAGE_SIZE', 100)
+    areas = ServiceArea.objects.filter(provider_id=provider_id).order_by('pk')
+    return [
+        ('ServiceAreaQueryView', queries.point_rows(lat, lng)),
+        ('ServiceAreaQueryView/quote', queries.quote_rows(queries.point_rows(lat, lng), queries.Quote(
+            get_setting('PROVIDERS_QUOTE', 'DEFAULT_LIMIT', 5), None, None))),
+        ('ServiceAreaBatchQueryView', ServiceArea.objects.matching_points_sql([(lat, lng), (lat, lng + NEARBY)])),
+        ('ServiceAreaShapeQueryView', ServiceArea.objects.intersecting(
+            Polygon.from_bbox((lng, lat, lng + NEARBY, lat + NEARBY)))),
+        ('ServiceAreaTripQueryView', ServiceArea.objects.for_trip(point, nearby)),
+        ('ProviderCoverageQueryView', provider_coverage.providers_for_point(point)),
+        ('ProviderListView', ProviderSerializer.values_queryset(Provider.objects.order_by('pk'))[:page_size]),
+        ('ProviderDetailView', Provider.objects.filter(pk=provider_id)),
+        ('ServiceAreaListView', ServiceAreaSerializer.values_queryset(areas)[:page_size]),
+        ('ServiceAreaDetailView', areas.filter(pk=area_id)),
+        ('ServiceAreaBulkView', areas.only('id', 'name', 'price', 'polygon')[
+                                :get_setting('PROVIDERS_BULK', 'CHUNK_SIZE', 500)]),
+        ('GenerateTokenView', Provider.objects.filter(email=email)),
+        ('ChangeFeedView', changes.changes_since(changes.START, get_setting('PROVIDERS_CHANGES', 'PAGE_SIZE', 1000))),
+    ]
+
+
+def _sql(query):
+    if isinstance(query, tuple):
+        return query
+    return query.query.get_compiler(using=query.db).as_sql()
+
+
+def explain(query, analyze=True, force_indexes=False):
+    """
+    The JSON plan of a queryset or (sql, params). force_indexes turns sequential scans off, so that
+    tables too small for an index to pay off still show whether one can be used
+    """
+    sql, params = _sql(query)
+    with transaction.atomic(), connection.cursor() as cursor:
+        if force_indexes:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN (%s) %s' % ('ANALYZE, FORMAT JSON' if analyze else 'FORMAT JSON', sql), params)
+        document = cursor.fetchone()[0]
+        transaction.set_rollback(True)  # drops the SET LOCAL, and anything ANALYZE ran
+    if isinstance(document, six.string_types):
+        document = json.loads(document)
+    return document[0]
+
+
+def _nodes(node):
+    yield node
+    for child in node.get('Plans', ()):
+        for descendant in _nodes(child):
+            yield descendant
+
+
+def summarize(plan):
+    """
+    Node types, indexes, sequentially scanned tables, estimated cost and run time of an explain() plan
+    """
+    nodes = list(_nodes(plan['Plan']))
+    return {
+        'nodes': sorted(set(node['Node Type'] for node in nodes)),
+        'indexes': sorted(set(node['Index Name'] for node in nodes if 'Index Name' in node)),
+        'seq_scans': sorted(set(node['Relation Name'] for node in nodes if node['Node Type'] == 'Seq Scan')),
+        'cost': plan['Plan']['Total Cost'],
+        'ms': plan.get('Execution Time', plan.get('Total Runtime')),  # renamed in PostgreSQL 9.4
+    }
+
+
+def check_views(arguments, analyze=True, force_indexes=False, names=None):
+    """
+    Summaries of the view_queries() plans, by name
+    """
+    return dict((name, summarize(explain(query, analyze, force_indexes)))
+                for name, query in view_queries(**arguments) if not names or name in names)
+
+
+def table_rows(tables):
+    """
+    The planner's row estimates of the tables
+    """
+    if not tables:
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relname, reltuples FROM pg_class WHERE relkind = %s AND relname = ANY(%s)',
+                       ['r', list(tables)])
+        return dict(cursor.fetchall())
+
+
+def problems(summaries, baseline=None, seq_scan_rows=None, cost_factor=None):
+    """
+    (name, problem) pairs for the plan summaries, compared against the summaries of a baseline run when given
+    """
+    if seq_scan_rows is None:
+        seq_scan_rows = get_setting('PROVIDERS_QUERY_PLANS', 'SEQ_SCAN_ROWS', 10000)
+    if cost_factor is None:
+        cost_factor = get_setting('PROVIDERS_QUERY_PLANS', 'COST_FACTOR', 2.0)
+    rows = table_rows(set(table for summary in summaries.values() for table in summary['seq_scans']))
+    found = []
+    for name, summary in sorted(summaries.items()):
+        for table in summary['seq_scans']:
+            estimate = max(rows.get(table, 0), 0)  # -1 until the table is first analyzed
+            if estimate >= seq_scan_rows:
+                found.append((name, 'sequential scan on %s (~%d rows)' % (table, estimate)))
+        previous = (baseline or {}).get(name)
+        if previous is None:
+            continue
+        for index in sorted(set(previous['indexes']) - set(summary['indexes'])):
+            found.append((name, 'no longer uses index %s' % index))
+        for table in sorted(set(summary['seq_scans']) - set(previous['seq_scans'])):
+            found.append((name, 'now scans %s sequentially' % table))
+        if previous['cost'] and summary['cost'] > previous['cost'] * cost_factor:
+            found.append((name, 'estimated cost went from %.1f to %.1f' % (previous['cost'], summary['cost'])))
+    return found
+
+
+def missing_indexes():
+    """
+    (table, column, access method) of the indexes the providers models expect but the database lacks:
+    a GiST index per spatial_index field, an index of any kind per foreign key, db_index field and
+    index_together or unique_together, by leading column
+    """
+    missing = []
+    with connection.cursor() as cursor:
+        for model in apps.get_app_config('providers').get_models():
+            if not model._meta.managed or model._meta.proxy:
+                continue
+            table = model._meta.db_table
+            cursor.execute(INDEX_SQL, [table])
+            indexes = cursor.fetchall()
+            expected = [(names[0], None) for names in model._meta.index_together + model._meta.unique_together]
+            for field in model._meta.local_concrete_fields:
+                if isinstance(field, BaseSpatialField) and field.spatial_index:
+                    expected.append((field.name, 'gist'))
+                elif field.db_index or field.unique:
+                    expected.append((field.name, None))
+            for name, method in expected:
+                column = model._meta.get_field(name).column
+                if not any(indexed == column and method in (None, amname) for amname, indexed in indexes):
+                    missing.append((table, column, method or 'any'))
+    return missing
+
+
+class QueryPlanTestMixin(object):
+    """
+    Plan assertions for test cases. Sequential scans are turned off while explaining, so the plans
+    show whether an index can serve the query even on the few rows of a test database
+    """
+
+    def assertUsesIndex(self, query, index):
+        summary = summarize(explain(query, force_indexes=True))
+        self.assertIn(index, summary['indexes'], 'plan uses %s' % (summary['indexes'] or 'no index'))
+
+    def assertNoSeqScan(self, query, tables=None):
+        seq_scans = summarize(explain(query, force_indexes=True))['seq_scans']
+        if tables is not None:
+            seq_scans = [table for table in seq_scans if table in tables]
+        self.assertEqual(seq_scans, [], 'plan scans %s sequentially' % ', '.join(seq_scans))
@@ -0,0 +1,18 @@
+from django.conf.urls import url
+from rest_framework.urlpatterns import format_suffix_patterns
+
+from providers import views
+
+
+# the read-only subset of providers.urls served by query workers
+
+urlpatterns = [
+    url(r'^get_areas/$', views.ServiceAreaQueryView.as_view()),
+    url(r'^get_areas/batch/$', views.ServiceAreaBatchQueryView.as_view()),
+    url(r'^get_areas/shape/$', views.ServiceAreaShapeQueryView.as_view()),
+    url(r'^get_areas/trip/$', views.ServiceAreaTripQueryView.as_view()),
+    url(r'^get_providers/$', views.ProviderCoverageQueryView.as_view()),
+    url(r'^metrics/$', views.MetricsView.as_view()),
+]
+
+urlpatterns = format_suffix_patterns(urlpatterns)
@@ -0,0 +1,57 @@
+import json
+
+from django.utils import six
+from rest_framework.renderers import JSONRenderer
+
+from providers.metrics import timed
+from providers.utils import get_setting
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class InstrumentedJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer reporting its time as the "render" phase of the request metrics
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            return super(InstrumentedJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+
+
+def fast_dumps(data):
+    """
+    Compact UTF-8 JSON for plain dicts, lists, strings and numbers, byte for byte what JSONRenderer
+    writes for them. Raises TypeError for anything else (Decimal, lazy translations, dates...).
+    PROVIDERS_JSON["ENCODER"] = "orjson" switches to orjson when installed; it is faster but writes
+    floats in exponent notation differently (1e-5 instead of 1e-05)
+    """
+    if orjson is not None and get_setting('PROVIDERS_JSON', 'ENCODER', 'json') == 'orjson':
+        ret = orjson.dumps(data)
+    else:
+        ret = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        if isinstance(ret, six.text_type):
+            ret = ret.encode('utf-8')
+    # same escaping as JSONRenderer, these are valid JSON but not valid JavaScript
+    return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastJSONRenderer(InstrumentedJSONRenderer):
+    """
+    Renders plain data, which is what the values serializers produce, without the DRF encoder's
+    per-object type dispatch. Indented or non-compact output and data the fast path cannot encode
+    go through the regular renderer
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or not self.compact or self.ensure_ascii or \
+                self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        try:
+            with timed('render'):
+                return fast_dumps(data)
+        except TypeError:
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
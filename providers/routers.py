@@ -0,0 +1,157 @@
+"""
+Database routing for read replicas.
+
+Reads only go to a replica inside a routing(use_replicas=True) block. ReplicaRoutingMiddleware opens
+one for views listing the request method in replica_methods, the ASGI point query path for its
+lookups. Writes, reads inside a transaction and reads after the first write of a request all use
+default, and a client that wrote is pinned to default for PIN_SECONDS so it reads its own writes on
+the next requests too.
+
+Each process checks its replicas at most every CHECK_INTERVAL seconds and takes them out of rotation
+while unreachable or more than MAX_LAG seconds behind. On PostgreSQL a replica that has replayed all the
+WAL it received is caught up, however long ago the primary last wrote. Otherwise its lag is the age of
+the last replayed transaction.
+
+Pins are kept in PIN_CACHE, which all workers have to share for a client's next request to read its
+writes whichever worker serves it.
+"""
+import hashlib
+import logging
+import random
+import threading
+import time
+
+from django.core.cache import caches
+from django.db import DatabaseError, connections
+
+from providers.utils import get_setting
+
+PRIMARY = 'default'
+
+logger = logging.getLogger('providers.routers')
+
+_local = threading.local()
+
+
+def replica_aliases():
+    return get_setting('PROVIDERS_REPLICAS', 'ALIASES', ())
+
+
+class RoutingState(object):
+    def __init__(self, use_replicas):
+        self.use_replicas = use_replicas
+        self.wrote = False
+        self.replica = None  # picked once, so a request reads a single replica
+
+
+class routing(object):
+    """
+    Context manager scoping replica reads and write tracking to the current thread
+    """
+
+    def __init__(self, use_replicas=False):
+        self.use_replicas = use_replicas
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'state', None)
+        _local.state = RoutingState(self.use_replicas)
+        return _local.state
+
+    def __exit__(self, *exc_info):
+        _local.state = self.previous
+
+
+def replication_lag(alias):
+    """
+    Seconds the replica is behind, None when it has not replayed anything yet
+    """
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor != 'postgresql':
+            cursor.execute('SELECT 1')
+            return 0.0
+        names = ('wal', 'lsn') if connection.pg_version >= 100000 else ('xlog', 'location')  # renamed in 10
+        cursor.execute('SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 '
+                       'WHEN pg_last_{0}_receive_{1}() = pg_last_{0}_replay_{1}() THEN 0 '
+                       'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'.format(*names))
+        lag, = cursor.fetchone()
+        return float(lag) if lag is not None else None
+
+
+class ReplicaHealth(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._status = {}  # alias -> (checked at, healthy)
+
+    def record(self, alias, healthy):
+        self._status[alias] = (time.time(), healthy)
+
+    def is_healthy(self, alias):
+        checked_at, healthy = self._status.get(alias, (0, False))
+        if time.time() - checked_at < get_setting('PROVIDERS_REPLICAS', 'CHECK_INTERVAL', 5):
+            return healthy
+        with self._lock:
+            checked_at, healthy = self._status.get(alias, (0, False))
+            if time.time() - checked_at < get_setting('PROVIDERS_REPLICAS', 'CHECK_INTERVAL', 5):
+                return healthy  # another thread just checked it
+            healthy = self.check(alias)
+            self.record(alias, healthy)
+        return healthy
+
+    def check(self, alias):
+        try:
+            lag = replication_lag(alias)
+        except DatabaseError:
+            logger.warning('Replica %s is unreachable, taking it out of rotation', alias, exc_info=True)
+            return False
+        if lag is None or lag > get_setting('PROVIDERS_REPLICAS', 'MAX_LAG', 5):
+            logger.warning('Replica %s is %s seconds behind, taking it out of rotation', alias, lag)
+            return False
+        return True
+
+    def pick(self):
+        aliases = [alias for alias in replica_aliases() if self.is_healthy(alias)]
+        return random.choice(aliases) if aliases else None
+
+
+health = ReplicaHealth()
+
+
+def _pin_key(client):
+    return 'replica:pin:%s' % hashlib.sha1(client.encode('utf-8')).hexdigest()
+
+
+def pin(client):
+    """
+    Keeps the client's reads on default for PIN_SECONDS, long enough for the replicas to catch up
+    """
+    seconds = get_setting('PROVIDERS_REPLICAS', 'PIN_SECONDS', 5)
+    caches[get_setting('PROVIDERS_REPLICAS', 'PIN_CACHE', 'default')].set(_pin_key(client), True, seconds)
+
+
+def is_pinned(client):
+    return caches[get_setting('PROVIDERS_REPLICAS', 'PIN_CACHE', 'default')].get(_pin_key(client), False)
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        state = getattr(_local, 'state', None)
+        if state is None or not state.use_replicas or state.wrote or connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        if state.replica is None:
+            state.replica = health.pick() or PRIMARY
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = getattr(_local, 'state', None)
+        if state is not None:
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # replicas hold the same rows as default
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replica_aliases():
+            return False  # replicated from default
+        return None
@@ -1,11 +1,96 @@
 import re
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.contrib.gis.geos import Polygon
+from django.db import transaction
+from django.db.models import BinaryField, F, Func
 from rest_framework import serializers
 
+from providers.geometry import GeometryError, normalize_polygon, wkb_to_geojson
+from providers.metrics import timed
 from providers.models import Provider, ServiceArea
+from providers.signals import providers_bulk_created
+
+
+class TimedListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with timed('serialize'):
+            return super(TimedListSerializer, self).data
+
+
+class TimedSerializerMixin(object):
+    """
+    Reports the time spent producing .data as the "serialize" phase of the request metrics
+    """
+
+    @property
+    def data(self):
+        with timed('serialize'):
+            return super(TimedSerializerMixin, self).data
+
+
+class ValuesSerializerMixin(object):
+    """
+    Read-only fast path producing the same primitives as .data from values_list() rows, without
+    binding fields or loading model instances. values_fields are the columns read, primary key first
+    so the rows can be keyset paginated. Each Meta.fields key is filled from the column of the same
+    name, or the one values_sources names for it, through values_converters[key] when there is one
+    """
+    values_fields = ()
+    values_sources = {}
+    values_converters = {}
+
+    @classmethod
+    def values_queryset(cls, queryset):
+        return queryset.values_list(*cls.values_fields)
+
+    @classmethod
+    def values_data(cls, rows):
+        with timed('serialize'):
+            return [cls.to_values(row) for row in rows]
 
+    @classmethod
+    def values_plan(cls):
+        """
+        (key, column index, converter) per Meta.fields key, worked out once per class
+        """
+        plan = cls.__dict__.get('_values_plan')
+        if plan is None:
+            plan = cls._values_plan = [
+                (key, cls.values_fields.index(cls.values_sources.get(key, key)), cls.values_converters.get(key))
+                for key in cls.Meta.fields]
+        return plan
 
-class ProviderSerializer(serializers.ModelSerializer):
+    @classmethod
+    def to_values(cls, row):
+        return OrderedDict([(key, row[index] if convert is None else convert(row[index]))
+                            for key, index, convert in cls.values_plan()])
+
+
+def format_price(value):
+    # what DecimalField(max_digits=10, decimal_places=2).to_representation returns
+    return '{0:f}'.format(Decimal(value).quantize(Decimal('0.01')))
+
+
+def format_polygon(wkb):
+    # what GeometryField.to_representation returns, for WKB read by values_list()
+    return wkb_to_geojson(wkb) if wkb is not None else None
+
+
+class ProviderListSerializer(TimedListSerializer):
+    def create(self, validated_data):
+        # one bulk insert per table instead of a save() per provider
+        with transaction.atomic():
+            providers = Provider.objects.bulk_create_with_tokens([Provider(**item) for item in validated_data])
+            providers_bulk_created.send(sender=Provider, instances=providers)
+        return providers
+
+
+class ProviderSerializer(ValuesSerializerMixin, TimedSerializerMixin, serializers.ModelSerializer):
     id = serializers.ReadOnlyField()
+    values_fields = ('id', 'name', 'email', 'language', 'currency', 'phone_number')
 
     def validate_currency(self, value):
         if not len(value) == 3 and (value.isalpha() or value.isnumeric()):  # validating either 3-digit or 3-letter code
@@ -24,24 +109,47 @@ class ProviderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Provider
         fields = ('name', 'email', 'language', 'currency', 'phone_number', 'id')
+        list_serializer_class = ProviderListSerializer
 
 
-class ServiceAreaSerializer(serializers.ModelSerializer):
+class ServiceAreaSerializer(ValuesSerializerMixin, TimedSerializerMixin, serializers.ModelSerializer):
     id = serializers.ReadOnlyField()
+    values_fields = ('id', 'name', 'price', 'polygon_wkb')
+    values_sources = {'polygon': 'polygon_wkb'}
+    values_converters = {'price': format_price, 'polygon': format_polygon}
 
     # conversion from GeoJSON to wkt and vice-versa handled by rest_framework_gis
 
+    def validate_polygon(self, value):
+        if not isinstance(value, Polygon):
+            return value  # the model field rejects other geometry types
+        try:
+            return normalize_polygon(value)
+        except GeometryError as e:
+            raise serializers.ValidationError(str(e))
+
     class Meta:
         model = ServiceArea
         fields = ('name', 'price', 'polygon', 'id')
+        list_serializer_class = TimedListSerializer
+
+    @classmethod
+    def values_queryset(cls, queryset):
+        # the polygon comes back as WKB and is turned into GeoJSON without building a GEOS geometry
+        queryset = queryset.annotate(polygon_wkb=Func(F('polygon'), function='ST_AsBinary', output_field=BinaryField()))
+        return super(ServiceAreaSerializer, cls).values_queryset(queryset)
 
 
-class ServiceAreaQueryResponseSerializer(serializers.ModelSerializer):
+class ServiceAreaQueryResponseSerializer(ValuesSerializerMixin, TimedSerializerMixin, serializers.ModelSerializer):
     provider = serializers.ReadOnlyField(source='provider.name')
+    values_fields = ('name', 'price', 'provider__name')
+    values_sources = {'provider': 'provider__name'}
+    values_converters = {'price': format_price}
 
     class Meta:
         model = ServiceArea
         fields = ('name', 'price', 'provider')
+        list_serializer_class = TimedListSerializer
 
 
 class GenerateTokenQuerySerializer(serializers.Serializer):
@@ -0,0 +1,113 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from rest_framework.authtoken.models import Token
+
+from providers import authentication, cache, changes, coverage, provider_coverage, spatial_index
+from providers.models import Provider, ServiceArea
+
+# sent by bulk write paths that bypass Model.save(), e.g. bulk_create
+service_areas_bulk_created = Signal(providing_args=['instances'])
+providers_bulk_created = Signal(providing_args=['instances'])
+
+
+@receiver(post_save, sender=Provider)
+@receiver(post_save, sender=ServiceArea)
+def log_saved(sender, instance, created, **kwargs):
+    if changes.is_enabled():
+        changes.record(instance, 'create' if created else 'update')
+
+
+@receiver(post_delete, sender=Provider)
+@receiver(post_delete, sender=ServiceArea)
+def log_deleted(sender, instance, **kwargs):
+    if changes.is_enabled():
+        changes.record(instance, 'delete')
+
+
+@receiver(providers_bulk_created, sender=Provider)
+@receiver(service_areas_bulk_created, sender=ServiceArea)
+def log_bulk_created(sender, instances, **kwargs):
+    if changes.is_enabled():
+        changes.record_many(instances, 'create')
+
+
+@receiver(pre_save, sender=ServiceArea)
+def service_area_saving(sender, instance, **kwargs):
+    if cache.is_enabled() and instance.pk is not None:
+        # remember where the area used to be, responses cached there have to go as well
+        instance._previous_bbox = ServiceArea.objects.filter(pk=instance.pk).values_list(
+            'bbox_xmin', 'bbox_ymin', 'bbox_xmax', 'bbox_ymax').first()
+
+
+@receiver(post_save, sender=ServiceArea)
+def service_area_saved(sender, instance, created, update_fields=None, **kwargs):
+    if coverage.is_enabled() and (created or update_fields is None or 'polygon' in update_fields):
+        coverage.tile_areas([instance])  # grid rows are written in the same transaction as the area
+    if provider_coverage.is_enabled():
+        if created:
+            provider_coverage.areas_created([instance.pk])
+        elif update_fields is None or 'polygon' in update_fields or 'price' in update_fields:
+            provider_coverage.rebuild([instance.provider_id])
+    if spatial_index.is_enabled():
+        transaction.on_commit(lambda: spatial_index.area_saved(instance))
+    if cache.is_enabled():
+        bboxes = [instance.bbox, getattr(instance, '_previous_bbox', None)]
+
+        def invalidate():
+            for bbox in bboxes:
+                if bbox is not None:
+                    cache.invalidate_bbox(bbox)
+        transaction.on_commit(invalidate)
+
+
+@receiver(post_delete, sender=ServiceArea)
+def service_area_deleted(sender, instance, **kwargs):
+    if provider_coverage.is_enabled():
+        provider_coverage.areas_deleted([instance.provider_id])
+    if spatial_index.is_enabled():
+        area_id = instance.pk  # pk is cleared once the delete collector finishes
+        transaction.on_commit(lambda: spatial_index.area_deleted(area_id))
+    if cache.is_enabled():
+        bbox = instance.bbox
+        transaction.on_commit(lambda: cache.invalidate_bbox(bbox))
+
+
+@receiver(post_save, sender=Provider)
+def provider_saved(sender, instance, created, **kwargs):
+    if spatial_index.is_enabled() and not created:
+        transaction.on_commit(lambda: spatial_index.provider_saved(instance))
+    if cache.is_enabled() and not created:
+        transaction.on_commit(cache.invalidate_all)  # cached responses carry the provider name
+
+
+@receiver(service_areas_bulk_created, sender=ServiceArea)
+def service_areas_created(sender, instances, **kwargs):
+    if coverage.is_enabled():
+        coverage.tile_areas(instances)
+    if provider_coverage.is_enabled():
+        provider_coverage.areas_created([instance.pk for instance in instances])
+    if spatial_index.is_enabled():
+        transaction.on_commit(lambda: spatial_index.areas_saved(instances))
+    if cache.is_enabled() and instances:
+        extents = [instance.bbox for instance in instances]
+        bbox = (min(extent[0] for extent in extents), min(extent[1] for extent in extents),
+                max(extent[2] for extent in extents), max(extent[3] for extent in extents))
+        transaction.on_commit(lambda: cache.invalidate_bbox(bbox))
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def token_changed(sender, instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: authentication.invalidate_token(key))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Provider)
+def user_saved(sender, instance, created, **kwargs):
+    if not created:
+        user_id = instance.pk
+        transaction.on_commit(lambda: authentication.invalidate_user(user_id))
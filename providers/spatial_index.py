@@ -0,0 +1,308 @@
+"""
+In-process spatial index of ServiceArea polygons used to answer get_areas point lookups
+without a round trip to PostGIS.
+
+Every worker keeps its own copy of the index. The stored bounding boxes, which hold the great
+circle edges, are bucketed into a uniform lng/lat grid for the prefilter. Candidates are then
+decided with prepared GEOS geometries built from the derived columns (see providers/geometry.py):
+a point in the area's core is in the area, a point outside its planar copy grown by
+BORDER_MARGIN and the bow left between its points is not. Points in between, near the edges, get
+the exact geography test in PostGIS, so answers are the same as without the index.
+Writes made in this process patch the index in place, writes made by other workers are
+picked up through a generation counter kept in the CACHE alias, which every worker has to share.
+"""
+import heapq
+import math
+import threading
+import time
+from collections import namedtuple
+
+from django.core.cache import caches
+
+from providers.utils import get_setting
+
+GENERATION_CACHE_KEY = 'providers:spatial_index:generation'
+
+# polygons spanning more grid cells than this are kept in a separate list and only bbox tested
+MAX_CELLS_PER_AREA = 4096
+
+IndexedProvider = namedtuple('IndexedProvider', ('id', 'name', 'currency', 'language'))
+
+
+class IndexedArea(object):
+    """
+    Lightweight stand-in for a ServiceArea row, exposing the attributes read by
+    ServiceAreaQueryResponseSerializer
+    """
+    __slots__ = ('id', 'name', 'price', 'provider', 'bbox', 'core', 'outer')
+
+    def __init__(self, id, name, price, provider, planar, core, bbox):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.provider = provider
+        self.bbox = bbox  # (xmin, ymin, xmax, ymax), grown by the bow of the great circle edges
+        self.core = core.prepared if core is not None else None
+        _, ymin, _, ymax = planar.extent
+        slack = max(ymin - bbox[1], bbox[3] - ymax, 0)
+        self.outer = planar.buffer(get_setting('PROVIDERS_GEOMETRY', 'BORDER_MARGIN', 0.001) + slack).prepared
+
+    def contains(self, lng, lat, point):
+        """
+        True or False when the planar geometries decide, None when only the geography test can
+        """
+        xmin, ymin, xmax, ymax = self.bbox
+        if not (xmin <= lng <= xmax and ymin <= lat <= ymax):
+            return False
+        if self.core is not None and self.core.contains(point):
+            return True
+        if not self.outer.intersects(point):
+            return False
+        return None
+
+
+def exact_matches(point, entries):
+    """
+    The entries whose area contains the point according to the geography test, in one query
+    """
+    from providers.models import ServiceArea
+
+    if not entries:
+        return []
+    found = set(ServiceArea.objects.filter(ServiceArea.objects.contains_point_q(point),
+                                           pk__in=[entry.id for entry in entries]).values_list('id', flat=True))
+    return [entry for entry in entries if entry.id in found]
+
+
+class SpatialIndex(object):
+    """
+    Grid bucketed bounding box index, refined by the cores and grown planar copies of the areas
+    """
+
+    def __init__(self, cell_size=0.5):
+        self.cell_size = float(cell_size)
+        self._areas = {}
+        self._cells = {}
+        self._large = set()
+        self._by_price = {}  # cell (None for the large areas) -> (price, id, area) tuples, built on demand
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._areas)
+
+    def _cell(self, lng, lat):
+        return int(math.floor(lng / self.cell_size)), int(math.floor(lat / self.cell_size))
+
+    def _cells_for_bbox(self, bbox):
+        xmin, ymin, xmax, ymax = bbox
+        col_min, row_min = self._cell(xmin, ymin)
+        col_max, row_max = self._cell(xmax, ymax)
+        if (col_max - col_min + 1) * (row_max - row_min + 1) > MAX_CELLS_PER_AREA:
+            return None
+        return [(col, row) for col in range(col_min, col_max + 1) for row in range(row_min, row_max + 1)]
+
+    def add(self, area):
+        """
+        Inserts or replaces an area. Accepts a ServiceArea instance with its provider loaded
+        """
+        provider = IndexedProvider(area.provider_id, area.provider.name, area.provider.currency,
+                                   area.provider.language)
+        self.add_row(area.id, area.name, area.price, provider, area.polygon_planar, area.polygon_core,
+                     (area.bbox_xmin, area.bbox_ymin, area.bbox_xmax, area.bbox_ymax))
+
+    def add_row(self, id, name, price, provider, planar, core, bbox):
+        entry = IndexedArea(id, name, price, provider, planar, core, bbox)
+        with self._lock:
+            self.remove(id)
+            self._areas[id] = entry
+            cells = self._cells_for_bbox(entry.bbox)
+            if cells is None:
+                self._large.add(id)
+                self._by_price.pop(None, None)
+            else:
+                for cell in cells:
+                    self._cells.setdefault(cell, set()).add(id)
+                    self._by_price.pop(cell, None)
+
+    def remove(self, area_id):
+        with self._lock:
+            entry = self._areas.pop(area_id, None)
+            if entry is None:
+                return
+            if area_id in self._large:
+                self._large.discard(area_id)
+                self._by_price.pop(None, None)
+                return
+            for cell in self._cells_for_bbox(entry.bbox):
+                self._by_price.pop(cell, None)
+                bucket = self._cells.get(cell)
+                if bucket is not None:
+                    bucket.discard(area_id)
+                    if not bucket:
+                        del self._cells[cell]
+
+    def update_provider(self, provider_id, name, currency, language):
+        with self._lock:
+            provider = IndexedProvider(provider_id, name, currency, language)
+            for entry in self._areas.values():
+                if entry.provider.id == provider_id:
+                    entry.provider = provider
+
+    def query(self, lng, lat):
+        """
+        Returns the indexed areas containing the point, ordered by id
+        """
+        from django.contrib.gis.geos import Point
+
+        point = Point(lng, lat)
+        matches, undecided = [], []
+        with self._lock:
+            # prepared geometries build their internal index lazily and are not safe to share unlocked
+            for area_id in self._cells.get(self._cell(lng, lat), set()) | self._large:
+                inside = self._areas[area_id].contains(lng, lat, point)
+                if inside:
+                    matches.append(self._areas[area_id])
+                elif inside is None:
+                    undecided.append(self._areas[area_id])
+        matches += exact_matches(point, undecided)
+        return sorted(matches, key=lambda entry: entry.id)
+
+    def _price_ordered(self, cell):
+        ordered = self._by_price.get(cell)
+        if ordered is None:
+            area_ids = self._large if cell is None else self._cells.get(cell, ())
+            ordered = sorted((self._areas[area_id].price, area_id, self._areas[area_id]) for area_id in area_ids)
+            self._by_price[cell] = ordered
+        return ordered
+
+    def quote(self, lng, lat, limit, currency=None, language=None):
+        """
+        Returns the limit cheapest areas containing the point, ordered by price then id. Candidates are
+        walked in price order, so geometry tests stop as soon as limit areas matched here, the ones
+        left undecided before that get a single exact test
+        """
+        from django.contrib.gis.geos import Point
+
+        point = Point(lng, lat)
+        walked, found = [], 0
+        with self._lock:
+            for price, area_id, entry in heapq.merge(self._price_ordered(self._cell(lng, lat)),
+                                                     self._price_ordered(None)):
+                if currency is not None and entry.provider.currency != currency:
+                    continue
+                if language is not None and entry.provider.language != language:
+                    continue
+                inside = entry.contains(lng, lat, point)
+                if inside is False:
+                    continue
+                walked.append((entry, inside))
+                if inside:
+                    found += 1
+                    if found == limit:
+                        break
+        exact = set(entry.id for entry in exact_matches(point, [entry for entry, inside in walked if inside is None]))
+        return [entry for entry, inside in walked if inside or entry.id in exact][:limit]
+
+
+def build_index():
+    from providers.models import ServiceArea
+
+    index = SpatialIndex(cell_size=get_setting('PROVIDERS_SPATIAL_INDEX', 'CELL_SIZE', 0.5))
+    rows = ServiceArea.objects.values_list('id', 'name', 'price', 'polygon_planar', 'polygon_core', 'bbox_xmin',
+                                           'bbox_ymin', 'bbox_xmax', 'bbox_ymax', 'provider_id', 'provider__name',
+                                           'provider__currency', 'provider__language')
+    for row in rows.iterator():
+        area_id, name, price, planar, core = row[:5]
+        provider = IndexedProvider(*row[9:])
+        index.add_row(area_id, name, price, provider, planar, core, row[5:9])
+    return index
+
+
+def is_enabled():
+    return get_setting('PROVIDERS_SPATIAL_INDEX', 'ENABLED', False)
+
+
+class _State(object):
+    index = None
+    generation = None
+    checked_at = 0
+
+
+_state = _State()
+_state_lock = threading.Lock()
+
+
+def _shared_cache():
+    return caches[get_setting('PROVIDERS_SPATIAL_INDEX', 'CACHE', 'default')]
+
+
+def _shared_generation():
+    return _shared_cache().get_or_set(GENERATION_CACHE_KEY, 0, None)
+
+
+def get_index():
+    """
+    Returns this worker's index, (re)building it when another worker has changed service areas
+    """
+    interval = get_setting('PROVIDERS_SPATIAL_INDEX', 'CHECK_INTERVAL', 1)
+    now = time.time()
+    if _state.index is not None and now - _state.checked_at < interval:
+        return _state.index
+
+    with _state_lock:
+        generation = _shared_generation()
+        if _state.index is None or generation != _state.generation:
+            _state.index = build_index()
+            _state.generation = generation
+        _state.checked_at = now
+        return _state.index
+
+
+def reset():
+    with _state_lock:
+        _state.index = None
+        _state.generation = None
+        _state.checked_at = 0
+
+
+def _bump_generation():
+    """
+    Tells the other workers their index is stale. When nobody else wrote in between, this
+    worker's patched index stays current and is not rebuilt
+    """
+    cache = _shared_cache()
+    try:
+        generation = cache.incr(GENERATION_CACHE_KEY)
+    except ValueError:
+        cache.set(GENERATION_CACHE_KEY, 1, None)
+        generation = 1
+    if _state.generation is not None and generation == _state.generation + 1:
+        _state.generation = generation
+    else:
+        _state.index = None
+
+
+def area_saved(area):
+    areas_saved([area])
+
+
+def areas_saved(areas):
+    with _state_lock:
+        if _state.index is not None:
+            for area in areas:
+                _state.index.add(area)
+        _bump_generation()
+
+
+def area_deleted(area_id):
+    with _state_lock:
+        if _state.index is not None:
+            _state.index.remove(area_id)
+        _bump_generation()
+
+
+def provider_saved(provider):
+    with _state_lock:
+        if _state.index is not None:
+            _state.index.update_provider(provider.pk, provider.name, provider.currency, provider.language)
+        _bump_generation()
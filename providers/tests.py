@@ -1,8 +1,31 @@
+import io
+import json
+import sys
+import tempfile
+import unittest
+from decimal import Decimal
+
+from django.apps import apps
+from django.conf import settings
 from django.contrib.auth.models import User
-from rest_framework import status
-from rest_framework.test import APITestCase
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
+from rest_framework import serializers, status
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from mozio import settings_query
 
+from . import (benchmarks, cache, changes, checks, coverage, metrics, offline, provider_coverage, queries, query_plans,
+               renderers, routers, spatial_index, throttling)
+from .geometry import wkb_to_geojson
 from .models import *
+from .serializers import (ProviderSerializer, ServiceAreaQueryResponseSerializer, ServiceAreaSerializer,
+                          ValuesSerializerMixin)
 
 
 class CreateProviderTest(APITestCase):
@@ -180,3 +203,1269 @@ class ServiceAreaQueryTest(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 0)
+
+
+@override_settings(PROVIDERS_SPATIAL_INDEX={'ENABLED': True, 'CELL_SIZE': 0.5, 'CHECK_INTERVAL': 0, 'CACHE': 'shared'})
+class SpatialIndexQueryTest(APITransactionTestCase):
+    def setUp(self):
+        spatial_index.reset()
+        self.provider_data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                              'phone_number': '+919739630033'}
+
+        self.provider = Provider.objects.create(**self.provider_data)
+        self.area_data = {'name': 'Test area', 'price': '40.25',
+                          'polygon': '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ]]}'}
+        self.area = ServiceArea.objects.create(provider=self.provider, **self.area_data)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.provider.auth_token.key)
+
+    def tearDown(self):
+        spatial_index.reset()
+
+    def test_can_find_correct_query(self):
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['provider'], 'Test Smith')
+
+    def test_cannot_find_incorrect_query(self):
+        response = self.client.get('/api/get_areas/?lat=1.5&lng=100.5')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 0)
+
+    def test_index_is_patched_on_create_and_delete(self):
+        spatial_index.get_index()
+        response = self.client.post('/api/areas/', {'name': 'Second area', 'price': '10',
+                                                    'polygon': '{ "type": "Polygon", "coordinates": [ [ [100.4, 0.4], [102.0, 0.4], [102.0, 2.0], [100.4, 2.0], [100.4, 0.4] ]]}'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(self.client.get('/api/get_areas/?lat=0.5&lng=100.5').data), 2)
+        self.assertEqual(len(self.client.get('/api/get_areas/?lat=1.5&lng=100.5').data), 1)
+
+        self.client.delete('/api/areas/' + str(self.area.id))
+        self.assertEqual(len(self.client.get('/api/get_areas/?lat=0.5&lng=100.5').data), 1)
+
+    def test_index_follows_updates(self):
+        spatial_index.get_index()
+        self.client.patch('/api/areas/' + str(self.area.id), {'price': '60'})
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        self.assertEqual(response.data[0]['price'], '60.00')
+
+    def test_index_follows_writes_through_other_workers(self):
+        spatial_index.get_index()
+        ServiceArea.objects.filter(pk=self.area.pk).update(price='60')  # written by another worker, which then
+        caches['shared'].incr(spatial_index.GENERATION_CACHE_KEY)  # bumps the shared generation
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        self.assertEqual(response.data[0]['price'], '60.00')
+
+    def test_non_finite_points_are_rejected(self):
+        response = self.client.get('/api/get_areas/?lat=nan&lng=100.5')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_points_near_long_edges_get_the_geography_test(self):
+        ServiceArea.objects.create(provider=self.provider, name='Long area', price='5',
+                                   polygon='{ "type": "Polygon", "coordinates": [ [ [0.0, 50.0], [40.0, 50.0], [40.0, 60.0], [0.0, 60.0], [0.0, 50.0] ]]}')
+        index = spatial_index.get_index()
+        with self.assertNumQueries(0):
+            self.assertEqual([area.name for area in index.query(20.0, 55.0)], ['Long area'])  # in the core
+            self.assertEqual(index.query(20.0, 65.0), [])  # past the bow
+        # the edges along the parallels bow north, to about 61.5 and 51.7 halfway
+        with self.assertNumQueries(1):
+            self.assertEqual([area.name for area in index.query(20.0, 61.0)], ['Long area'])
+        with self.assertNumQueries(1):
+            self.assertEqual(index.query(20.0, 51.0), [])
+
+
+class ServiceAreaBatchQueryTest(APITestCase):
+    def setUp(self):
+        self.provider_data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                              'phone_number': '+919739630033'}
+
+        self.provider = Provider.objects.create(**self.provider_data)
+        self.area_data = {'name': 'Test area', 'price': '40.25',
+                          'polygon': '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ]]}'}
+        self.area = ServiceArea.objects.create(provider=self.provider, **self.area_data)
+
+    def test_can_query_json_batch(self):
+        response = self.client.post('/api/get_areas/batch/', [[0.5, 100.5], {'lat': 1.5, 'lng': 100.5}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(response.data[0]['areas'][0]['provider'], 'Test Smith')
+        self.assertEqual(len(response.data[1]['areas']), 0)
+
+    def test_can_query_csv_batch(self):
+        response = self.client.post('/api/get_areas/batch/', '0.5,100.5\n1.5,100.5\n', content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([len(point['areas']) for point in response.data], [1, 0])
+
+    def test_cannot_query_invalid_batch(self):
+        response = self.client.post('/api/get_areas/batch/', [[0.5]], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/get_areas/batch/', '0.5,100.5\nnan,100.5\n', content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+def square(xmin, ymin, size=1.0):
+    return json.dumps({'type': 'Polygon', 'coordinates': [[
+        [xmin, ymin], [xmin + size, ymin], [xmin + size, ymin + size], [xmin, ymin + size], [xmin, ymin]]]})
+
+
+class ServiceAreaShapeQueryTest(APITestCase):
+    def setUp(self):
+        self.airline = Provider.objects.create(name='Airline', email='airline@test.com', language='en',
+                                               currency='USD', phone_number='+919739630033')
+        self.local = Provider.objects.create(name='Local', email='local@test.com', language='en',
+                                             currency='USD', phone_number='+919739630034')
+        ServiceArea.objects.create(provider=self.airline, name='Airport', price='30.00', polygon=square(100, 0))
+        ServiceArea.objects.create(provider=self.airline, name='Downtown', price='20.00', polygon=square(102, 0))
+        ServiceArea.objects.create(provider=self.local, name='Airport', price='10.00', polygon=square(100, 0))
+
+    def test_can_query_route(self):
+        route = {'type': 'LineString', 'coordinates': [[100.5, 0.5], [102.5, 0.5]]}
+        response = self.client.post('/api/get_areas/shape/', route, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 3)
+
+        route = {'type': 'Feature', 'properties': {}, 'geometry': {'type': 'LineString',
+                                                                   'coordinates': [[99.0, 0.5], [99.5, 0.5]]}}
+        response = self.client.post('/api/get_areas/shape/', route, format='json')
+        self.assertEqual(len(response.data), 0)
+
+    def test_can_query_region(self):
+        response = self.client.post('/api/get_areas/shape/', json.loads(square(101.5, 0.5)), format='json')
+        self.assertEqual(sorted(area['name'] for area in response.data), ['Downtown'])
+
+    def test_can_query_bbox(self):
+        response = self.client.get('/api/get_areas/shape/?bbox=100.5,0.5,101.5,0.6&limit=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(area['provider'], area['price']) for area in response.data], [('Local', '10.00')])
+
+    def test_cannot_query_invalid_shape(self):
+        response = self.client.get('/api/get_areas/shape/?bbox=101,0,100,1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/get_areas/shape/', {'type': 'Point', 'coordinates': [100.5, 0.5]},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_trip_needs_both_ends(self):
+        response = self.client.get('/api/get_areas/trip/?pickup_lat=0.5&pickup_lng=100.5'
+                                   '&dropoff_lat=0.5&dropoff_lng=102.5')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(area['provider'], area['name']) for area in response.data['pickup']], [('Airline', 'Airport')])
+        self.assertEqual([(area['provider'], area['name']) for area in response.data['dropoff']],
+                         [('Airline', 'Downtown')])
+
+    def test_trip_is_one_query(self):
+        with self.assertNumQueries(1):
+            self.client.get('/api/get_areas/trip/?pickup_lat=0.5&pickup_lng=100.5&dropoff_lat=0.5&dropoff_lng=100.6')
+
+    @override_settings(PROVIDERS_SPATIAL_INDEX={'ENABLED': True, 'CELL_SIZE': 0.5, 'CHECK_INTERVAL': 0})
+    def test_trip_from_spatial_index(self):
+        spatial_index.reset()
+        try:
+            response = self.client.get('/api/get_areas/trip/?pickup_lat=0.5&pickup_lng=100.5'
+                                       '&dropoff_lat=0.5&dropoff_lng=100.6')
+        finally:
+            spatial_index.reset()
+        self.assertEqual(sorted(area['provider'] for area in response.data['pickup']), ['Airline', 'Local'])
+        self.assertEqual(sorted(area['provider'] for area in response.data['dropoff']), ['Airline', 'Local'])
+
+
+class ServiceAreaQueryCountTest(APITestCase):
+    def setUp(self):
+        self.polygon = '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ]]}'
+        self.provider = None
+        for i in range(5):
+            provider = Provider.objects.create(name='Test Smith %d' % i, email='test%d@test.com' % i, language='test',
+                                               currency='TST', phone_number='+919739630033')
+            ServiceArea.objects.create(provider=provider, name='Test area %d' % i, price='40.25', polygon=self.polygon)
+            ServiceArea.objects.create(provider=provider, name='Other area %d' % i, price='10', polygon=self.polygon)
+            self.provider = self.provider or provider
+
+    def test_query_response_uses_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        self.assertEqual(len(response.data), 10)
+
+    def test_area_list_uses_constant_queries(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.provider.auth_token.key)
+        with self.assertNumQueries(3):  # token lookup, the ETag aggregate and the area list
+            response = self.client.get('/api/areas/')
+        self.assertEqual(len(response.data), 2)
+
+
+@override_settings(PROVIDERS_QUERY_CACHE={'ENABLED': True, 'ALIAS': 'get_areas', 'VERSION_ALIAS': 'shared',
+                                          'TIMEOUT': 300, 'PRECISION': 0.0001, 'TILE_SIZE': 0.1})
+class ServiceAreaQueryCacheTest(APITransactionTestCase):
+    def setUp(self):
+        caches['get_areas'].clear()
+        self.provider_data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                              'phone_number': '+919739630033'}
+
+        self.provider = Provider.objects.create(**self.provider_data)
+        self.area_data = {'name': 'Test area', 'price': '40.25',
+                          'polygon': '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ]]}'}
+        self.area = ServiceArea.objects.create(provider=self.provider, **self.area_data)
+        self.auth = {'HTTP_AUTHORIZATION': 'Token ' + self.provider.auth_token.key}
+
+    def test_repeated_query_is_served_from_cache(self):
+        self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/get_areas/?lat=0.50001&lng=100.50001')
+        self.assertEqual(len(response.data), 1)
+
+    def test_update_invalidates_overlapping_cells_only(self):
+        self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        self.client.get('/api/get_areas/?lat=10.5&lng=10.5')
+        self.client.patch('/api/areas/' + str(self.area.id), {'price': '60'}, **self.auth)
+
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        self.assertEqual(response.data[0]['price'], '60.00')
+        with self.assertNumQueries(0):
+            self.client.get('/api/get_areas/?lat=10.5&lng=10.5')
+
+    def test_writes_through_other_workers_invalidate_cells(self):
+        self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        caches['shared'].set(cache.GLOBAL_VERSION_KEY, 'elsewhere', None)  # another worker's invalidate_all()
+        with self.assertNumQueries(1):
+            self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+
+    def test_non_finite_points_are_rejected(self):
+        for lat, lng in (('nan', '100.5'), ('0.5', 'inf'), ('-Infinity', '100.5')):
+            response = self.client.get('/api/get_areas/?lat=%s&lng=%s' % (lat, lng))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delete_invalidates_cells(self):
+        self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        self.client.delete('/api/areas/' + str(self.area.id), **self.auth)
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        self.assertEqual(len(response.data), 0)
+
+    def test_lru_cache_evicts_least_recently_used(self):
+        lru = cache.LRULocMemCache('lru-test', {'OPTIONS': {'MAX_ENTRIES': 2, 'CULL_FREQUENCY': 2}})
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertIsNone(lru.get('b'))
+
+
+class ServiceAreaListPaginationTest(APITestCase):
+    def setUp(self):
+        self.provider_data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                              'phone_number': '+919739630033'}
+
+        self.provider = Provider.objects.create(**self.provider_data)
+        self.polygon = '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ]]}'
+        for i in range(5):
+            ServiceArea.objects.create(provider=self.provider, name='Test area %d' % i, price='40.25',
+                                       polygon=self.polygon)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.provider.auth_token.key)
+
+    def test_list_is_unpaginated_by_default(self):
+        response = self.client.get('/api/areas/')
+        self.assertEqual(len(response.data), 5)
+
+    def test_can_page_through_list(self):
+        response = self.client.get('/api/areas/?page_size=2')
+        self.assertEqual(len(response.data['results']), 2)
+        names = [area['name'] for area in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            names += [area['name'] for area in response.data['results']]
+        self.assertEqual(names, ['Test area %d' % i for i in range(5)])
+
+    def test_can_stream_json(self):
+        response = self.client.get('/api/areas/?stream=json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual(data, json.loads(self.client.get('/api/areas/').content.decode('utf-8')))
+
+    def test_can_stream_geojson(self):
+        response = self.client.get('/api/areas/?stream=geojson')
+        data = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual(data['type'], 'FeatureCollection')
+        self.assertEqual(len(data['features']), 5)
+        self.assertEqual(data['features'][0]['geometry']['type'], 'Polygon')
+
+    def test_can_stream_providers(self):
+        response = self.client.get('/api/providers/?stream=json')
+        data = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual(data[0]['email'], 'test@test.com')
+
+
+class ServiceAreaBulkTest(APITestCase):
+    def setUp(self):
+        self.provider_data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                              'phone_number': '+919739630033'}
+
+        self.provider = Provider.objects.create(**self.provider_data)
+        self.polygon = {"type": "Polygon", "coordinates": [[[100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0]]]}
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.provider.auth_token.key)
+
+    def test_can_import_feature_collection(self):
+        features = [{'type': 'Feature', 'geometry': self.polygon, 'properties': {'name': 'Area %d' % i, 'price': '10'}}
+                    for i in range(3)]
+        response = self.client.post('/api/areas/bulk/', {'type': 'FeatureCollection', 'features': features},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(ServiceArea.objects.filter(provider=self.provider).count(), 3)
+
+    def test_import_reports_invalid_records(self):
+        lines = [json.dumps({'name': 'Good area', 'price': '10', 'polygon': self.polygon}),
+                 json.dumps({'name': 'Bad area', 'price': 'free', 'polygon': self.polygon})]
+        response = self.client.post('/api/areas/bulk/', '\n'.join(lines), content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+
+    def test_import_reports_unreadable_lines(self):
+        lines = [json.dumps({'name': 'Area %d' % i, 'price': '10', 'polygon': self.polygon}) for i in range(2)]
+        lines.insert(1, '{"name": "Cut short", ')
+        response = self.client.post('/api/areas/bulk/', '\n'.join(lines), content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1])
+
+    def test_export_can_be_reimported(self):
+        ServiceArea.objects.create(provider=self.provider, name='Test area', price='40.25', polygon=json.dumps(self.polygon))
+        response = self.client.get('/api/areas/bulk/?output=ndjson&wkb=1')
+        dump = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(len(dump.splitlines()), 1)
+
+        response = self.client.post('/api/areas/bulk/', dump, content_type='application/x-ndjson')
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(ServiceArea.objects.filter(provider=self.provider, name='Test area').count(), 2)
+
+    def import_file(self, lines, **options):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as dump:
+            dump.write('\n'.join(lines))
+            dump.flush()
+            call_command('import_areas', self.provider.email, dump.name, chunk_size=1, stdout=StringIO(),
+                         stderr=StringIO(), **options)
+
+    def test_command_imports_nothing_when_a_record_is_rejected(self):
+        lines = [json.dumps({'name': 'Area %d' % i, 'price': '10', 'polygon': self.polygon}) for i in range(2)]
+        lines.append('{"name": "Cut short", ')
+        with self.assertRaises(CommandError):
+            self.import_file(lines)
+        self.assertFalse(ServiceArea.objects.filter(provider=self.provider).exists())
+
+        self.import_file(lines, chunk_commit=True)
+        self.assertEqual(ServiceArea.objects.filter(provider=self.provider).count(), 2)
+
+
+class ProviderWritePathTest(APITestCase):
+    def setUp(self):
+        self.data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                     'phone_number': '+919739630033'}
+
+    def test_update_does_not_recreate_token(self):
+        provider = Provider.objects.create(**self.data)
+        key = provider.auth_token.key
+        provider.language = 'new'
+        provider.save()
+        self.assertEqual(Token.objects.get(user=provider).key, key)
+
+    def test_create_makes_no_existence_check(self):
+        with CaptureQueriesContext(connection) as queries:
+            Provider.objects.create(**self.data)
+        self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith('SELECT')])
+
+    def test_can_bulk_create_providers(self):
+        providers = [dict(self.data, email='test%d@test.com' % i) for i in range(3)]
+        response = self.client.post('/api/providers/', providers, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 3)
+        for provider in Provider.objects.all():
+            self.assertEqual(provider.username, provider.email)
+            self.assertTrue(Token.objects.filter(user=provider).exists())
+
+
+class CachedTokenAuthenticationTest(APITransactionTestCase):
+    def setUp(self):
+        caches['auth_local'].clear()
+        caches['shared'].clear()
+        self.provider_data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                              'phone_number': '+919739630033'}
+
+        self.provider = Provider.objects.create(**self.provider_data)
+        self.area_data = {'name': 'Test area', 'price': '40.25',
+                          'polygon': '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ]]}'}
+        self.area = ServiceArea.objects.create(provider=self.provider, **self.area_data)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.provider.auth_token.key)
+
+    def test_authenticated_reads_make_no_auth_queries(self):
+        self.client.get('/api/areas/' + str(self.area.id))
+        with self.assertNumQueries(1):  # the area itself
+            response = self.client.get('/api/areas/' + str(self.area.id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_other_workers_read_the_shared_cache(self):
+        self.client.get('/api/areas/' + str(self.area.id))
+        caches['auth_local'].clear()  # a second worker, which has not seen the token yet
+        with self.assertNumQueries(1):  # the area itself
+            response = self.client.get('/api/areas/' + str(self.area.id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(DEBUG=False)
+    def test_process_local_shared_alias_is_reported(self):
+        self.assertEqual([message.id for message in checks.check_shared_caches(None)], ['providers.W001'])
+        with override_settings(CACHES=dict(settings.CACHES, shared={
+                'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'providers_cache'})):
+            self.assertEqual(checks.check_shared_caches(None), [])
+
+    def test_deleted_token_is_rejected(self):
+        self.client.get('/api/areas/')
+        caches['auth_local'].clear()  # stands in for the local cache expiring
+        Token.objects.filter(user=self.provider).delete()
+        self.assertEqual(self.client.get('/api/areas/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_provider_is_rejected(self):
+        self.client.get('/api/areas/')
+        caches['auth_local'].clear()
+        self.provider.is_active = False
+        self.provider.save()
+        self.assertEqual(self.client.get('/api/areas/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ServiceAreaDerivedGeometryTest(APITestCase):
+    def setUp(self):
+        self.provider_data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                              'phone_number': '+919739630033'}
+
+        self.provider = Provider.objects.create(**self.provider_data)
+        self.area_data = {'name': 'Test area', 'price': '40.25',
+                          'polygon': '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ]]}'}
+        self.area = ServiceArea.objects.create(provider=self.provider, **self.area_data)
+
+    def test_derived_columns_are_saved(self):
+        area = ServiceArea.objects.get(pk=self.area.id)
+        self.assertEqual((area.bbox_xmin, area.bbox_ymin, area.bbox_xmax, area.bbox_ymax), (100.0, 0.0, 101.0, 1.0))
+        self.assertTrue(area.polygon_core.within(area.polygon_planar))
+
+    def test_derived_columns_follow_polygon_updates(self):
+        auth_token = self.provider.auth_token
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + auth_token.key)
+        self.client.patch('/api/areas/' + str(self.area.id), {
+            'polygon': '{ "type": "Polygon", "coordinates": [ [ [10.0, 0.0], [11.0, 0.0], [11.0, 1.0], [10.0, 1.0], [10.0, 0.0] ]]}'})
+        self.assertEqual(ServiceArea.objects.get(pk=self.area.id).bbox_xmin, 10.0)
+
+    def test_point_near_edge_uses_exact_test(self):
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=100.9999')
+        self.assertEqual(len(response.data), 1)
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=101.0001')
+        self.assertEqual(len(response.data), 0)
+
+
+class InstrumentationTest(APITestCase):
+    def setUp(self):
+        self.provider_data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                              'phone_number': '+919739630033'}
+
+        self.provider = Provider.objects.create(**self.provider_data)
+        self.area_data = {'name': 'Test area', 'price': '40.25',
+                          'polygon': '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ]]}'}
+        self.area = ServiceArea.objects.create(provider=self.provider, **self.area_data)
+
+    def test_response_has_server_timing(self):
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+        self.assertIn('render;dur=', response['Server-Timing'])
+
+    def test_queries_are_counted_without_debug_cursors(self):
+        connection.queries_log.clear()
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        self.assertFalse(connection.force_debug_cursor)
+        self.assertEqual(len(connection.queries_log), 0)
+
+    def test_metrics_endpoint_exposes_histograms(self):
+        self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('providers_request_seconds_count{endpoint="providers.views.ServiceAreaQueryView"',
+                      response.content.decode('utf-8'))
+
+    def test_metrics_endpoint_is_local_only(self):
+        response = self.client.get('/api/metrics/', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'the ASGI query path needs Python 3.5+')
+class ASGIQueryTest(APITransactionTestCase):
+    def setUp(self):
+        self.provider_data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                              'phone_number': '+919739630033'}
+
+        self.provider = Provider.objects.create(**self.provider_data)
+        self.area_data = {'name': 'Test area', 'price': '40.25',
+                          'polygon': '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ]]}'}
+        self.area = ServiceArea.objects.create(provider=self.provider, **self.area_data)
+
+    def request(self, method, path, query_string=b'', body=b''):
+        import asyncio
+        from mozio.wsgi import application as wsgi_application
+        from providers.asgi import QueryApplication
+
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string, 'headers': [],
+                 'server': ('testserver', 80), 'client': ('127.0.0.1', 1234)}
+        asyncio.get_event_loop().run_until_complete(QueryApplication(wsgi_application)(scope, receive, send))
+        self.bodies = [message for message in sent[1:] if message['type'] == 'http.response.body']
+        return sent[0]['status'], json.loads(b''.join(message['body'] for message in self.bodies).decode('utf-8'))
+
+    def test_can_query_point(self):
+        status_code, data = self.request('GET', '/api/get_areas/', b'lat=0.5&lng=100.5')
+        self.assertEqual(status_code, 200)
+        self.assertEqual(data, [{'name': 'Test area', 'price': '40.25', 'provider': 'Test Smith'}])
+
+    def test_can_query_batch(self):
+        status_code, data = self.request('POST', '/api/get_areas/batch/', body=b'[[0.5, 100.5], [1.5, 100.5]]')
+        self.assertEqual([len(point['areas']) for point in data], [1, 0])
+
+    def test_rejects_invalid_point(self):
+        status_code, data = self.request('GET', '/api/get_areas/', b'lat=abc&lng=100.5')
+        self.assertEqual(status_code, 400)
+
+    def test_other_paths_fall_back_to_wsgi(self):
+        status_code, data = self.request('GET', '/api/providers/')
+        self.assertEqual(status_code, 200)
+        self.assertEqual(data[0]['email'], 'test@test.com')
+
+    @override_settings(PROVIDERS_BATCH_QUERY={'MAX_POINTS': 1})
+    def test_errors_keep_their_detail(self):
+        status_code, data = self.request('POST', '/api/get_areas/batch/', body=b'[[0.5, 100.5], [1.5, 100.5]]')
+        self.assertEqual((status_code, data), (400, {'detail': 'Too many points in one batch'}))
+
+    def test_fallback_streams_the_body(self):
+        Provider.objects.create(name='Other', email='other@test.com', language='test', currency='TST',
+                                phone_number='+919739630034')
+        status_code, data = self.request('GET', '/api/providers/', b'stream=json')
+        self.assertEqual(len(data), 2)
+        self.assertGreater(len(self.bodies), 2)
+        self.assertEqual([message.get('more_body', False) for message in self.bodies][-1], False)
+        self.assertTrue(all(message['more_body'] for message in self.bodies[:-1]))
+
+
+class ValuesSerializationTest(APITestCase):
+    def setUp(self):
+        self.provider_data = {'name': 'Test Smith  ', 'email': 'test@test.com', 'language': 'test',
+                              'currency': 'TST', 'phone_number': '+919739630033'}
+
+        self.provider = Provider.objects.create(**self.provider_data)
+        self.polygon = '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ], [ [100.2, 0.2], [100.00001, 0.2], [100.2, 0.3], [100.2, 0.2] ]]}'
+        self.area = ServiceArea.objects.create(provider=self.provider, name='Test \u00e1rea', price='40.2',
+                                               polygon=self.polygon)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.provider.auth_token.key)
+
+    def render(self, data):
+        return renderers.InstrumentedJSONRenderer().render(data)
+
+    def test_area_list_matches_model_serializer(self):
+        expected = self.render(ServiceAreaSerializer(ServiceArea.objects.all(), many=True).data)
+        self.assertEqual(self.client.get('/api/areas/').content, expected)
+
+    def test_provider_list_matches_model_serializer(self):
+        expected = self.render(ProviderSerializer(Provider.objects.all(), many=True).data)
+        self.assertEqual(self.client.get('/api/providers/').content, expected)
+
+    def test_query_response_matches_model_serializer(self):
+        areas = ServiceArea.objects.select_related('provider')
+        expected = self.render(ServiceAreaQueryResponseSerializer(areas, many=True).data)
+        self.assertEqual(self.client.get('/api/get_areas/?lat=0.5&lng=100.5').content, expected)
+
+    def test_values_follow_the_declarations(self):
+        class AreaNameSerializer(ValuesSerializerMixin, serializers.ModelSerializer):
+            values_fields = ('id', 'name')
+
+            class Meta:
+                model = ServiceArea
+                fields = ('name', 'id')
+
+        rows = AreaNameSerializer.values_queryset(ServiceArea.objects.all())
+        self.assertEqual(AreaNameSerializer.values_data(rows), [AreaNameSerializer(self.area).data])
+
+    def test_wkb_matches_geos_coordinates(self):
+        polygon = ServiceArea.objects.get(pk=self.area.id).polygon
+        geometry = wkb_to_geojson(polygon.ewkb)
+        self.assertEqual(geometry['type'], 'Polygon')
+        self.assertEqual(json.dumps(geometry['coordinates']), json.dumps(polygon.coords))
+
+    def test_renderer_falls_back_for_rich_types(self):
+        data = {'price': Decimal('1.50')}
+        self.assertEqual(renderers.FastJSONRenderer().render(data), self.render(data))
+
+    def test_browsers_get_the_browsable_api(self):
+        response = self.client.get('/api/providers/', HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+
+
+@override_settings(PROVIDERS_COVERAGE_TILES={'ENABLED': True, 'RESOLUTION': 0.25})
+class CoverageTileTest(APITestCase):
+    def setUp(self):
+        self.provider_data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                              'phone_number': '+919739630033'}
+
+        self.provider = Provider.objects.create(**self.provider_data)
+        self.area_data = {'name': 'Test area', 'price': '40.25',
+                          'polygon': '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ]]}'}
+        self.area = ServiceArea.objects.create(provider=self.provider, **self.area_data)
+
+    def test_cells_are_written_on_create(self):
+        cells = CoverageCell.objects.filter(area=self.area)
+        self.assertEqual(cells.filter(full=True).count(), 4)  # the inner 2x2 cells, the border ones are partial
+        self.assertTrue(cells.filter(cell_x=400, cell_y=0, full=False).exists())
+
+    def test_can_query_through_grid(self):
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        self.assertEqual(response.data[0]['name'], 'Test area')
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=101.1')
+        self.assertEqual(len(response.data), 0)
+
+    def test_cells_follow_polygon_updates(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.provider.auth_token.key)
+        self.client.patch('/api/areas/' + str(self.area.id), {
+            'polygon': '{ "type": "Polygon", "coordinates": [ [ [10.0, 0.0], [11.0, 0.0], [11.0, 1.0], [10.0, 1.0], [10.0, 0.0] ]]}'})
+        self.assertFalse(CoverageCell.objects.filter(cell_x=400).exists())
+        self.assertEqual(len(self.client.get('/api/get_areas/?lat=0.5&lng=10.5').data), 1)
+
+    def test_cells_are_deleted_with_area(self):
+        self.area.delete()
+        self.assertFalse(CoverageCell.objects.exists())
+
+    def test_rebuild(self):
+        CoverageCell.objects.all().delete()
+        self.assertEqual(coverage.rebuild(), 25)
+
+    def test_cells_cover_great_circle_edges(self):
+        polygon = json.dumps({'type': 'Polygon', 'coordinates': [[[0, 44], [20, 44], [20, 45], [0, 45], [0, 44]]]})
+        ServiceArea.objects.create(provider=self.provider, name='Wide area', price='10', polygon=polygon)
+        self.assertEqual(len(self.client.get('/api/get_areas/?lat=45.3&lng=10').data), 1)  # north of the vertices
+        self.assertEqual(len(self.client.get('/api/get_areas/?lat=44.3&lng=10').data), 0)
+
+    @override_settings(PROVIDERS_COVERAGE_TILES={'ENABLED': True, 'RESOLUTION': 0.25, 'MAX_CELLS_PER_AREA': 16})
+    def test_large_areas_are_left_untiled(self):
+        area = ServiceArea.objects.create(provider=self.provider, name='Large area', price='10', polygon=square(10, 0))
+        self.assertEqual(list(CoverageCell.objects.filter(area=area).values_list('cell_x', 'cell_y', 'full')),
+                         [(CoverageCell.UNTILED, CoverageCell.UNTILED, False)])
+        self.assertEqual(len(self.client.get('/api/get_areas/?lat=0.5&lng=10.5').data), 1)
+        self.assertEqual(len(self.client.get('/api/get_areas/?lat=0.5&lng=11.5').data), 0)
+
+
+@override_settings(PROVIDERS_REPLICAS={'ALIASES': ('replica',), 'MAX_LAG': 5, 'CHECK_INTERVAL': 60,
+                                       'PIN_SECONDS': 5, 'PIN_CACHE': 'shared'})
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        routers.health.record('replica', True)
+
+    def tearDown(self):
+        routers.health._status.clear()
+
+    def test_reads_go_to_primary_outside_replica_blocks(self):
+        self.assertEqual(self.router.db_for_read(ServiceArea), 'default')
+        with routers.routing(use_replicas=False):
+            self.assertEqual(self.router.db_for_read(ServiceArea), 'default')
+
+    def test_reads_go_to_healthy_replica(self):
+        with routers.routing(use_replicas=True):
+            self.assertEqual(self.router.db_for_read(ServiceArea), 'replica')
+
+    def test_reads_after_write_stay_on_primary(self):
+        with routers.routing(use_replicas=True):
+            self.assertEqual(self.router.db_for_write(ServiceArea), 'default')
+            self.assertEqual(self.router.db_for_read(ServiceArea), 'default')
+
+    def test_lagging_replica_leaves_rotation(self):
+        routers.health.record('replica', False)
+        with routers.routing(use_replicas=True):
+            self.assertEqual(self.router.db_for_read(ServiceArea), 'default')
+
+    def test_clients_are_pinned_after_writes(self):
+        routers.pin('Token abc')
+        self.assertTrue(routers.is_pinned('Token abc'))
+        self.assertFalse(routers.is_pinned('Token def'))
+
+
+@unittest.skipUnless('replica' in settings.DATABASES, 'set REPLICA_DB_HOST to test against a replica')
+class ReplicaRoutingTest(APITransactionTestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.provider_data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                              'phone_number': '+919739630033'}
+
+        self.provider = Provider.objects.create(**self.provider_data)
+        self.area_data = {'name': 'Test area', 'price': '40.25',
+                          'polygon': '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ]]}'}
+        self.area = ServiceArea.objects.create(provider=self.provider, **self.area_data)
+        caches['shared'].clear()
+        routers.health._status.clear()
+
+    def test_point_query_reads_replica(self):
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        self.assertEqual(len(response.data), 1)
+        self.assertTrue(queries.captured_queries)
+
+    def test_batch_query_reads_replica(self):
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = self.client.post('/api/get_areas/batch/', [[0.5, 100.5]], format='json')
+        self.assertEqual(len(response.data[0]['areas']), 1)
+        self.assertTrue(queries.captured_queries)
+
+    def test_caught_up_replica_has_no_lag(self):
+        self.assertEqual(routers.replication_lag('replica'), 0.0)
+
+    def test_writer_reads_primary(self):
+        self.client.patch('/api/providers/' + str(self.provider.id), {'language': 'en'})
+        with CaptureQueriesContext(connections['replica']) as queries:
+            self.client.get('/api/providers/' + str(self.provider.id))
+        self.assertFalse(queries.captured_queries)
+
+
+@unittest.skipIf(offline.np is None, 'offline matching needs numpy')
+class OfflineMatchTest(APITestCase):
+    def setUp(self):
+        self.provider_data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                              'phone_number': '+919739630033'}
+
+        self.provider = Provider.objects.create(**self.provider_data)
+        ServiceArea.objects.create(provider=self.provider, name='Test area', price='40.25',
+                                   polygon='{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ], [ [100.2, 0.2], [100.4, 0.2], [100.4, 0.4], [100.2, 0.4], [100.2, 0.2] ]]}')
+        ServiceArea.objects.create(provider=self.provider, name='Other area', price='10',
+                                   polygon='{ "type": "Polygon", "coordinates": [ [ [100.5, 0.5], [102.0, 0.5], [102.0, 2.0], [100.5, 2.0], [100.5, 0.5] ]]}')
+        self.points = [(0.5, 100.1), (0.3, 100.3), (0.7, 100.7), (1.5, 101.5), (5.0, 5.0)]
+
+    def test_matches_api(self):
+        columns = offline.match_points([lat for lat, lng in self.points], [lng for lat, lng in self.points])
+        matched = list(zip(columns['point'].tolist(), columns['area'].tolist(), columns['price'].tolist()))
+        expected = []
+        for index, (lat, lng) in enumerate(self.points):
+            response = self.client.get('/api/get_areas/?lat=%s&lng=%s' % (lat, lng))
+            expected += sorted((index, area['name'], area['price']) for area in response.data)
+        self.assertEqual(sorted(matched), sorted(expected))
+
+    def test_blocks_keep_input_order(self):
+        areas = offline.load_areas()
+        blocks = offline.read_points(io.StringIO(u'lat,lng\n' + u''.join(u'%s,%s\n' % point for point in self.points)),
+                                     block_size=2)
+        points = []
+        for columns in offline.match_blocks(areas, blocks, processes=1):
+            points += columns['point'].tolist()
+        self.assertEqual(points, [0, 2, 2, 3])
+
+    def test_long_edges_follow_the_great_circle(self):
+        ServiceArea.objects.create(provider=self.provider, name='Long area', price='5',
+                                   polygon='{ "type": "Polygon", "coordinates": [ [ [0.0, 50.0], [40.0, 50.0], [40.0, 60.0], [0.0, 60.0], [0.0, 50.0] ]]}')
+        # the edges along the parallels bow north, to about 61.5 and 51.7 halfway
+        points = [(61.0, 20.0), (51.0, 20.0)]
+        columns = offline.match_points([lat for lat, lng in points], [lng for lat, lng in points])
+        self.assertEqual(columns['point'].tolist(), [0])
+        self.assertEqual([len(self.client.get('/api/get_areas/?lat=%s&lng=%s' % point).data) for point in points], [1, 0])
+
+
+class ServiceAreaQuoteTest(APITestCase):
+    def setUp(self):
+        spatial_index.reset()
+        self.polygon = '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ]]}'
+        for i, (currency, language, price) in enumerate([('USD', 'en', '30'), ('EUR', 'de', '10'), ('USD', 'es', '20'),
+                                                          ('USD', 'en', '25')]):
+            provider = Provider.objects.create(name='Test Smith %d' % i, email='test%d@test.com' % i, language=language,
+                                               currency=currency, phone_number='+919739630033')
+            ServiceArea.objects.create(provider=provider, name='Test area %d' % i, price=price, polygon=self.polygon)
+
+    def tearDown(self):
+        spatial_index.reset()
+
+    def test_returns_cheapest_areas(self):
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5&limit=2')
+        self.assertEqual([area['price'] for area in response.data], ['10.00', '20.00'])
+
+    def test_filters_by_currency_and_language(self):
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5&currency=USD&language=en')
+        self.assertEqual([area['name'] for area in response.data], ['Test area 3', 'Test area 0'])
+
+    def test_rejects_invalid_limit(self):
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5&limit=0')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_index_quotes_match_database(self):
+        expected = self.client.get('/api/get_areas/?lat=0.5&lng=100.5&currency=USD&limit=2').data
+        with override_settings(PROVIDERS_SPATIAL_INDEX={'ENABLED': True, 'CELL_SIZE': 0.5, 'CHECK_INTERVAL': 0}):
+            response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5&currency=USD&limit=2')
+        self.assertEqual(response.data, expected)
+
+
+@override_settings(PROVIDERS_GEOMETRY={'BORDER_MARGIN': 0.001, 'SIMPLIFY_TOLERANCE': 0.0005, 'NORMALIZE_TOLERANCE': 0,
+                                       'MAX_VERTICES': 100, 'PIECE_VERTICES': 16})
+class GeometryNormalizationTest(APITestCase):
+    def setUp(self):
+        self.provider_data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                              'phone_number': '+919739630033'}
+
+        self.provider = Provider.objects.create(**self.provider_data)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.provider.auth_token.key)
+
+    def circle(self, vertices):
+        import math
+        ring = [[100.5 + 0.5 * math.cos(2 * math.pi * i / vertices), 0.5 + 0.5 * math.sin(2 * math.pi * i / vertices)]
+                for i in range(vertices)]
+        return json.dumps({'type': 'Polygon', 'coordinates': [ring + ring[:1]]})
+
+    def test_self_intersection_is_repaired(self):
+        # a square with a zero width spike, the ring overlaps itself along the spike
+        polygon = '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.5], [99.5, 0.5], [100.0, 0.5], [100.0, 0.0] ]]}'
+        response = self.client.post('/api/areas/', {'name': 'Test area', 'price': '10', 'polygon': polygon})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(ServiceArea.objects.get(pk=response.data['id']).polygon.valid)
+
+    def test_bowtie_is_rejected(self):
+        polygon = '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 1.0], [101.0, 0.0], [100.0, 1.0], [100.0, 0.0] ]]}'
+        response = self.client.post('/api/areas/', {'name': 'Test area', 'price': '10', 'polygon': polygon})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('polygon', response.data)
+
+    def test_vertex_limit(self):
+        response = self.client.post('/api/areas/', {'name': 'Test area', 'price': '10', 'polygon': self.circle(200)})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_large_polygons_are_subdivided(self):
+        response = self.client.post('/api/areas/', {'name': 'Test area', 'price': '10', 'polygon': self.circle(64)})
+        area = ServiceArea.objects.get(pk=response.data['id'])
+        self.assertTrue(area.subdivided)
+        self.assertGreater(area.pieces.count(), 1)
+        self.assertEqual(area.polygon.num_points, 65)  # kept whole for display
+        self.assertEqual(len(self.client.get('/api/get_areas/?lat=0.5&lng=100.999').data), 1)
+        self.assertEqual(len(self.client.get('/api/get_areas/?lat=0.9&lng=100.9').data), 0)
+        self.assertEqual(len(self.client.post('/api/get_areas/batch/', [[0.5, 100.999], [0.9, 100.9]],
+                                              format='json').data[0]['areas']), 1)
+
+    def test_audit_reports_stale_bounding_boxes_and_missing_pieces(self):
+        response = self.client.post('/api/areas/', {'name': 'Test area', 'price': '10', 'polygon': self.circle(64)})
+        area = ServiceArea.objects.get(pk=response.data['id'])
+        ServiceArea.objects.filter(pk=area.pk).update(bbox_ymax=2.0)
+        area.pieces.all().delete()
+
+        out = StringIO()
+        call_command('audit_geometries', stdout=out)
+        self.assertIn('area %d: stale bounding box, missing pieces' % area.pk, out.getvalue())
+        call_command('audit_geometries', fix=True, stdout=StringIO())
+        out = StringIO()
+        call_command('audit_geometries', stdout=out)
+        self.assertEqual(out.getvalue(), '0 areas reported, 0 fixed\n')
+
+    def test_wide_areas_follow_great_circle_edges(self):
+        # the 20 degree wide edges bow about 0.44 degrees toward the pole halfway along
+        polygon = json.dumps({'type': 'Polygon', 'coordinates': [[[0, 44], [20, 44], [20, 45], [0, 45], [0, 44]]]})
+        response = self.client.post('/api/areas/', {'name': 'Wide area', 'price': '10', 'polygon': polygon})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertGreater(ServiceArea.objects.get(pk=response.data['id']).bbox_ymax, 45.43)
+
+        points = [(45.2, 10), (44.6, 10), (44.2, 10), (45.5, 10)]  # poleward of the north edge, inside, south, north
+        expected = [1, 1, 0, 0]
+        self.assertEqual([len(self.client.get('/api/get_areas/?lat=%s&lng=%s' % point).data) for point in points],
+                         expected)
+        response = self.client.post('/api/get_areas/batch/', points, format='json')
+        self.assertEqual([len(result['areas']) for result in response.data], expected)
+
+
+class ConditionalGetTest(APITestCase):
+    def setUp(self):
+        self.provider_data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                              'phone_number': '+919739630033'}
+
+        self.provider = Provider.objects.create(**self.provider_data)
+        self.area_data = {'name': 'Test area', 'price': '40.25',
+                          'polygon': '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ]]}'}
+        self.area = ServiceArea.objects.create(provider=self.provider, **self.area_data)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.provider.auth_token.key)
+
+    def test_unchanged_list_is_not_modified(self):
+        etag = self.client.get('/api/areas/')['ETag']
+        with self.assertNumQueries(1):  # the aggregate, the token comes from the auth cache
+            response = self.client.get('/api/areas/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_changes_give_new_etag(self):
+        etag = self.client.get('/api/areas/')['ETag']
+        self.client.patch('/api/areas/' + str(self.area.id), {'price': '60'})
+        response = self.client.get('/api/areas/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_deleting_from_list_gives_new_etag(self):
+        ServiceArea.objects.create(provider=self.provider, **self.area_data)
+        etag = self.client.get('/api/areas/')['ETag']
+        self.client.delete('/api/areas/' + str(self.area.id))
+        response = self.client.get('/api/areas/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_detail_honours_if_modified_since(self):
+        response = self.client.get('/api/providers/' + str(self.provider.id))
+        response = self.client.get('/api/providers/' + str(self.provider.id),
+                                   HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_detail_is_fetched_once(self):
+        with self.assertNumQueries(1):  # the area, which also gives the validators
+            response = self.client.get('/api/areas/' + str(self.area.id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/areas/' + str(self.area.id), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_missing_detail_is_not_found(self):
+        response = self.client.get('/api/areas/0')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(ROOT_URLCONF=settings_query.ROOT_URLCONF, MIDDLEWARE=settings_query.MIDDLEWARE)
+class QueryWorkerProfileTest(APITestCase):
+    def setUp(self):
+        self.provider = Provider.objects.create(name='Test Smith', email='test@test.com', language='test',
+                                                currency='TST', phone_number='+919739630033')
+        ServiceArea.objects.create(provider=self.provider, name='Test area', price='40.25', polygon=(
+            '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ]]}'))
+
+    def test_serves_point_queries(self):
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
+        response = self.client.post('/api/get_areas/batch/', [[0.5, 100.5], [1.5, 100.5]], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_does_not_serve_other_endpoints(self):
+        self.assertEqual(self.client.get('/api/providers/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/admin/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_starts_lighter_than_full_profile(self):
+        full = benchmarks.measure_startup('mozio.settings', runs=1)
+        query = benchmarks.measure_startup('mozio.settings_query', runs=1)
+        self.assertLess(query['modules'], full['modules'])
+
+
+@override_settings(PROVIDERS_PROVIDER_COVERAGE={'ENABLED': True, 'PRICE_TIERS': (), 'PRUNE': False})
+class BenchmarkTest(APITestCase):
+    def setUp(self):
+        self.providers = benchmarks.generate(20, areas_per_provider=10)
+
+    def test_generated_areas_go_through_the_bulk_path(self):
+        self.assertEqual(ProviderCoverage.objects.filter(tier=0).count(), 2)
+        self.assertEqual(sum(ProviderCoverage.objects.values_list('area_count', flat=True)), 20)
+
+    def test_every_scenario_succeeds(self):
+        for name, factory in benchmarks.scenarios(self.providers, 20):
+            result = benchmarks.run_in_process(factory, 2)
+            self.assertEqual(result['errors'], 0, name)
+            self.assertGreater(result['queries_per_request'], 0, name)
+
+
+class ChangeFeedTest(APITransactionTestCase):
+    # the feed only serves committed transactions, so these tests cannot run inside one
+
+    def setUp(self):
+        caches['auth_local'].clear()
+        caches['shared'].clear()
+        self.provider_data = {'name': 'Test Smith', 'email': 'test@test.com', 'language': 'test', 'currency': 'TST',
+                              'phone_number': '+919739630033'}
+        self.provider = Provider.objects.create(**self.provider_data)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.provider.auth_token.key)
+        self.area_data = {'name': 'Test area', 'price': '40.25',
+                          'polygon': '{ "type": "Polygon", "coordinates": [ [ [100.0, 0.0], [101.0, 0.0], [101.0, 1.0], [100.0, 1.0], [100.0, 0.0] ]]}'}
+
+    def read(self, since=None, limit=None):
+        params = dict((key, value) for key, value in (('since', since), ('limit', limit)) if value is not None)
+        response = self.client.get('/api/changes/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(b''.join(response.streaming_content).decode('utf-8'))
+
+    def test_logs_writes_in_order(self):
+        area_id = self.client.post('/api/areas/', self.area_data).data['id']
+        self.client.patch('/api/areas/' + str(area_id), {'price': '60'})
+        self.client.delete('/api/areas/' + str(area_id))
+
+        feed = self.read()
+        self.assertEqual([(change['model'], change['action']) for change in feed['changes']], [
+            ('provider', 'create'), ('servicearea', 'create'), ('servicearea', 'update'), ('servicearea', 'delete')])
+        self.assertEqual(feed['changes'][0]['data']['email'], 'test@test.com')
+        self.assertEqual(feed['changes'][2]['data']['price'], '60.00')
+        self.assertEqual(feed['changes'][2]['data']['polygon']['type'], 'Polygon')
+        self.assertIsNone(feed['changes'][3]['data'])
+        self.assertEqual(feed['next'], feed['changes'][-1]['cursor'])
+
+    def test_reads_on_from_cursor(self):
+        feed = self.read(limit=1)
+        self.assertEqual(len(feed['changes']), 1)
+
+        self.client.patch('/api/providers/' + str(self.provider.id), {'language': 'en'})
+        feed = self.read(since=feed['next'])
+        self.assertEqual([change['action'] for change in feed['changes']], ['update'])
+        self.assertEqual(feed['changes'][0]['data']['language'], 'en')
+
+        feed = self.read(since=feed['next'])
+        self.assertEqual(feed['changes'], [])
+        self.assertEqual(self.read(since=feed['next'])['next'], feed['next'])
+
+    def test_logs_bulk_writes(self):
+        providers = [dict(self.provider_data, email='test%d@test.com' % i) for i in range(2)]
+        self.client.post('/api/providers/', providers, format='json')
+        self.client.post('/api/areas/bulk/', {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {'name': 'Bulk area', 'price': '10'},
+             'geometry': json.loads(self.area_data['polygon'])}]}, format='json')
+
+        feed = self.read()
+        self.assertEqual([(change['model'], change['action']) for change in feed['changes'][1:]], [
+            ('provider', 'create'), ('provider', 'create'), ('servicearea', 'create')])
+
+    def test_deleting_provider_logs_its_areas(self):
+        area = ServiceArea.objects.create(provider=self.provider, **self.area_data)
+        provider_id = self.provider.id
+        self.provider.delete()
+        deleted = [(change['model'], change['id']) for change in self.read()['changes'] if change['action'] == 'delete']
+        self.assertEqual(sorted(deleted), [('provider', provider_id), ('servicearea', area.id)])
+
+    def test_rejects_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/changes/?since=abc').status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(PROVIDERS_CHANGES={'ALLOWED_IPS': ()})
+    def test_only_answers_allowed_ips(self):
+        self.assertEqual(self.client.get('/api/changes/').status_code, status.HTTP_403_FORBIDDEN)
+
+
+THROTTLE = {
+    'ENABLED': True,
+    'CACHE': 'shared',
+    'INTERNAL_IPS': (),
+    'CLASSES': {
+        'internal': {'RATE': None, 'SHED_AT': None},
+        'token': {'RATE': 1, 'BURST': 4, 'SHED_AT': 2.0},
+        'anon': {'RATE': 1, 'BURST': 2, 'SHED_AT': 1.0},
+    },
+    'MAX_IN_FLIGHT': 64,
+    'MAX_DB_LATENCY': 0.5,
+}
+
+
+@override_settings(PROVIDERS_THROTTLE=THROTTLE)
+class ThrottleTest(APITestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        caches['auth_local'].clear()
+        throttling.buckets.clear()
+        metrics.registry.clear()
+        self.provider = Provider.objects.create(name='Test Smith', email='test@test.com', language='test',
+                                                currency='TST', phone_number='+919739630033')
+
+    def tearDown(self):
+        throttling.buckets.clear()
+        metrics.registry.clear()
+
+    def query(self, **extra):
+        return self.client.get('/api/get_areas/?lat=0.5&lng=100.5', **extra)
+
+    def test_throttles_anonymous_clients_per_ip(self):
+        self.assertEqual([self.query().status_code for _ in range(2)], [200, 200])
+        with self.assertNumQueries(0):
+            response = self.query()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.query(REMOTE_ADDR='10.0.0.2').status_code, status.HTTP_200_OK)
+
+    def test_known_tokens_get_their_own_bucket(self):
+        token = 'Token ' + self.provider.auth_token.key
+        self.client.get('/api/areas/', HTTP_AUTHORIZATION=token)  # caches the token
+        statuses = [self.query(HTTP_AUTHORIZATION=token).status_code for _ in range(5)]
+        self.assertEqual(statuses, [200] * 4 + [429])
+        self.assertEqual(self.query().status_code, status.HTTP_200_OK)
+
+    def test_unknown_tokens_count_as_anonymous(self):
+        statuses = [self.query(HTTP_AUTHORIZATION='Token %d' % i).status_code for i in range(3)]
+        self.assertEqual(statuses[-1], status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_other_endpoints_are_not_throttled(self):
+        statuses = [self.client.get('/api/providers/').status_code for _ in range(3)]
+        self.assertEqual(statuses, [200] * 3)
+
+    @override_settings(PROVIDERS_THROTTLE=dict(THROTTLE, MAX_IN_FLIGHT=1))
+    def test_sheds_low_priority_requests_under_load(self):
+        with self.assertNumQueries(0):
+            response = self.query()
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        token = 'Token ' + self.provider.auth_token.key
+        self.client.get('/api/areas/', HTTP_AUTHORIZATION=token)
+        self.assertEqual(self.query(HTTP_AUTHORIZATION=token).status_code, status.HTTP_200_OK)
+
+    def test_sheds_on_slow_queries(self):
+        request_metrics = metrics.RequestMetrics()
+        request_metrics.sql_count, request_metrics.sql_time = 2, 2.0
+        metrics.registry.observe('test', 'GET', 200, request_metrics)
+        self.assertEqual(self.query().status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_internal_ips_are_never_limited(self):
+        with self.settings(PROVIDERS_THROTTLE=dict(THROTTLE, INTERNAL_IPS=('127.0.0.1',), MAX_IN_FLIGHT=1)):
+            statuses = [self.query().status_code for _ in range(4)]
+        self.assertEqual(statuses, [200] * 4)
+
+    def test_process_local_buckets_stop_the_app_from_loading(self):
+        self.assertEqual([message.id for message in checks.check_shared_caches(None)], ['providers.E001'])
+        with self.assertRaises(ImproperlyConfigured):
+            apps.get_app_config('providers').ready()
+
+
+@override_settings(PROVIDERS_PROVIDER_COVERAGE={'ENABLED': True, 'PRICE_TIERS': (15, 25), 'PRUNE': True})
+class ProviderCoverageTest(APITestCase):
+    def setUp(self):
+        self.airline = Provider.objects.create(name='Airline', email='airline@test.com', language='en',
+                                               currency='USD', phone_number='+919739630033')
+        self.local = Provider.objects.create(name='Local', email='local@test.com', language='en',
+                                             currency='USD', phone_number='+919739630034')
+        self.airport = ServiceArea.objects.create(provider=self.airline, name='Airport', price='30.00',
+                                                  polygon=square(100, 0))
+        ServiceArea.objects.create(provider=self.airline, name='Downtown', price='20.00', polygon=square(101, 0))
+        ServiceArea.objects.create(provider=self.local, name='Airport', price='10.00', polygon=square(100, 0))
+        provider_coverage.pending_rebuilds().clear()
+
+    def providers(self, query):
+        response = self.client.get('/api/get_providers/?' + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [provider['name'] for provider in response.data]
+
+    def test_unions_are_kept_per_tier(self):
+        rows = dict(((row.provider_id, row.tier), row) for row in ProviderCoverage.objects.all())
+        self.assertEqual(sorted(rows), [(self.airline.pk, 0), (self.airline.pk, 2),
+                                        (self.local.pk, 0), (self.local.pk, 1), (self.local.pk, 2)])
+        self.assertEqual(rows[(self.airline.pk, 0)].area_count, 2)
+        self.assertAlmostEqual(rows[(self.airline.pk, 0)].polygon.area, 2.0, places=6)
+        self.assertEqual(rows[(self.airline.pk, 2)].max_price, Decimal('25.00'))
+
+    def test_can_query_providers(self):
+        self.assertEqual(self.providers('lat=0.5&lng=100.5'), ['Airline', 'Local'])
+        self.assertEqual(self.providers('lat=0.5&lng=101.5'), ['Airline'])
+        self.assertEqual(self.providers('lat=0.5&lng=102.5'), [])
+        self.assertEqual(self.providers('lat=0.5&lng=100.5&max_price=12'), ['Local'])
+        self.assertEqual(self.providers('lat=0.5&lng=101.5&max_price=25'), ['Airline'])
+        self.assertEqual(self.providers('lat=0.5&lng=100.5&max_price=20'), ['Local'])
+
+    def test_points_near_the_edge_are_exact(self):
+        self.assertEqual(self.providers('lat=0.5&lng=100.00001'), ['Airline', 'Local'])
+        self.assertEqual(self.providers('lat=0.5&lng=99.99999'), [])
+
+    def test_answers_match_the_per_area_query(self):
+        for lat, lng, max_price in ((0.5, 100.5, None), (0.5, 101.0, None), (0.99999, 101.5, '25'), (0.5, 99.9, None)):
+            query = 'lat=%s&lng=%s' % (lat, lng) + ('&max_price=%s' % max_price if max_price else '')
+            with self.settings(PROVIDERS_PROVIDER_COVERAGE={'ENABLED': False}):
+                expected = self.providers(query)
+            self.assertEqual(self.providers(query), expected)
+
+    def test_writes_update_the_unions(self):
+        self.airport.polygon = square(103, 0)
+        self.airport.save()
+        self.assertEqual(self.providers('lat=0.5&lng=100.5'), ['Local'])
+        self.assertEqual(self.providers('lat=0.5&lng=103.5'), ['Airline'])
+
+        self.airport.price = '12.00'
+        self.airport.save(update_fields=['price'])
+        self.assertEqual(self.providers('lat=0.5&lng=103.5&max_price=15'), ['Airline'])
+
+        self.airport.delete()
+        self.assertEqual(self.providers('lat=0.5&lng=103.5'), [])
+        provider_coverage.rebuild([self.airline.pk])  # run on commit, which test transactions never reach
+        self.assertFalse(ProviderCoverage.objects.filter(provider=self.airline, tier=1).exists())
+        self.assertEqual(self.providers('lat=0.5&lng=101.5'), ['Airline'])
+
+    def test_deletes_rebuild_each_provider_once(self):
+        for i in range(5):
+            ServiceArea.objects.create(provider=self.local, name='Area %d' % i, price='10.00', polygon=square(110 + i, 0))
+        ServiceArea.objects.filter(provider=self.local).delete()
+        self.assertTrue(ProviderCoverage.objects.get(provider=self.local, tier=0).polygon_inner.empty)
+        self.assertEqual(provider_coverage.pending_rebuilds(), set([self.local.pk]))
+        self.assertEqual(self.providers('lat=0.5&lng=100.5'), ['Airline'])
+
+        provider_coverage._rebuild_pending()  # run on commit, which test transactions never reach
+        self.assertFalse(ProviderCoverage.objects.filter(provider=self.local).exists())
+        with self.assertNumQueries(0):
+            provider_coverage._rebuild_pending()  # the callbacks queued by the other deletes
+
+    def test_bulk_imports_extend_the_unions(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.local.auth_token.key)
+        features = [{'type': 'Feature', 'properties': {'name': 'Harbour', 'price': '5.00'},
+                     'geometry': json.loads(square(104, 0))}]
+        response = self.client.post('/api/areas/bulk/', {'type': 'FeatureCollection', 'features': features},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.providers('lat=0.5&lng=104.5&max_price=5'), ['Local'])
+        self.assertEqual(ProviderCoverage.objects.get(provider=self.local, tier=0).area_count, 2)
+
+    def test_rebuild_recomputes_the_unions(self):
+        ProviderCoverage.objects.all().delete()
+        provider_coverage.rebuild()
+        self.assertEqual(ProviderCoverage.objects.count(), 5)
+        self.assertEqual(self.providers('lat=0.5&lng=100.5'), ['Airline', 'Local'])
+
+    def test_pruned_point_lookups_match(self):
+        response = self.client.get('/api/get_areas/?lat=0.5&lng=100.5')
+        self.assertEqual(sorted(area['provider'] for area in response.data), ['Airline', 'Local'])
+
+    def test_cannot_query_invalid_price(self):
+        response = self.client.get('/api/get_providers/?lat=0.5&lng=100.5&max_price=cheap')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class QueryPlanTest(query_plans.QueryPlanTestMixin, APITestCase):
+    def setUp(self):
+        self.provider = Provider.objects.create(name='Airline', email='airline@test.com', language='en',
+                                                currency='USD', phone_number='+919739630033')
+        for i in range(3):
+            ServiceArea.objects.create(provider=self.provider, name='Area %d' % i, price='10.00', polygon=square(100 + i, 0))
+
+    def test_point_lookup_uses_spatial_index(self):
+        self.assertUsesIndex(queries.point_rows(0.5, 100.5), 'providers_servicearea_polygon_id')
+        self.assertUsesIndex(ServiceArea.objects.matching_points_sql([(0.5, 100.5)]),
+                             'providers_servicearea_polygon_id')
+
+    def test_view_queries_can_use_indexes(self):
+        for name, query in query_plans.view_queries(**query_plans.sample_arguments()):
+            if name != 'GenerateTokenView':  # auth_user.email is not indexed
+                self.assertNoSeqScan(query)
+
+    def test_flags_sequential_scans(self):
+        summaries = {'GenerateTokenView': query_plans.summarize(query_plans.explain(
+            Provider.objects.filter(email='airline@test.com')))}
+        self.assertEqual(query_plans.problems(summaries, seq_scan_rows=10 ** 9), [])
+        found = query_plans.problems(summaries, seq_scan_rows=0)
+        self.assertEqual([name for name, problem in found], ['GenerateTokenView'])
+        self.assertIn('auth_user', found[0][1])
+
+    def test_flags_dropped_spatial_index(self):
+        self.assertEqual(query_plans.missing_indexes(), [])
+        query = queries.point_rows(0.5, 100.5)
+        baseline = {'get_areas': query_plans.summarize(query_plans.explain(query, force_indexes=True))}
+
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX providers_servicearea_polygon_id')
+        self.assertIn(('providers_servicearea', 'polygon', 'gist'), query_plans.missing_indexes())
+        summaries = {'get_areas': query_plans.summarize(query_plans.explain(query, force_indexes=True))}
+        self.assertIn(('get_areas', 'no longer uses index providers_servicearea_polygon_id'),
+                      query_plans.problems(summaries, baseline, seq_scan_rows=10 ** 9))
+
+    def test_flags_cost_regressions(self):
+        baseline = {'get_areas': {'indexes': ['a'], 'seq_scans': [], 'cost': 10.0}}
+        summaries = {'get_areas': {'indexes': ['a'], 'seq_scans': [], 'cost': 15.0}}
+        self.assertEqual(query_plans.problems(summaries, baseline, cost_factor=2.0), [])
+        summaries['get_areas']['cost'] = 25.0
+        self.assertEqual(query_plans.problems(summaries, baseline, cost_factor=2.0),
+                         [('get_areas', 'estimated cost went from 10.0 to 25.0')])
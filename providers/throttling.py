@@ -0,0 +1,182 @@
+"""
+Rate limits and load shedding for the query endpoints, decided before any database work.
+ThrottleMiddleware applies them to views listing the request method in throttle_methods, the
+ASGI query path to its point lookups.
+
+Requests fall into the priority classes of PROVIDERS_THROTTLE["CLASSES"]: "internal" for INTERNAL_IPS,
+"token" for tokens the authentication cache already knows and "anon" for everyone else. Tokens are
+not looked up in the database here, so an unknown token counts as anonymous until it has
+authenticated once. Token clients get a bucket per token and anonymous clients one per IP.
+
+Buckets are kept in the shared cache as GCRA theoretical arrival times, one value per client, so all
+workers enforce one limit. A worker leases LEASE tokens at a time and spends them locally. A client
+over its limit is then rejected locally until its retry time, without touching the cache. Updates are
+read-modify-write, so concurrent workers can let a client go over its limit by about a lease each.
+Unspent leases are lost to the client, so keep LEASE well below BURST.
+
+Each class is shed with a 503 from its SHED_AT load on. The load is the higher of how full the request
+queue is (requests in flight over MAX_IN_FLIGHT, or pending lookups over MAX_PENDING on the ASGI path)
+and the recent time per SQL query over MAX_DB_LATENCY, as measured by providers/metrics.py.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import namedtuple
+
+from django.core.cache import caches
+
+from providers import authentication, metrics
+from providers.utils import get_setting
+
+DEFAULT_CLASSES = {
+    'internal': {'RATE': None, 'SHED_AT': None},
+    'token': {'RATE': 50, 'BURST': 100, 'SHED_AT': 1.0},
+    'anon': {'RATE': 10, 'BURST': 20, 'SHED_AT': 0.8},
+}
+MAX_LOCAL_KEYS = 100000  # clients remembered per process before idle ones are forgotten
+
+Rejection = namedtuple('Rejection', ('status', 'detail', 'retry_after'))
+
+
+def is_enabled():
+    return get_setting('PROVIDERS_THROTTLE', 'ENABLED', False)
+
+
+def _token(authorization):
+    parts = (authorization or '').split()
+    if len(parts) == 2 and parts[0].lower() == 'token':
+        return parts[1]
+    return None
+
+
+def client_class(ip, authorization):
+    """
+    Returns the priority class of a request and the key of its bucket
+    """
+    if ip in get_setting('PROVIDERS_THROTTLE', 'INTERNAL_IPS', ()):
+        return 'internal', None
+    key = _token(authorization)
+    if key is not None:
+        row = authentication.cached_principal(key)
+        if row and row[2]:
+            return 'token', 'token:%s' % hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return 'anon', 'ip:%s' % ip
+
+
+class Buckets(object):
+    """
+    Token buckets in the shared cache, with this process' leases and rejections in front of them
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leases = {}  # key -> leased tokens not spent yet
+        self._blocked = {}  # key -> time until which the client is over its limit
+
+    def clear(self):
+        with self._lock:
+            self._leases.clear()
+            self._blocked.clear()
+
+    def take(self, key, rate, burst):
+        """
+        Takes a token from the client's bucket. Returns 0 when there was one, otherwise the seconds until there is
+        """
+        now = time.time()
+        with self._lock:
+            blocked_until = self._blocked.get(key, 0)
+            if blocked_until > now:
+                return blocked_until - now
+            if self._leases.get(key, 0) > 0:
+                self._leases[key] -= 1
+                return 0
+
+        granted, retry_after = self.lease(key, rate, burst, now)
+        with self._lock:
+            if len(self._leases) + len(self._blocked) > MAX_LOCAL_KEYS:
+                self._forget_idle(now)
+            if not granted:
+                self._blocked[key] = now + retry_after
+                return retry_after
+            self._blocked.pop(key, None)
+            self._leases[key] = self._leases.get(key, 0) + granted - 1
+            return 0
+
+    def lease(self, key, rate, burst, now):
+        """
+        Takes up to LEASE tokens from the shared bucket. Returns (tokens granted, seconds until the next one)
+        """
+        cache = caches[get_setting('PROVIDERS_THROTTLE', 'CACHE', 'default')]
+        cache_key = 'throttle:%s' % key
+        interval = 1.0 / rate
+        arrival = max(cache.get(cache_key) or now, now)
+        available = int((now + burst * interval - arrival) / interval + 1e-9)
+        if available < 1:
+            return 0, arrival + interval - burst * interval - now
+        granted = min(get_setting('PROVIDERS_THROTTLE', 'LEASE', 1), available)
+        arrival += granted * interval
+        cache.set(cache_key, arrival, int(math.ceil(arrival - now)) + 1)  # a drained bucket has refilled by then
+        return granted, 0
+
+    def _forget_idle(self, now):
+        self._blocked = dict((key, until) for key, until in self._blocked.items() if until > now)
+        self._leases = dict((key, tokens) for key, tokens in self._leases.items() if tokens > 0)
+
+
+buckets = Buckets()
+
+
+class RequestQueue(object):
+    """
+    Counts the requests this process is working on
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def __enter__(self):
+        with self._lock:
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.in_flight -= 1
+
+    def load(self):
+        return self.in_flight / float(get_setting('PROVIDERS_THROTTLE', 'MAX_IN_FLIGHT', 64))
+
+
+request_queue = RequestQueue()
+
+
+def load(queue_load):
+    """
+    How overloaded the process is, 1.0 at either threshold
+    """
+    latency = metrics.registry.recent_query_latency(get_setting('PROVIDERS_THROTTLE', 'LATENCY_WINDOW', 5))
+    return max(queue_load, latency / get_setting('PROVIDERS_THROTTLE', 'MAX_DB_LATENCY', 0.5))
+
+
+def check(ip, authorization, queue_load):
+    """
+    Decides on a request from its client IP and Authorization header. queue_load is how full the caller's
+    request queue is, 1.0 being full. Returns None when the request may go on, a Rejection otherwise
+    """
+    priority, key = client_class(ip, authorization)
+    config = get_setting('PROVIDERS_THROTTLE', 'CLASSES', DEFAULT_CLASSES)[priority]
+    shed_at = config.get('SHED_AT')
+    if shed_at is not None and load(queue_load) >= shed_at:
+        return Rejection(503, 'Service overloaded, try again later',
+                         get_setting('PROVIDERS_THROTTLE', 'SHED_RETRY_AFTER', 1))
+    if config.get('RATE'):
+        retry_after = buckets.take(key, config['RATE'], config.get('BURST', config['RATE']))
+        if retry_after:
+            return Rejection(429, 'Request was throttled', retry_after)
+    return None
+
+
+def retry_after_header(rejection):
+    return '%d' % max(1, math.ceil(rejection.retry_after))
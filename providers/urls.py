@@ -9,8 +9,15 @@ urlpatterns = [
     url(r'^providers/get_token$', views.GenerateTokenView.as_view()),
     url(r'^providers/(?P<pk>[0-9]+)$', views.ProviderDetailView.as_view()),
     url(r'^areas/$', views.ServiceAreaListView.as_view()),
+    url(r'^areas/bulk/$', views.ServiceAreaBulkView.as_view()),
     url(r'^areas/(?P<pk>[0-9]+)$', views.ServiceAreaDetailView.as_view()),
     url(r'^get_areas/$', views.ServiceAreaQueryView.as_view()),
+    url(r'^get_areas/batch/$', views.ServiceAreaBatchQueryView.as_view()),
+    url(r'^get_areas/shape/$', views.ServiceAreaShapeQueryView.as_view()),
+    url(r'^get_areas/trip/$', views.ServiceAreaTripQueryView.as_view()),
+    url(r'^get_providers/$', views.ProviderCoverageQueryView.as_view()),
+    url(r'^changes/$', views.ChangeFeedView.as_view()),
+    url(r'^metrics/$', views.MetricsView.as_view()),
     url(r'^docs/', include('rest_framework_docs.urls')),
 ]
 
@@ -1,6 +1,24 @@
+import json
+
+from django.conf import settings
 from rest_framework.exceptions import APIException
+from rest_framework.utils.encoders import JSONEncoder
 
 
 class InvalidArgumentsException(APIException):
     status_code = 400
-    default_detail = 'Invalid arguments'
\ No newline at end of file
+    default_detail = 'Invalid arguments'
+
+
+def get_setting(name, key, default=None):
+    """
+    Reads a single key out of one of the PROVIDERS_* settings dicts, falling back to default
+    """
+    return getattr(settings, name, {}).get(key, default)
+
+
+def dumps_json(data):
+    """
+    Same compact, non-ascii-escaped output JSONRenderer produces with the default settings
+    """
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
@@ -1,107 +1,225 @@
 import json
 
-from django.contrib.gis.geos import Point
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.views.generic import View
 
 # Create your views here.
 from rest_framework import generics
 from rest_framework import mixins
 from rest_framework import status
 from rest_framework import viewsets
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.exceptions import APIException
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from providers import bulk, changes, metrics, queries
+from providers.authentication import CachedTokenAuthentication
+from providers.mixins import ConditionalGetMixin, StreamingListMixin, ValuesListMixin
 from providers.models import Provider, ServiceArea
-from providers.serializers import ProviderSerializer, ServiceAreaSerializer, ServiceAreaQueryResponseSerializer, \
-    GenerateTokenQuerySerializer
-from providers.utils import InvalidArgumentsException
+from providers.pagination import KeysetPagination
+from providers.parsers import CSVPointsParser, NDJSONParser
+from providers.serializers import ProviderSerializer, ServiceAreaSerializer, GenerateTokenQuerySerializer
+from providers.utils import InvalidArgumentsException, get_setting
 
 # using django rest framework for creating the APIs
 
-class ProviderListView(generics.ListCreateAPIView):
+class ProviderListView(ConditionalGetMixin, ValuesListMixin, StreamingListMixin, generics.ListCreateAPIView):
     """
     Endpoint for creating new providers and fetching providers list. \n
-    Currency argument must be a 3-letter or a 3-digit code
+    Currency argument must be a 3-letter or a 3-digit code.
+    Send "cursor" or "page_size" to page through the list, or stream=json to stream it.
+    Send the ETag back in If-None-Match to get a 304 while the list is unchanged.
+    POST a list of providers to create them in bulk
     """
+    replica_methods = ('GET',)
     queryset = Provider.objects.all()
     serializer_class = ProviderSerializer
+    pagination_class = KeysetPagination
 
+    def get_serializer(self, *args, **kwargs):
+        if isinstance(kwargs.get('data', None), list):
+            kwargs['many'] = True
+        return super(ProviderListView, self).get_serializer(*args, **kwargs)
 
-class ProviderDetailView(generics.RetrieveUpdateDestroyAPIView):
+
+class ProviderDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Endpoint for updating provider and fetching provider details.
-    Currency argument must be a 3-letter or a 3-digit code
+    Currency argument must be a 3-letter or a 3-digit code.
+    GET honours If-None-Match and If-Modified-Since
     """
+    replica_methods = ('GET',)
     queryset = Provider.objects.all()
     serializer_class = ProviderSerializer
 
 
-class ServiceAreaListView(generics.ListCreateAPIView):
+class ServiceAreaListView(ConditionalGetMixin, ValuesListMixin, StreamingListMixin, generics.ListCreateAPIView):
     """
     Endpoint for creating service areas and fetching service areas list.
     Polygon argument should be a valid GeoJSON of type polygon.
+    Send "cursor" or "page_size" to page through the list, or stream=json / stream=geojson to stream it.
+    Send the ETag back in If-None-Match to get a 304 while the list is unchanged.
     Requires Authorization: Token <provider's token> header
     """
+    replica_methods = ('GET',)
     serializer_class = ServiceAreaSerializer
-    authentication_classes = (TokenAuthentication,)
+    pagination_class = KeysetPagination
+    geojson_geometry_field = 'polygon'
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
-        return ServiceArea.objects.filter(provider=Provider.objects.get(user_ptr=self.request.user))
+        # providers share their primary key with the authenticated user, no need to load the provider row
+        return ServiceArea.objects.filter(provider_id=self.request.user.pk)
 
     def perform_create(self, serializer):
-        serializer.save(provider=Provider.objects.get(user_ptr=self.request.user))
+        serializer.save(provider_id=self.request.user.pk)
 
 
-class ServiceAreaDetailView(generics.RetrieveUpdateDestroyAPIView):
+class ServiceAreaDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     """
         Endpoint for updating service area and fetching service area details.
         Polygon argument should be a valid GeoJSON of type polygon.
+        GET honours If-None-Match and If-Modified-Since.
         Requires Authorization: Token <provider's token> header
     """
+    replica_methods = ('GET',)
+
     def get_queryset(self):
-        return ServiceArea.objects.filter(provider=Provider.objects.get(user_ptr=self.request.user))
+        return ServiceArea.objects.filter(provider_id=self.request.user.pk)
 
     serializer_class = ServiceAreaSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
-    def perform_update(self, serializer):
-        serializer.save(provider=Provider.objects.get(user_ptr=self.request.user))
+
+class ServiceAreaBulkView(APIView):
+    """
+        Endpoint for bulk importing and exporting the provider's service areas.
+        POST a GeoJSON FeatureCollection (application/json) or one area per line (application/x-ndjson),
+        polygons may be GeoJSON, WKT or hex WKB. Invalid records are reported by index and skipped,
+        valid ones are committed chunk by chunk.
+        GET streams the areas as a FeatureCollection, or as NDJSON with "output=ndjson" ("wkb=1" for hex WKB polygons).
+        Requires Authorization: Token <provider's token> header
+    """
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    parser_classes = (JSONParser, NDJSONParser)
+
+    def get(self, request, *args, **kwargs):
+        fmt = request.query_params.get('output', 'geojson')
+        if fmt not in bulk.FORMATS:
+            raise InvalidArgumentsException
+        lines = bulk.export_areas(ServiceArea.objects.filter(provider_id=request.user.pk), fmt,
+                                  wkb=request.query_params.get('wkb') == '1',
+                                  chunk_size=get_setting('PROVIDERS_BULK', 'CHUNK_SIZE', 500))
+        content_type = 'application/x-ndjson' if fmt == 'ndjson' else 'application/vnd.geo+json'
+        return StreamingHttpResponse((line.encode('utf-8') for line in lines), content_type=content_type)
+
+    def post(self, request, *args, **kwargs):
+        records = request.data
+        if isinstance(records, dict):
+            records = records.get('features', [])
+        provider = Provider.objects.get(pk=request.user.pk)
+        created, errors = bulk.import_areas(provider, records,
+                                            chunk_size=get_setting('PROVIDERS_BULK', 'CHUNK_SIZE', 500),
+                                            chunk_commit=True)
+        response_status = status.HTTP_400_BAD_REQUEST if errors and not created else status.HTTP_201_CREATED
+        return Response({'created': created, 'errors': errors}, status=response_status)
 
 
 class ServiceAreaQueryView(APIView):
     """
         Endpoint for fetching service areas by lat/lng.
-        Accepts "lat" and "lng" query params
+        Accepts "lat" and "lng" query params. Send "limit" (and optionally "currency" and/or "language")
+        to get only the cheapest matching areas, ordered by price
 
     """
+    replica_methods = ('GET',)
+    throttle_methods = ('GET',)
+
     def get(self, request, *args, **kwargs):
         params = request.query_params
-        lat = params.get('lat', None)
-        lng = params.get('lng', None)
-        if lat and lng:
-            try:
-                lng = float(lng)
-                lat = float(lat)
-                pnt = Point(lng, lat)
-            except (TypeError,ValueError):
-                raise InvalidArgumentsException
-
-            areas = ServiceArea.objects.filter(polygon__intersects=pnt)
-            serializer = ServiceAreaQueryResponseSerializer(areas, many=True)
-            return Response(serializer.data)
-        else:
-            raise InvalidArgumentsException
+        lat, lng = queries.parse_point(params.get('lat', None), params.get('lng', None))
+        quote = queries.parse_quote(params.get('limit', None), params.get('currency', None),
+                                    params.get('language', None))
+        return Response(queries.areas_for_point(lat, lng, quote))
+
+
+class ServiceAreaBatchQueryView(APIView):
+    """
+        Endpoint for fetching service areas for many lat/lng points at once.
+        Accepts a JSON array of [lat, lng] pairs or {"lat": .., "lng": ..} objects,
+        or a text/csv body with one "lat,lng" line per point
+    """
+    replica_methods = ('POST',)  # read only despite the method
+    throttle_methods = ('POST',)
+    parser_classes = (JSONParser, CSVPointsParser)
+
+    def post(self, request, *args, **kwargs):
+        return Response(queries.areas_for_points(queries.parse_points(request.data)))
+
+
+class ServiceAreaShapeQueryView(APIView):
+    """
+        Endpoint for fetching the service areas intersecting a route or region.
+        GET accepts a "bbox" query param (min_lng,min_lat,max_lng,max_lat), POST a GeoJSON
+        LineString or Polygon. "limit", "currency" and "language" work as on get_areas
+    """
+    replica_methods = ('GET', 'POST')  # read only despite the method
+    throttle_methods = ('GET', 'POST')
+
+    def get(self, request, *args, **kwargs):
+        return self.respond(queries.parse_bbox(request.query_params.get('bbox', None)))
+
+    def post(self, request, *args, **kwargs):
+        return self.respond(queries.parse_shape(request.data))
+
+    def respond(self, shape):
+        params = self.request.query_params
+        quote = queries.parse_quote(params.get('limit', None), params.get('currency', None),
+                                    params.get('language', None))
+        return Response(queries.areas_for_shape(shape, quote))
+
+
+class ServiceAreaTripQueryView(APIView):
+    """
+        Endpoint for fetching the service areas of providers covering both ends of a trip.
+        Accepts "pickup_lat", "pickup_lng", "dropoff_lat" and "dropoff_lng" query params
+    """
+    replica_methods = ('GET',)
+    throttle_methods = ('GET',)
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        pickup = queries.parse_point(params.get('pickup_lat', None), params.get('pickup_lng', None))
+        dropoff = queries.parse_point(params.get('dropoff_lat', None), params.get('dropoff_lng', None))
+        return Response(queries.areas_for_trip(pickup, dropoff))
+
+
+class ProviderCoverageQueryView(APIView):
+    """
+        Endpoint for fetching the providers serving a lat/lng.
+        Accepts "lat" and "lng" query params, and "max_price" to only count areas priced at most that
+    """
+    replica_methods = ('GET',)
+    throttle_methods = ('GET',)
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        lat, lng = queries.parse_point(params.get('lat', None), params.get('lng', None))
+        return Response(queries.providers_for_point(lat, lng, queries.parse_price(params.get('max_price', None))))
+
 
 class GenerateTokenView(APIView):
     """
         Generate token by providing email
     """
+    replica_methods = ('POST',)  # read only despite the method
+    throttle_methods = ('POST',)
 
     serializer_class = GenerateTokenQuerySerializer
     def post(self, request, *args, **kwargs):
@@ -116,3 +234,31 @@ class GenerateTokenView(APIView):
         else:
             raise InvalidArgumentsException
 
+
+class ChangeFeedView(APIView):
+    """
+        Streams the provider and service area changes made after the "since" cursor, oldest first,
+        at most "limit" of them. Send the "next" cursor of the response as "since" to read on; without
+        "since" the feed starts at the oldest change kept. Only answers requests from PROVIDERS_CHANGES["ALLOWED_IPS"]
+    """
+    authentication_classes = ()
+
+    def get(self, request, *args, **kwargs):
+        if request.META.get('REMOTE_ADDR') not in get_setting('PROVIDERS_CHANGES', 'ALLOWED_IPS', ('127.0.0.1',)):
+            return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+        cursor = changes.parse_cursor(request.query_params.get('since', None))
+        limit = changes.parse_limit(request.query_params.get('limit', None))
+        return StreamingHttpResponse((chunk.encode('utf-8') for chunk in changes.feed(cursor, limit)),
+                                     content_type='application/json')
+
+
+class MetricsView(View):
+    """
+        Per-endpoint latency and SQL histograms of this worker in the Prometheus text format.
+        Only answers requests from PROVIDERS_METRICS["ALLOWED_IPS"]
+    """
+
+    def get(self, request, *args, **kwargs):
+        if request.META.get('REMOTE_ADDR') not in get_setting('PROVIDERS_METRICS', 'ALLOWED_IPS', ('127.0.0.1',)):
+            return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+        return HttpResponse(metrics.registry.exposition(), content_type='text/plain; version=0.0.4')